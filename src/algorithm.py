@@ -1,19 +1,52 @@
 # SPDX-License-Identifier: BSD-3-Clause
 
-import random as rd
 import numpy as np
 import math
-from noise import snoise2
-from config import Config
+from config import Color, Config
+from sampling import AngularSampler, wrapped_standard_deviation
+from noise_bank import NoiseBank
+from occupancy import OccupancyGrid
+from registry import get_algorithm
 
 class Algorithm():
-    
-    def __init__(self, graph_p, loop_closure_probability_p = 10):
+    # Number of mine levels built at once (about 40 nodes per level)
+    MINE_LEVELS_PER_BATCH = 256
+    # Number of nodes expanded again when the stall watchdog restarts the gaussian_perlin growth
+    RESEED_FRONTIER_SIZE = 64
+
+    def __init__(self, graph_p, loop_closure_probability_p = 10, stream_p=None, random_p=None, generation_size_p=None, nb_nodes_p=None, three_dimension_p=None, growth_mode_p=None):
+        """
+        random_p is the np.random.Generator of this graph (every draw of the algorithm comes from it).
+        generation_size_p (box centered on the origin), nb_nodes_p, three_dimension_p and growth_mode_p
+        default to GENERATION_SIZE, NB_NODES, THREE_DIMENSION_GENERATION and GROWTH_MODE.
+        """
         self.graph = graph_p
+        self.generation_size = tuple(generation_size_p) if generation_size_p is not None else Config.GENERATION_SIZE.value
+        self.max_nodes = nb_nodes_p if nb_nodes_p is not None else Config.NB_NODES.value
+        self.three_dimension = three_dimension_p if three_dimension_p is not None else Config.THREE_DIMENSION_GENERATION.value
+        self.growth_mode = growth_mode_p if growth_mode_p is not None else Config.GROWTH_MODE.value
+        self.random = random_p if random_p is not None else np.random.default_rng()
+        self.stream = stream_p
         self.iterations = 0
         self.loop_closure_probability = loop_closure_probability_p
         self.angles = np.arange(360)
+        # Standard deviation given as a fraction of a full turn, converted to the wrapped normal distribution
+        self.sampler = AngularSampler(wrapped_standard_deviation(Config.STANDARD_DEVIATION.value), random_p=self.random)
+        # The noise bank is built on first use from its seed (saved in the checkpoints)
+        self.noise_seed = int(self.random.integers(2**32))
+        self._noise_bank = None
+        self.occupancy = OccupancyGrid(self.generation_size, Config.OCCUPANCY_CELL_SIZE.value, Config.OCCUPANCY_EXEMPT_HOPS.value) if Config.OCCUPANCY_GRID.value else None
         self.current_node_index=1
+        self.frontier_end = None
+        self.empty_expansions = 0
+        # Stall watchdog of gaussian_perlin: distance factor of the children, recoveries without any new node
+        # and oldest node id read again after a restart (kept in memory by the stream)
+        self.radius_scale = 1.0
+        self.failed_recoveries = 0
+        self.recovery_nb_nodes = None
+        self.reseed_floor = None
+        self.restart_range = None
+        self.growth = {'status': "running", 'attempts': 0, 'rejects': 0, 'retries': 0, 'reseeds': 0, 'radius_shrinks': 0}
         self.stop_algorithm = False
         self.max_node_distance = 0
 
@@ -22,35 +55,112 @@ class Algorithm():
         """
         Main algorithm generation
         Starting node already defined
+        The algorithm is looked up (and its module imported) in the registry.
+        """
+        if self.occupancy is not None:
+            self.occupancy.mark(self.graph.get_ids(), self.graph.get_parents(), self.graph.get_positions())
+        get_algorithm(selected_algorithm)(self)
+
+
+    def start_gaussian_perlin(self):
         """
-        if selected_algorithm=="gaussian_perlin":
-            # Nodes around the starting node
-            first_node_probability = self.perlin_distribution_circle()
-            nb_nodes = rd.randint(2, self.graph.max_created_node_on_circle)
-            for i in range(nb_nodes):
-                chosen_angle = np.random.choice(self.angles, p=first_node_probability)
-                self.graph.add_node(node_id_p=i+1, parent_p=0, coordinates_p=self.get_coordinates_on_circle(radius_p=self.graph.nodes[0].radius, theta_p=chosen_angle, index_p=0), radius_p=rd.uniform(1.0, Config.MAX_RADIUS_NODE.value), active_p=True)
-                self.graph.nodes[0].add_edge(i+1)
-            # The graph
+        Nodes around the starting node, then the Gaussian-Perlin growth
+        """
+        profile_id, first_node_probability = self.perlin_distribution_circle()
+        nb_nodes = int(self.random.integers(2, self.graph.max_created_node_on_circle, endpoint=True))
+        for i, chosen_angle in enumerate(self.sampler.sample_table(first_node_probability, nb_nodes, key_p=profile_id)):
+            self.occupy(self.graph.add_node(node_id_p=i+1, parent_p=0, coordinates_p=self.get_coordinates_on_circle(radius_p=self.graph.nodes[0].radius, theta_p=chosen_angle, index_p=0), radius_p=self.random.uniform(1.0, Config.MAX_RADIUS_NODE.value), active_p=True))
+        # The graph
+        if self.growth_mode == "frontier":
+            from array_graph import ArrayGraph
+
+            if not isinstance(self.graph, ArrayGraph):
+                # The object storage rebuilds its arrays from every node at each access: quadratic growth
+                print(f"{Color.WARNING.value}\t-The frontier growth mode needs GRAPH_STORAGE = \"array\": sequential growth{Color.ENDC.value}")
+                self.growth_mode = "sequential"
+        if self.growth_mode == "frontier":
+            self.gaussian_perlin_frontier()
+        else:
             self.gaussian_perlin()
-        
-        if selected_algorithm == "mine":
-            # Nodes around the starting node
-            first_node_probability = self.perlin_distribution_circle()
-            chosen_angle = np.random.choice(self.angles, p=first_node_probability)
-            self.graph.add_node(node_id_p=1, parent_p=0, coordinates_p=self.get_coordinates_on_circle(radius_p=self.graph.nodes[0].radius, theta_p=chosen_angle, index_p=0), radius_p=rd.uniform(1.0, Config.MAX_RADIUS_NODE.value), active_p=True)
-            self.graph.nodes[0].add_edge(1)
-            # The graph
-            self.mine()
 
 
-    def gaussian_perlin(self):
+    def start_mine(self):
+        """
+        Node next to the starting node, then the mine growth
+        """
+        profile_id, first_node_probability = self.perlin_distribution_circle()
+        chosen_angle = self.sampler.sample_table(first_node_probability, key_p=profile_id)[0]
+        self.occupy(self.graph.add_node(node_id_p=1, parent_p=0, coordinates_p=self.get_coordinates_on_circle(radius_p=self.graph.nodes[0].radius, theta_p=chosen_angle, index_p=0), radius_p=self.random.uniform(1.0, Config.MAX_RADIUS_NODE.value), active_p=True))
+        # The graph
+        self.mine()
+
+
+    def resume(self):
+        """
+        Resume an interrupted generation from the last checkpoint of the graph stream
+        """
+        state = self.stream.resume(self.graph)
+        self.random.bit_generator.state = state['random_state']
+        self.current_node_index = state['current_node_index']
+        self.max_node_distance = state['max_node_distance']
+        self.frontier_end = state['frontier_end']
+        self.empty_expansions = state.get('empty_expansions', 0)
+        for attribute in ('radius_scale', 'failed_recoveries', 'recovery_nb_nodes', 'reseed_floor', 'restart_range', 'growth'):
+            setattr(self, attribute, state.get(attribute, getattr(self, attribute)))
+        self.noise_seed = state['noise_seed']
+        self._noise_bank = None
+        self.occupancy = state.get('occupancy', self.occupancy)
+        if state['completed']:
+            return
+        if state['algorithm'] == "gaussian_perlin":
+            self.gaussian_perlin(resume_p=True)
+        elif state['algorithm'] == "gaussian_perlin_frontier":
+            self.gaussian_perlin_frontier(resume_p=True)
+        elif state['algorithm'] == "mine":
+            self.mine(origin_id_p=state['origin_id'])
+
+
+    def checkpoint(self, algorithm_p, watermark_p, origin_id_p=None, completed_p=False):
+        """
+        Stream the new nodes to disk and save the state needed to resume the generation.
+        watermark_p is the oldest node id the algorithm still needs to read.
+        """
+        state = {
+            'algorithm': algorithm_p,
+            'completed': completed_p,
+            'current_node_index': self.current_node_index,
+            'max_node_distance': self.max_node_distance,
+            'frontier_end': self.frontier_end,
+            'empty_expansions': self.empty_expansions,
+            'radius_scale': self.radius_scale,
+            'failed_recoveries': self.failed_recoveries,
+            'recovery_nb_nodes': self.recovery_nb_nodes,
+            'reseed_floor': self.reseed_floor,
+            'restart_range': self.restart_range,
+            'growth': self.growth,
+            'noise_seed': self.noise_seed,
+            'origin_id': origin_id_p,
+            'random_state': self.random.bit_generator.state,
+            'occupancy': self.occupancy,
+        }
+        self.stream.flush(self.graph, state, watermark_p)
+
+
+    def gaussian_perlin(self, resume_p=False):
         """
         Execute the Gaussian-Perlin algorithm
         """
-        self.current_node_index = self.graph.nb_nodes-1
-        while self.graph.nb_nodes < Config.NB_NODES.value:
+        if not resume_p:
+            self.current_node_index = self.graph.nb_nodes-1
+        while self.graph.nb_nodes < self.max_nodes:
         # for i in range(self.min_nodes):           
+            if self.stream is not None and self.stream.should_flush(self.graph):
+                # Parents ids never decrease along the frontier: the grand parent of the current node is the oldest node still read
+                parent_id = self.graph.nodes[self.current_node_index].parent
+                grand_parent_id = self.graph.nodes[parent_id].parent if parent_id is not None else None
+                watermark = min(node_id for node_id in (self.current_node_index, parent_id, grand_parent_id, self.reseed_floor) if node_id is not None)
+                self.checkpoint("gaussian_perlin", watermark)
+
             current_node = self.graph.nodes[self.current_node_index]
             self.max_node_distance = max(self.max_node_distance, current_node.coordinates['x'], current_node.coordinates['y'], current_node.coordinates['z'])
 
@@ -60,211 +170,443 @@ class Algorithm():
             if parent_node.id:
                 grand_parent_node = self.graph.nodes[self.graph.nodes[parent_node.id].parent]
                 angle_grand_parent = self.calculate_angle(grand_parent_node, parent_node)
-                
-                probability_array = np.zeros((3,360))
-                probability_final = np.zeros((1,360))
-
-                probability_array[0] = self.gaussian_distribution_circle(360-angle_parent)
-                probability_array[1] = self.gaussian_distribution_circle(360-angle_grand_parent)
-                probability_array[2] = self.perlin_distribution_circle()
-            
-                for i in range(360):
-                    probability_final[0][i] = (probability_array[0][i]+probability_array[1][i])/2
 
+                # Mixture of the parent and grand parent directions
+                directions = (angle_parent, angle_grand_parent)
 
             else:
-                # probability_array = np.zeros((1,360))
-                probability_final = np.zeros((1,360))
-
-                probability_final[0] = self.gaussian_distribution_circle(360-angle_parent)
-                # probability_array[1] = self.perlin_distribution_circle()
-            
-                # for i in range(360):
-                #     probability_final[0][i] = (probability_array[0][i]+probability_array[1][i])/2
+                directions = (angle_parent,)
             
-            # Choose an angle based on the distribution
-            nb_nodes = rd.randint(0,self.graph.max_created_node_on_circle)
-            for i in range(nb_nodes):
-                if self.graph.nb_nodes < Config.NB_NODES.value:    
-                    chosen_angle = np.random.choice(self.angles, p=probability_final[0])
-                    new_node_coordinates = self.get_coordinates_on_circle(radius_p=self.graph.nodes[self.current_node_index].radius, theta_p=chosen_angle, index_p=self.current_node_index)
+            # Choose the angles based on the distribution
+            nb_nodes = int(self.random.integers(0, self.graph.max_created_node_on_circle, endpoint=True))
+            for chosen_angle in self.sampler.sample_mixture(directions, nb_p=nb_nodes):
+                if self.graph.nb_nodes < self.max_nodes:    
+                    new_node_coordinates = self.get_coordinates_on_circle(radius_p=self.graph.nodes[self.current_node_index].radius*self.radius_scale, theta_p=chosen_angle, index_p=self.current_node_index)
+                    self.growth['attempts'] += 1
                     
-                    if abs(new_node_coordinates[0]) <= Config.GENERATION_SIZE.value[0]/2 and abs(new_node_coordinates[1]) <= Config.GENERATION_SIZE.value[1]/2 and abs(new_node_coordinates[2]) <= Config.GENERATION_SIZE.value[2]/2:
-                        self.graph.add_node(node_id_p=self.graph.nb_nodes, parent_p=self.current_node_index, coordinates_p=new_node_coordinates, radius_p=rd.uniform(1.0, Config.MAX_RADIUS_NODE.value), active_p=True)
+                    if abs(new_node_coordinates[0]) <= self.generation_size[0]/2 and abs(new_node_coordinates[1]) <= self.generation_size[1]/2 and abs(new_node_coordinates[2]) <= self.generation_size[2]/2:
+                        radius = self.random.uniform(1.0, Config.MAX_RADIUS_NODE.value)
+                        if self.occupancy is not None:
+                            redraw = lambda: self.get_coordinates_on_circle(radius_p=self.graph.nodes[self.current_node_index].radius*self.radius_scale, theta_p=self.sampler.sample_mixture(directions)[0], index_p=self.current_node_index)
+                            new_node_coordinates = self.place_without_collision(self.current_node_index, new_node_coordinates, radius, redraw)
+                        if new_node_coordinates is not None:
+                            self.occupy(self.graph.add_node(node_id_p=self.graph.nb_nodes, parent_p=self.current_node_index, coordinates_p=new_node_coordinates, radius_p=radius, active_p=True))
+                        else:
+                            self.growth['rejects'] += 1
+                    else:
+                        self.growth['rejects'] += 1
                             
             self.current_node_index += 1
+            if self.restart_range is not None and self.current_node_index == self.restart_range[0]:
+                # End of the restarted nodes: continue with the nodes they created
+                self.current_node_index, self.restart_range = self.restart_range[1], None
 
-            if self.current_node_index >= len(self.graph.nodes):
+            if self.current_node_index >= self.graph.nb_nodes:
                 self.current_node_index -= 1
+                self.empty_expansions += 1
+                if self.empty_expansions >= Config.STALL_LIMIT.value:
+                    # The last node cannot grow anymore: restart from a random node, or give up
+                    restart = self.recover_from_stall()
+                    if restart is None:
+                        break
+                    self.current_node_index, self.restart_range = restart[0], (restart[1], self.graph.nb_nodes)
                 continue
+            self.empty_expansions = 0
+            self.radius_scale = 1.0
+        self.end_growth()
 
 
-    def gaussian_distribution_circle(self, direction_p):
+    def gaussian_perlin_frontier(self, resume_p=False):
         """
-        Return a Gaussian distribution array based on a given direction (degree).
-        The distribution is returned in a list of 360 elements (1 element per degree).
+        Execute the Gaussian-Perlin algorithm expanding the whole frontier (the nodes created by the
+        previous iteration, ids current_node_index to frontier_end) at once with array operations.
+        Same distributions as gaussian_perlin, in the same node order.
         """
-        direction = direction_p
-        # Convert the input angle to a value between 0 and 1
-        direction = direction % 360 / 360.0
+        if not resume_p:
+            self.current_node_index = self.graph.nb_nodes-1
+            self.frontier_end = self.graph.nb_nodes
+        while self.graph.nb_nodes < self.max_nodes:
+            frontier = np.arange(self.current_node_index, self.frontier_end)
+            rows = self.graph.get_rows(frontier)
+            parents = self.graph.get_parents()[rows]
+            parent_rows = self.graph.get_rows(parents)
+            grand_parents = self.graph.get_parents()[parent_rows]
+            if self.stream is not None and self.stream.should_flush(self.graph):
+                # The oldest node still read is a node of the frontier, a parent or a grand parent
+                watermark = min(frontier[0], parents.min(), grand_parents[grand_parents >= 0].min(initial=frontier[0]))
+                self.checkpoint("gaussian_perlin_frontier", watermark)
+                rows, parent_rows = self.graph.get_rows(frontier), self.graph.get_rows(parents)
+
+            positions = self.graph.get_positions()
+            current = positions[rows]
+            parent = positions[parent_rows]
+            self.max_node_distance = max(self.max_node_distance, current.max())
+
+            # Directions of the parent and of the grand parent (not used when the parent is the root)
+            angle_parent = np.degrees(np.arctan2(current[:, 1] - parent[:, 1], current[:, 0] - parent[:, 0]))
+            directions = np.full((len(frontier), 2), np.nan)
+            directions[:, 0] = angle_parent
+            has_grand_parent = parents != 0
+            grand_parent = positions[self.graph.get_rows(grand_parents[has_grand_parent])]
+            directions[has_grand_parent, 1] = np.degrees(np.arctan2(parent[has_grand_parent, 1] - grand_parent[:, 1], parent[has_grand_parent, 0] - grand_parent[:, 0]))
+
+            # Children of every frontier node, in the order of the sequential algorithm
+            counts = self.random.integers(0, self.graph.max_created_node_on_circle, len(frontier), endpoint=True)
+            origins = np.repeat(np.arange(len(frontier)), counts)
+            radius = self.graph.get_radii()[rows][origins]*self.radius_scale
+            coordinates = self.frontier_children(current[origins], directions[origins], radius)
+            self.growth['attempts'] += len(origins)
+
+            if self.occupancy is None:
+                inside = np.flatnonzero(self.inside_generation(coordinates))
+                self.growth['rejects'] += len(origins) - len(inside)
+                inside = inside[:self.max_nodes - self.graph.nb_nodes]
+                radii = self.random.uniform(1.0, Config.MAX_RADIUS_NODE.value, len(inside))
+            else:
+                radii = self.random.uniform(1.0, Config.MAX_RADIUS_NODE.value, len(origins))
+                inside = self.inside_generation(coordinates)
+                tested = np.flatnonzero(inside)
+                collided = tested[self.occupancy.collides(frontier[origins[tested]], coordinates[tested], radii[tested])]
+                # Colliding candidates are drawn again, like in place_without_collision, until they are
+                # inside the generation box and free
+                for retry in range(Config.OCCUPANCY_RETRIES.value):
+                    if not len(collided):
+                        break
+                    self.growth['retries'] += len(collided)
+                    coordinates[collided] = self.frontier_children(current[origins[collided]], directions[origins[collided]], radius[collided])
+                    redrawn_inside = self.inside_generation(coordinates[collided])
+                    retested = collided[redrawn_inside]
+                    collided = np.concatenate((collided[~redrawn_inside], retested[self.occupancy.collides(frontier[origins[retested]], coordinates[retested], radii[retested])]))
+                inside[collided] = False
+                # Candidates of the same batch overlapping each other: the first one is kept
+                inside = np.flatnonzero(inside)
+                conflicted = self.occupancy.conflicts(origins[inside], coordinates[inside], radii[inside])
+                inside = inside[~conflicted]
+                self.occupancy.count(len(tested), len(collided) + np.count_nonzero(conflicted))
+                self.growth['rejects'] += len(origins) - len(inside)
+                inside = inside[:self.max_nodes - self.graph.nb_nodes]
+                radii = radii[inside]
+            first_id = self.graph.nb_nodes
+            self.graph.add_nodes(np.arange(first_id, first_id + len(inside)), frontier[origins[inside]], coordinates[inside], radii)
+            if self.occupancy is not None:
+                self.occupancy.mark(np.arange(first_id, first_id + len(inside)), frontier[origins[inside]], coordinates[inside])
+
+            if len(inside):
+                self.current_node_index, self.frontier_end = first_id, self.graph.nb_nodes
+                self.empty_expansions = 0
+                self.radius_scale = 1.0
+            else:
+                # Nothing created: expand the last node again
+                self.current_node_index, self.frontier_end = self.graph.nb_nodes-1, self.graph.nb_nodes
+                self.empty_expansions += 1
+                if self.empty_expansions >= Config.STALL_LIMIT.value:
+                    # The last node cannot grow anymore: restart from random nodes, or give up
+                    restart = self.recover_from_stall()
+                    if restart is None:
+                        break
+                    self.current_node_index, self.frontier_end = restart
+        self.end_growth()
+
+
+    def end_growth(self):
+        """
+        Set the final status of the gaussian_perlin growth (unless it gave up).
+        """
+        if self.growth['status'] == "running":
+            self.growth['status'] = "complete"
 
-        # Create an array of angles from 0 to 1
-        angles = np.linspace(0, 1, 360)
 
-        # Generate a Gaussian distribution centered at the input angle
-        gaussian_values = np.exp(-0.5 * ((angles - direction) / Config.STANDARD_DEVIATION.value) ** 2)
+    def recover_from_stall(self):
+        """
+        Stall watchdog of gaussian_perlin, called once the last node was expanded STALL_LIMIT times in a row
+        without any child (e.g. every candidate outside the generation box).
+        Return the (first id, end id) range of nodes to expand again, starting at a random node. After a
+        restart that created less than STALL_LIMIT nodes, the distance of the children is also multiplied
+        by STALL_RADIUS_FACTOR. Return None, with the 'stalled' status, after STALL_MAX_RECOVERIES such
+        restarts in a row.
+        """
+        self.empty_expansions = 0
+        # A restart that created less than STALL_LIMIT nodes did not recover the growth
+        recovered = self.recovery_nb_nodes is None or self.graph.nb_nodes - self.recovery_nb_nodes >= Config.STALL_LIMIT.value
+        self.failed_recoveries = 1 if recovered else self.failed_recoveries + 1
+        self.recovery_nb_nodes = self.graph.nb_nodes
+        if self.failed_recoveries > Config.STALL_MAX_RECOVERIES.value:
+            self.growth['status'] = "stalled"
+            return None
+        if self.failed_recoveries > 1:
+            self.radius_scale *= Config.STALL_RADIUS_FACTOR.value
+            self.growth['radius_shrinks'] += 1
+
+        # Nodes expanded from the restart on must have their parent and grand parent in memory (streamed graph)
+        ids, parents = self.graph.get_ids(), self.graph.get_parents()
+        known = parents >= ids[0]
+        grand_parents = np.full(len(parents), -1, dtype=np.int64)
+        grand_parents[known] = parents[self.graph.get_rows(parents[known])]
+        # The root (no parent) cannot be expanded again either
+        readable = known & ((grand_parents < 0) | (grand_parents >= ids[0]))
+        # Every node after the restart is expanded again: restart after the last node that cannot be read
+        first_row = min(len(ids) - int(np.argmin(readable[::-1])), len(ids) - 1) if not readable.all() else 0
+        row = int(self.random.integers(first_row, len(ids)))
+        end_row = min(row + self.RESEED_FRONTIER_SIZE, len(ids))
+        read = np.concatenate((ids[row:], parents[row:], grand_parents[row:]))
+        self.reseed_floor = int(min(read[read >= 0].min(), self.reseed_floor if self.reseed_floor is not None else np.inf))
+        self.growth['reseeds'] += 1
+        return int(ids[row]), int(ids[end_row - 1]) + 1
+
+
+    def frontier_children(self, centers_p, directions_p, radii_p):
+        """
+        Return the coordinates of one child for every row of the (n, 3) centers_p, at the distance radii_p
+        in a direction drawn from the mixture of the (n, 2) directions_p (degrees, NaN when unused).
+        """
+        coordinates = np.empty((len(centers_p), 3))
+        if not len(centers_p):
+            return coordinates
+        theta = np.radians(self.sampler.sample_mixtures(directions_p, np.ones(len(centers_p), dtype=np.int64)))
+        coordinates[:, 0] = centers_p[:, 0] + radii_p * np.cos(theta)
+        coordinates[:, 1] = centers_p[:, 1] + radii_p * np.sin(theta)
+        if self.three_dimension:
+            step_down = self.random.random(len(centers_p)) < Config.Z_AXIS_LAYER_PROB.value/100
+            coordinates[:, 2] = np.where(step_down, centers_p[:, 2] - Config.Z_AXIS_LAYER_STEP.value, centers_p[:, 2] + self.random.normal(Config.Z_AXIS_GAUSSIAN_MEAN.value, 0.1, len(centers_p)))
+            coordinates[step_down, :2] *= Config.Z_AXIS_STEP_DOWN_XY_SHIFT.value
+        else:
+            coordinates[:, 2] = 0.0
+        return coordinates
 
-        # Normalize the values so they sum to 1
-        gaussian_values = gaussian_values / gaussian_values.sum()
 
-        return gaussian_values
+    def inside_generation(self, coordinates_p):
+        """
+        Return whether the coordinates (one point or an (n, 3) array) are inside the generation box.
+        """
+        return np.all(np.abs(coordinates_p) <= np.asarray(self.generation_size, dtype=np.float64)/2, axis=-1)
 
 
-    def perlin_distribution_circle(self):
+    def occupy(self, node_p):
         """
-        Return a Perlin distribution.
-        The distribution is returned in a list of 360 elements (1 element per degree).
+        Mark a new node in the occupancy grid (if any) and return it.
         """
-        scale=rd.uniform(0.1, Config.MAX_SCALE.value)
-        octaves=rd.uniform(0.1, Config.MAX_OCTAVES.value)
-        persistence=rd.uniform(0.1, Config.MAX_PERSISTENCE.value)
-        lacunarity=rd.uniform(0.1, Config.MAX_LACUNARITY.value)
-        x = np.linspace(0, 1, 360)
-        y = np.linspace(0, 1, 360)
-        
-        # Create an empty array to store the noise values
-        noise_values = np.empty(360)
+        if self.occupancy is not None:
+            self.occupancy.mark([node_p.id], [node_p.parent], [node_p.get_list_coordinates()])
+        return node_p
 
-        # Generate perlin noise for each point in the circle
-        for i in range(360):
-            noise_values[i] = snoise2(x[i]*scale, y[i]*scale, 1, octaves, persistence, lacunarity)
 
-        # Normalize the values so they sum to 1
-        noise_values = noise_values - noise_values.min()  # Make the values positive
-        noise_values = noise_values / noise_values.sum()  # Normalize to sum to 1
-        return noise_values
+    def place_without_collision(self, parent_id_p, coordinates_p, radius_p, redraw_p):
+        """
+        Return coordinates_p, or new coordinates drawn with redraw_p (at most OCCUPANCY_RETRIES times) while
+        the sphere of the new child of parent_id_p collides with the occupancy grid.
+        Return None if every draw collides or leaves the generation box.
+        """
+        coordinates = coordinates_p
+        for retry in range(Config.OCCUPANCY_RETRIES.value + 1):
+            if retry:
+                coordinates = redraw_p()
+                self.growth['retries'] += 1
+            if self.inside_generation(coordinates) and not self.occupancy.collides_one(parent_id_p, coordinates, radius_p):
+                self.occupancy.count(1, 0)
+                return coordinates
+        self.occupancy.count(1, 1)
+        return None
 
 
-    def mine(self):
-        """
-        MINE CONTEXT
-        Create a graph that looks like a mine structure
-        """
-        origin = list(self.graph.nodes.values())[-1]
-        self.current_node_index = self.graph.nb_nodes-1
-        number_nodes = self.graph.nb_nodes
-        origin = self.graph.nodes[self.current_node_index]
-
-        while number_nodes < Config.NB_NODES.value:
-            nb_branch = rd.randint(1,3)
-            for i in range(nb_branch):
-                # Create a main branch
-                branch = self.mine_add_main_branch(origin)
-                if branch:
-                    # Add sub branches (harvesting sites) to main branch
-                    break_point_sub = self.mine_add_sub_branches(branch)
-                    if break_point_sub:
-                        continue
-                    else:
-                        return 1
-                else:
-                    return 1
-                
-            if not Config.THREE_DIMENSION_GENERATION.value:
-                return 1
-            
-            else:
-                if abs(origin.coordinates['x']) <= Config.GENERATION_SIZE.value[0]/2 and abs(origin.coordinates['y']) <= Config.GENERATION_SIZE.value[1]/2 and abs(origin.coordinates['z']) <= Config.GENERATION_SIZE.value[2]/2:
-                    origin = self.graph.add_node(node_id_p=self.graph.nb_nodes, parent_p= origin.id, coordinates_p=(origin.coordinates['x'], origin.coordinates['y'], origin.coordinates['z'] - Config.Z_AXIS_LAYER_STEP.value ), radius_p=rd.uniform(1.0, Config.MAX_RADIUS_NODE.value))
+    @property
+    def noise_bank(self):
+        if self._noise_bank is None:
+            self._noise_bank = NoiseBank(Config.NOISE_BANK_SIZE.value, 360, self.noise_seed, Config.MAX_SCALE.value, Config.MAX_OCTAVES.value, Config.MAX_PERSISTENCE.value, Config.MAX_LACUNARITY.value)
+        return self._noise_bank
 
 
-    def mine_add_main_branch(self, origin_p):
+    def perlin_distribution_circle(self):
         """
-        MINE CONTEXT
-        Create a main branch based on the position of the origin
-        """
-        size_branch = rd.randint(2,10)
-        branch = []
-        last_node = None
-        shift = None
-        for i in range(size_branch):
-            # Check if number of desired nodes reached
-            if self.graph.nb_nodes >= Config.NB_NODES.value:
-                return 0
-            if i == 0:
-                chosen_angle = np.random.choice(self.angles)
-                shift = (rd.randint(1,5)*rd.random()*([-1,1][rd.randrange(2)]), rd.randint(1,5)*rd.random()*([-1,1][rd.randrange(2)]))
-                coord_x = origin_p.coordinates['x']+shift[0]
-                coord_y = origin_p.coordinates['y']+shift[1]
-                last_node = self.graph.add_node(node_id_p=self.graph.nb_nodes, parent_p=origin_p.id, coordinates_p=(coord_x, coord_y, origin_p.coordinates['z']), radius_p=rd.uniform(1.0, Config.MAX_RADIUS_NODE.value), active_p=True)
-                branch.append(last_node)
-            else:
-                coord_x = origin_p.coordinates['x']+shift[0]*i
-                coord_y = origin_p.coordinates['y']+shift[1]*i
-                if abs(coord_x) <= Config.GENERATION_SIZE.value[0]/2 and abs(coord_y) <= Config.GENERATION_SIZE.value[1]/2 and abs(origin_p.coordinates['z']) <= Config.GENERATION_SIZE.value[2]/2:
-                    last_node = self.graph.add_node(node_id_p=self.graph.nb_nodes, parent_p=last_node.id, coordinates_p=(coord_x,coord_y,origin_p.coordinates['z']), radius_p=rd.uniform(1.0, Config.MAX_RADIUS_NODE.value), active_p=True)
-                    branch.append(last_node)
-        return branch
+        Return a Perlin distribution picked at random in the noise bank, as (profile id, distribution).
+        The distribution is returned in a list of 360 elements (1 element per degree).
+        """
+        profile_id = int(self.random.integers(len(self.noise_bank)))
+        return profile_id, self.noise_bank.profile(profile_id)
 
 
-    def mine_add_sub_branches(self, branch_p):
+    def mine(self, origin_id_p=None):
         """
         MINE CONTEXT
-        Add small branches along an given main branch (list of nodes)
-        """
-        for main_branch_node in branch_p:
-            # Add sub branches of random size
-            size_branch = rd.randint(0,5)
-            last_node = None
-
-            for i in range(size_branch):
-                # Check if number of desired nodes reached
-                if self.graph.nb_nodes >= Config.NB_NODES.value:
-                    return 0
-                # 2D Rotation matrix
-                coord_x = main_branch_node.coordinates['x'] * math.cos(math.pi/2) - main_branch_node.coordinates['y'] * math.sin(math.pi/2)
-                coord_y = main_branch_node.coordinates['x'] * math.sin(math.pi/2) + main_branch_node.coordinates['y'] * math.cos(math.pi/2)
-                
-                # Check if the new coordinates are outside the generation box
-                if abs(coord_x) <= Config.GENERATION_SIZE.value[0]/2 and abs(coord_y) <= Config.GENERATION_SIZE.value[1]/2:
-                    if i == 0:
-                        # Create a node from the main branch node
-                        last_node = self.graph.add_node(node_id_p=self.graph.nb_nodes, parent_p=main_branch_node.id, coordinates_p=(coord_x,coord_y,main_branch_node.coordinates['z']), radius_p=0.5, active_p=True)
-                    else:
-                        # Extend the sub branch
-                        last_node = self.graph.add_node(node_id_p=self.graph.nb_nodes, parent_p=last_node.id, coordinates_p=(coord_x+i, coord_y+i, main_branch_node.coordinates['z']), radius_p=0.5, active_p=True)
+        Create a graph that looks like a mine structure, level after level: every level gets 1 to 3 straight
+        main branches leaving its origin, each main branch node gets a sub branch (harvesting site), and the
+        next level starts one layer below.
+        The levels are built as whole coordinate arrays, several levels at once. The mine stops (status
+        "stalled") once the origin of the next level leaves the generation box.
+        """
+        origin_id = self.graph.nb_nodes-1 if origin_id_p is None else origin_id_p
+        self.current_node_index = origin_id
+        while self.graph.nb_nodes < self.max_nodes:
+            if self.stream is not None and self.stream.should_flush(self.graph):
+                # Only the origin of the current level is read again
+                self.checkpoint("mine", origin_id, origin_id_p=origin_id)
+
+            # Fixed number of levels per batch: the random draws do not depend on the streaming
+            origin_id, nb_created = self.mine_levels(origin_id, self.MINE_LEVELS_PER_BATCH if self.three_dimension else 1)
+
+            if not self.three_dimension:
+                break
+            if nb_created == 0:
+                # The origin left the generation box (or every new node collided): the mine is full
+                self.growth['status'] = "stalled"
+                return 1
+        self.end_growth()
         return 1
 
 
-    def loop_closure(self):
+    def mine_levels(self, origin_id_p, nb_levels_p):
+        """
+        MINE CONTEXT
+        Add at most nb_levels_p levels to the mine, starting from the origin node origin_id_p, stopping at
+        max_nodes and at the bottom of the generation box (every level is in its own layer).
+        Main branch nodes are placed every shift from the origin (the first one even outside the generation box),
+        sub branches start at the main branch node rotated by 90 degrees around the z axis and go diagonally.
+        Return the id of the origin of the next level and the number of nodes created.
+        """
+        half_size = np.asarray(self.generation_size, dtype=np.float64)/2
+        layer_step = Config.Z_AXIS_LAYER_STEP.value
+        origin = np.asarray(self.graph.nodes[origin_id_p].get_list_coordinates(), dtype=np.float64)
+
+        # Origin of every level: one layer below the previous origin, only while that one is inside the generation box
+        if not np.all(np.abs(origin) <= half_size):
+            return origin_id_p, 0
+        nb_levels = min(nb_levels_p, int((origin[2] + half_size[2]) // layer_step) + 1) if self.three_dimension else 1
+        # Every level (3D) creates the origin of the next one
+        nb_steps = nb_levels if self.three_dimension else 0
+        levels = np.arange(nb_levels)
+        levels_z = origin[2] - layer_step * levels
+
+        # Main branches: 1 to 3 per level, 2 to 10 nodes each
+        nb_branches = self.random.integers(1, 3, nb_levels, endpoint=True)
+        branch_levels = np.repeat(levels, nb_branches)
+        sizes = self.random.integers(2, 10, len(branch_levels), endpoint=True)
+        shifts = self.random.integers(1, 5, (len(branch_levels), 2), endpoint=True) * self.random.random((len(branch_levels), 2)) * self.random.choice((-1, 1), (len(branch_levels), 2))
+        main_branches = np.repeat(np.arange(len(branch_levels)), sizes)
+        main_steps = np.arange(len(main_branches)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+        main_coordinates = np.empty((len(main_branches), 3))
+        main_coordinates[:, :2] = origin[:2] + shifts[main_branches] * (main_steps + 1)[:, None]
+        main_coordinates[:, 2] = levels_z[branch_levels[main_branches]]
+        main_radii = self.random.uniform(1.0, Config.MAX_RADIUS_NODE.value, len(main_branches))
+        main_kept = (main_steps == 0) | np.all(np.abs(main_coordinates) <= half_size, axis=1)
+
+        # Sub branches: 0 to 5 nodes, only when their start is inside the generation box
+        sub_sizes = self.random.integers(0, 5, len(main_branches), endpoint=True)
+        sub_starts = np.stack((-main_coordinates[:, 1], main_coordinates[:, 0], main_coordinates[:, 2]), axis=1)
+
+        if self.occupancy is not None:
+            # Tested from the origin, with the spheres flattened to half a layer step (tunnels of the same layer only)
+            origins = np.full(len(main_branches), origin_id_p)
+            collided = self.occupancy.collides(origins, main_coordinates, np.minimum(main_radii, layer_step/2))
+            # A main branch whose first node collides is abandoned, the other colliding nodes are skipped
+            abandoned = np.zeros(len(branch_levels), dtype=bool)
+            abandoned[main_branches[collided & (main_steps == 0)]] = True
+            rejected = main_kept & (collided | abandoned[main_branches])
+            self.occupancy.count(np.count_nonzero(main_kept), np.count_nonzero(rejected))
+            main_kept &= ~rejected
+        sub_sizes = np.where(main_kept & np.all(np.abs(sub_starts[:, :2]) <= half_size[:2], axis=1), sub_sizes, 0)
+        sub_mains = np.repeat(np.arange(len(main_branches)), sub_sizes)
+        sub_steps = np.arange(len(sub_mains)) - np.repeat(np.cumsum(sub_sizes) - sub_sizes, sub_sizes)
+        sub_coordinates = sub_starts[sub_mains] + np.stack((sub_steps, sub_steps, np.zeros(len(sub_steps))), axis=1)
+        sub_kept = np.ones(len(sub_mains), dtype=bool)
+        if self.occupancy is not None and len(sub_mains):
+            # A sub branch stops at its first colliding node
+            collided = self.occupancy.collides(np.full(len(sub_mains), origin_id_p), sub_coordinates, np.full(len(sub_mains), 0.5))
+            first_collision = np.full(len(main_branches), np.iinfo(np.int64).max)
+            np.minimum.at(first_collision, sub_mains[collided], sub_steps[collided])
+            sub_kept = sub_steps < first_collision[sub_mains]
+            self.occupancy.count(len(sub_mains), np.count_nonzero(~sub_kept))
+
+        # Local indices: kept main nodes, kept sub nodes, then the origins of the next levels (-1 is origin_id_p)
+        mains = np.flatnonzero(main_kept)
+        subs = np.flatnonzero(sub_kept)
+        main_locals = np.full(len(main_branches), -1)
+        main_locals[mains] = np.arange(len(mains))
+        first_origin = len(mains) + len(subs)
+        level_origins = np.concatenate(([-1], first_origin + np.arange(nb_steps)))[levels]
+
+        first_in_branch = np.ones(len(mains), dtype=bool)
+        first_in_branch[1:] = main_branches[mains[1:]] != main_branches[mains[:-1]]
+        main_parents = np.where(first_in_branch, level_origins[branch_levels[main_branches[mains]]], np.arange(len(mains)) - 1)
+        sub_parents = np.where(sub_steps[subs] == 0, main_locals[sub_mains[subs]], len(mains) + np.arange(len(subs)) - 1)
+        origin_parents = level_origins[:nb_steps]
+
+        coordinates = np.concatenate((main_coordinates[mains], sub_coordinates[subs], np.column_stack((np.full((nb_steps, 2), origin[:2]), levels_z[:nb_steps] - layer_step))))
+        radii = np.concatenate((main_radii[mains], np.full(len(subs), 0.5), self.random.uniform(1.0, Config.MAX_RADIUS_NODE.value, nb_steps)))
+        parents = np.concatenate((main_parents, sub_parents, origin_parents))
+
+        self.growth['attempts'] += len(main_branches) + len(sub_mains)
+        self.growth['rejects'] += len(main_branches) + len(sub_mains) - len(mains) - len(subs)
+
+        # Creation order: level, branch, main branch nodes then their sub branches, then the origin of the next level
+        keys = (
+            np.concatenate((branch_levels[main_branches[mains]], branch_levels[main_branches[sub_mains[subs]]], levels[:nb_steps])),
+            np.concatenate((main_branches[mains], main_branches[sub_mains[subs]], np.full(nb_steps, len(branch_levels)))),
+            np.concatenate((np.zeros(len(mains), dtype=np.int64), np.ones(len(subs), dtype=np.int64), np.full(nb_steps, 2))),
+            np.concatenate((mains, sub_mains[subs], np.zeros(nb_steps, dtype=np.int64))),
+            np.concatenate((np.zeros(len(mains), dtype=np.int64), sub_steps[subs], np.zeros(nb_steps, dtype=np.int64))),
+        )
+        order = np.lexsort(keys[::-1])[:self.max_nodes - self.graph.nb_nodes]
+        ids = np.full(len(coordinates) + 1, origin_id_p)
+        ids[order] = self.graph.nb_nodes + np.arange(len(order))
+        # Nodes dropped by max_nodes come after all the kept ones: their ids are never read
+        self.graph.add_nodes(ids[order], ids[parents[order]], coordinates[order], radii[order])
+        if self.occupancy is not None:
+            self.occupancy.mark(ids[order], ids[parents[order]], coordinates[order])
+
+        next_origin = ids[first_origin + nb_steps - 1] if nb_steps else origin_id_p
+        return int(next_origin), len(order)
+
+
+    def loop_closure(self, distance_p=None, min_hops_p=None):
         """
-        Post processing loop closure creation
+        Post processing loop closure creation.
+        Every pair of nodes closer than distance_p and not already connected within min_hops_p edges
+        is connected with a probability of loop_closure_probability percent, in a random order, while
+        both nodes have less than LOOP_CLOSURE_MAX_EDGES_PER_NODE loop edges and the graph less than
+        LOOP_CLOSURE_MAX_FRACTION loop edges per node.
+        Return the number of edges added.
         """
-        pass
+        distance = Config.LOOP_CLOSURE_DISTANCE.value if distance_p is None else distance_p
+        min_hops = Config.LOOP_CLOSURE_MIN_HOPS.value if min_hops_p is None else min_hops_p
+        if self.loop_closure_probability <= 0:
+            return 0
+        candidates = self.graph.get_loop_closure_candidates(distance, min_hops)
+        chosen = candidates[self.random.random(len(candidates)) < self.loop_closure_probability/100]
+        chosen = chosen[self.random.permutation(len(chosen))]
+
+        # Rank of every pair among the chosen pairs of each of its nodes: a pair is kept if it comes
+        # within the first LOOP_CLOSURE_MAX_EDGES_PER_NODE of both nodes (a bound, never exceeded)
+        ends = chosen.ravel()
+        order = np.argsort(ends, kind='stable')
+        sorted_ends = ends[order]
+        group_starts = np.flatnonzero(np.r_[True, sorted_ends[1:] != sorted_ends[:-1]])
+        ranks = np.empty(len(ends), dtype=np.int64)
+        ranks[order] = np.arange(len(ends)) - np.repeat(group_starts, np.diff(np.r_[group_starts, len(ends)]))
+        chosen = chosen[ranks.reshape(-1, 2).max(axis=1, initial=0) < Config.LOOP_CLOSURE_MAX_EDGES_PER_NODE.value]
+        chosen = chosen[:int(Config.LOOP_CLOSURE_MAX_FRACTION.value * self.graph.nb_nodes)]
+        return self.graph.add_edges(chosen[:, 0], chosen[:, 1])
 
    
     def get_coordinates_on_circle(self, radius_p, theta_p, index_p):
         """
-        Return the coordinates of a point in a circle based on the origin's coordinate and the radius of the circle as well as it's angle.
+        Return the coordinates of a point in a circle based on the origin's coordinate and the radius of the circle as well as it's angle (degrees).
         """
         radius = radius_p
-        theta = theta_p
+        theta = math.radians(theta_p)
         index = index_p
         node = self.graph.nodes[index]
         x = node.coordinates['x'] + radius * math.cos(theta)
         y = node.coordinates['y'] + radius * math.sin(theta)
 
         # 3D generation
-        if Config.THREE_DIMENSION_GENERATION.value:
+        if self.three_dimension:
             z_layer_probability = Config.Z_AXIS_LAYER_PROB.value/100
-            layer_choice = rd.choices(population=[True,False], weights=[z_layer_probability,1-z_layer_probability])
-            if layer_choice[0]:
+            if self.random.random() < z_layer_probability:
                 z = node.coordinates['z'] - Config.Z_AXIS_LAYER_STEP.value
                 x *= Config.Z_AXIS_STEP_DOWN_XY_SHIFT.value
                 y *= Config.Z_AXIS_STEP_DOWN_XY_SHIFT.value
             else:
                 # z = node.coordinates['z']
-                z = node.coordinates['z'] + rd.gauss(Config.Z_AXIS_GAUSSIAN_MEAN.value, 0.1)
+                z = node.coordinates['z'] + self.random.normal(Config.Z_AXIS_GAUSSIAN_MEAN.value, 0.1)
         else:
             z = 0.0
         return list((x,y,z))
@@ -0,0 +1,204 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Vectorized analytics of a generated graph, computed from its coordinate and edge arrays with
+sparse-graph routines. The results are saved in the "analytics" entry of data.json so datasets
+can be filtered without opening the meshes:
+
+    $ python3 src/analytics.py data/<generation_name>
+"""
+import json
+import os
+import sys
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse import csgraph
+
+
+def weighted_adjacency(nb_nodes_p, edges_p, lengths_p):
+    """
+    Return the symmetric CSR matrix of the graph weighted by the edge lengths.
+    """
+    rows = np.concatenate((edges_p[:, 0], edges_p[:, 1]))
+    cols = np.concatenate((edges_p[:, 1], edges_p[:, 0]))
+    weights = np.concatenate((lengths_p, lengths_p))
+    return sparse.csr_matrix((weights, (rows, cols)), shape=(nb_nodes_p, nb_nodes_p))
+
+
+def chain_tortuosity(positions_p, edges_p, lengths_p, degrees_p):
+    """
+    Return the tortuosity (path length / distance between the ends) of every chain.
+    A chain is a maximal path whose interior nodes all have a degree of 2.
+    """
+    nb_nodes = len(positions_p)
+    interior = degrees_p == 2
+    u_interior = interior[edges_p[:, 0]]
+    v_interior = interior[edges_p[:, 1]]
+
+    # Label the interior nodes of every chain
+    inner_edges = edges_p[u_interior & v_interior]
+    inner_graph = sparse.csr_matrix((np.ones(len(inner_edges), dtype=np.int8), (inner_edges[:, 0], inner_edges[:, 1])), shape=(nb_nodes, nb_nodes))
+    _, labels = csgraph.connected_components(inner_graph, directed=False)
+
+    # Chains made of one edge between two junctions
+    direct = ~u_interior & ~v_interior
+    direct_tortuosity = np.ones(np.count_nonzero(direct & (lengths_p > 0)))
+
+    # Length of the other chains: every edge touching an interior node belongs to its chain
+    touching = u_interior | v_interior
+    edge_labels = np.where(u_interior, labels[edges_p[:, 0]], labels[edges_p[:, 1]])[touching]
+    chain_ids, edge_labels = np.unique(edge_labels, return_inverse=True)
+    chain_lengths = np.bincount(edge_labels, weights=lengths_p[touching], minlength=len(chain_ids))
+
+    # Ends of the chains: junction nodes reached from an interior node (closed loops have none)
+    boundary = u_interior ^ v_interior
+    boundary_labels = np.searchsorted(chain_ids, np.where(u_interior, labels[edges_p[:, 0]], labels[edges_p[:, 1]])[boundary])
+    boundary_nodes = np.where(u_interior, edges_p[:, 1], edges_p[:, 0])[boundary]
+    order = np.argsort(boundary_labels, kind='stable')
+    boundary_labels = boundary_labels[order]
+    boundary_nodes = boundary_nodes[order]
+    first = np.searchsorted(boundary_labels, np.arange(len(chain_ids)), side='left')
+    last = np.searchsorted(boundary_labels, np.arange(len(chain_ids)), side='right') - 1
+    has_two_ends = last > first
+    start = positions_p[boundary_nodes[first[has_two_ends]]]
+    end = positions_p[boundary_nodes[last[has_two_ends]]]
+    distances = np.linalg.norm(end - start, axis=1)
+    valid = distances > 0
+    tortuosity = chain_lengths[has_two_ends][valid] / distances[valid]
+    return np.concatenate((direct_tortuosity, tortuosity))
+
+
+def bounding_box_fill(positions_p, edges_p, cell_size_p):
+    """
+    Return the fraction of the bounding box cells holding a node or an edge midpoint, and the cell size
+    (cell_size_p, enlarged if the grid would have more than 8 cells per sample).
+    """
+    samples = np.concatenate((positions_p, (positions_p[edges_p[:, 0]] + positions_p[edges_p[:, 1]]) / 2))
+    mins = positions_p.min(axis=0)
+    extent = positions_p.max(axis=0) - mins
+    cell_size = max(cell_size_p, (np.prod(np.maximum(extent, cell_size_p)) / (8 * len(samples))) ** (1 / 3))
+    shape = np.maximum(np.ceil(extent / cell_size).astype(np.int64), 1)
+    cells = np.minimum(((samples - mins) / cell_size).astype(np.int64), shape - 1)
+    occupied = np.zeros(int(np.prod(shape)), dtype=bool)
+    occupied[np.ravel_multi_index(cells.T, shape)] = True
+    return float(np.count_nonzero(occupied) / len(occupied)), float(cell_size)
+
+
+def accumulate_to_root(predecessors_p, *values_p):
+    """
+    Return, for every node of a shortest path tree, the sums of each of values_p along its path to
+    the root (pointer jumping: O(n log depth) without a Python loop over the nodes).
+    """
+    nb_nodes = len(predecessors_p)
+    # The roots and unreached nodes point to a sentinel node holding zeros
+    totals = [np.append(np.asarray(values, dtype=np.float64), 0.0) for values in values_p]
+    pointers = np.append(np.where(predecessors_p >= 0, predecessors_p, nb_nodes), nb_nodes).astype(np.int32)
+    while (pointers != nb_nodes).any():
+        for total in totals:
+            total += total[pointers]
+        pointers = pointers[pointers]
+    return [total[:nb_nodes] for total in totals]
+
+
+def farthest_node(adjacency_p, positions_p, source_p, tree_p, hops_p=False):
+    """
+    Return (node, distance, hops) of the node farthest from source_p along the shortest paths
+    (hops is None unless hops_p is set). On a tree the paths are the breadth first tree, otherwise
+    they are computed with Dijkstra.
+    """
+    if tree_p:
+        _, predecessors = csgraph.breadth_first_order(adjacency_p, source_p, directed=False, return_predecessors=True)
+        linked = predecessors >= 0
+        lengths = np.zeros(len(positions_p))
+        lengths[linked] = np.linalg.norm(positions_p[linked] - positions_p[predecessors[linked]], axis=1)
+        totals = accumulate_to_root(predecessors, lengths, linked) if hops_p else accumulate_to_root(predecessors, lengths)
+        linked[source_p] = True
+        distances = np.where(linked, totals[0], -1.0)
+    else:
+        distances, predecessors = csgraph.dijkstra(adjacency_p, directed=False, indices=source_p, return_predecessors=True)
+        distances = np.where(np.isfinite(distances), distances, -1.0)
+        totals = [None, accumulate_to_root(predecessors, predecessors >= 0)[0]] if hops_p else [None]
+    node = int(np.argmax(distances))
+    return node, float(distances[node]), int(totals[1][node]) if hops_p else None
+
+
+def shortest_path_diameter(adjacency_p, positions_p, labels_p, tree_p):
+    """
+    Return the (length, hops) of the longest shortest path of the largest component (double sweep:
+    exact on trees, lower bound when the graph has cycles).
+    """
+    largest = np.argmax(np.bincount(labels_p))
+    start = int(np.flatnonzero(labels_p == largest)[0])
+    far, _, _ = farthest_node(adjacency_p, positions_p, start, tree_p)
+    _, length, hops = farthest_node(adjacency_p, positions_p, far, tree_p, hops_p=True)
+    return length, hops
+
+
+def compute_analytics(positions_p, edges_p):
+    """
+    Compute the analytics of a graph given its (n, 3) positions and its unique (e, 2) edges (rows).
+    Return a json serializable dictionary.
+    """
+    positions = np.asarray(positions_p, dtype=np.float64).reshape(-1, 3)
+    edges = np.asarray(edges_p, dtype=np.int64).reshape(-1, 2)
+    nb_nodes = len(positions)
+    nb_edges = len(edges)
+    if nb_nodes == 0:
+        return {'nodes': 0, 'edges': 0}
+
+    lengths = np.linalg.norm(positions[edges[:, 1]] - positions[edges[:, 0]], axis=1)
+    adjacency = weighted_adjacency(nb_nodes, edges, np.maximum(lengths, 1e-9))
+    degrees = np.bincount(edges.ravel(), minlength=nb_nodes)
+    nb_components, labels = csgraph.connected_components(adjacency, directed=False)
+    component_sizes = np.bincount(labels)
+    tortuosity = chain_tortuosity(positions, edges, lengths, degrees)
+    nb_cycles = nb_edges - nb_nodes + nb_components
+    diameter_length, diameter_hops = shortest_path_diameter(adjacency, positions, labels, nb_cycles == 0)
+    extent = positions.max(axis=0) - positions.min(axis=0)
+    fill, cell_size = bounding_box_fill(positions, edges, max(float(np.median(lengths)) if nb_edges else 1.0, 1e-6))
+
+    return {
+        'nodes': nb_nodes,
+        'edges': nb_edges,
+        'connected_components': int(nb_components),
+        'largest_component_nodes': int(component_sizes.max()),
+        'degree_histogram': np.bincount(degrees).tolist(),
+        'leaf_nodes': int(np.count_nonzero(degrees == 1)),
+        'branch_nodes': int(np.count_nonzero(degrees >= 3)),
+        'isolated_nodes': int(np.count_nonzero(degrees == 0)),
+        # Independent cycles (cyclomatic number)
+        'cycles': int(nb_cycles),
+        'total_length': float(lengths.sum()),
+        'mean_edge_length': float(lengths.mean()) if nb_edges else 0.0,
+        'chains': int(len(tortuosity)),
+        'tortuosity_mean': float(tortuosity.mean()) if len(tortuosity) else 1.0,
+        'tortuosity_median': float(np.median(tortuosity)) if len(tortuosity) else 1.0,
+        'tortuosity_max': float(tortuosity.max()) if len(tortuosity) else 1.0,
+        'bounding_box': extent.tolist(),
+        'bounding_box_fill': fill,
+        'bounding_box_fill_cell_size': cell_size,
+        'diameter_length': diameter_length,
+        'diameter_hops': diameter_hops,
+        # Double sweep: exact on trees, a lower bound of the diameter when the graph has cycles
+        'diameter_approximate': bool(nb_cycles > 0),
+    }
+
+
+def collect_analytics(dataset_path_p):
+    """
+    Return {index: analytics} for every graph of a generation directory, reading only the metadata.
+    """
+    results = {}
+    for index in sorted(os.listdir(dataset_path_p)):
+        for path in (os.path.join(dataset_path_p, index, "graph_arrays", "metadata.json"), os.path.join(dataset_path_p, index, "data.json")):
+            if os.path.exists(path):
+                with open(path) as infile:
+                    results[index] = json.load(infile).get('analytics')
+                break
+    return results
+
+
+if __name__ == '__main__':
+    for index, analytics in collect_analytics(sys.argv[1]).items():
+        print(json.dumps({'index': index, **(analytics or {})}))
@@ -0,0 +1,560 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Array-backed (struct-of-arrays) storage engine for the graph.
+Every node attribute lives in a contiguous NumPy array instead of a Node object.
+"""
+import json
+from collections.abc import Mapping
+
+import numpy as np
+
+from config import Config
+from graph import Graph
+
+
+class NodeView:
+    """
+    Lightweight view on one row of an ArrayGraph.
+    Exposes the same interface as node.Node without owning any data.
+    """
+    __slots__ = ('_graph', '_row')
+
+    def __init__(self, graph_p, row_p):
+        self._graph = graph_p
+        self._row = row_p
+
+    def __repr__(self):
+        return (f"NodeView(ID: {self.id}, Parents: {self.parent}, Edges: {self.edges}, "
+                f"Coordinates: {self.coordinates}, Radius: {self.radius}, Active: {self.active})")
+
+    def __eq__(self, other):
+        return isinstance(other, NodeView) and other._graph is self._graph and other._row == self._row
+
+    def __hash__(self):
+        return hash((id(self._graph), self._row))
+
+    @property
+    def id(self):
+        return int(self._graph._ids[self._row])
+
+    @property
+    def parent(self):
+        parent = int(self._graph._parents[self._row])
+        return parent if parent >= 0 else None
+
+    @property
+    def edges(self):
+        return self._graph.get_node_edges(self.id)
+
+    @property
+    def coordinates(self):
+        x, y, z = self._graph._coordinates[self._row]
+        return {'x': float(x), 'y': float(y), 'z': float(z)}
+
+    @property
+    def radius(self):
+        return float(self._graph._radii[self._row])
+
+    @property
+    def active(self):
+        return bool(self._graph._active[self._row])
+
+    def set_parent(self, parent_p):
+        self._graph._parents[self._row] = parent_p if parent_p is not None else -1
+
+    def get_parent(self):
+        return self.parent
+
+    def has_parent(self):
+        if self.parent:
+            return True
+        else:
+            return False
+
+    def add_edge(self, edge_p):
+        self._graph.add_edge(self.id, edge_p)
+
+    def set_edges(self, edges_p):
+        self._graph.set_node_edges(self.id, edges_p)
+
+    def get_edges(self):
+        return self.edges
+
+    def set_coordinates(self, coordinates_p):
+        self._graph.set_coordinates(self.id, coordinates_p)
+
+    def get_list_coordinates(self):
+        return self._graph._coordinates[self._row].tolist()
+
+    def get_coordinates(self):
+        return self.coordinates
+
+    def get_radius(self):
+        return self.radius
+
+    def set_radius(self, radius_p):
+        self._graph._radii[self._row] = radius_p
+
+    def activate(self):
+        self._graph._active[self._row] = True
+
+    def deactivate(self):
+        self._graph._active[self._row] = False
+
+    def is_active(self):
+        return self.active
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'parent': self.parent,
+            'edges': self.edges,
+            'coordinates': self.coordinates,
+            'radius': self.radius,
+            'active': self.active,
+        }
+
+    def toJSON(self):
+        return json.dumps(self.to_dict(), sort_keys=True, indent=4)
+
+
+class NodeMapping(Mapping):
+    """
+    Read-only dictionary facade (node id -> NodeView) so code written against Graph.nodes keeps working.
+    Only resident (not evicted) nodes are visible.
+    """
+    def __init__(self, graph_p):
+        self._graph = graph_p
+
+    def __getitem__(self, node_id):
+        return NodeView(self._graph, self._graph.get_row(node_id))
+
+    def __iter__(self):
+        return (int(node_id) for node_id in self._graph.get_ids())
+
+    def __len__(self):
+        return self._graph.nb_resident_nodes
+
+
+class ArrayGraph(Graph):
+    """
+    Graph storing ids, parents, coordinates, radii and active flags in NumPy arrays.
+    Arrays grow by amortized doubling. Edges are kept once, as canonical (min id, max id) pairs.
+    Rows already written to disk by a GraphStream can be evicted, in which case only the
+    resident rows (the most recent ones) are kept in memory.
+    """
+    # Minimal number of recent edge keys kept in a set before they are merged into the sorted edge keys
+    EDGE_INDEX_TAIL = 4096
+
+    def __init__(self, generation_name_p, nb_graphs_p, max_created_node_on_circle_p=3, capacity_p=1024, spatial_index_p=True):
+        super().__init__(generation_name_p, nb_graphs_p, max_created_node_on_circle_p, spatial_index_p)
+        self._capacity = 0
+        self._size = 0
+        self._offset = 0
+        self._ids = np.empty(0, dtype=np.int64)
+        self._parents = np.empty(0, dtype=np.int64)
+        self._coordinates = np.empty((0, 3), dtype=np.float64)
+        self._radii = np.empty(0, dtype=np.float64)
+        self._active = np.empty(0, dtype=bool)
+        self._reserve_nodes(capacity_p)
+
+        self._edge_capacity = 0
+        self._nb_edges = 0
+        self._edge_offset = 0
+        self._edges = np.empty((0, 2), dtype=np.int64)
+        self._reserve_edges(capacity_p)
+        # Duplicate lookup: sorted keys (edge_key) of the resident edges, but the most recent ones kept in
+        # a small set (at most 1/256 of the edges) until they are merged
+        self._edge_index = np.empty(0, dtype=np.int64)
+        self._edge_tail = set()
+
+        # Only ids that differ from their (logical) row need a lookup entry
+        self._rows = {}
+        self.nodes = NodeMapping(self)
+
+
+    def _reserve_nodes(self, capacity_p):
+        """
+        Make sure the node arrays can hold at least capacity_p rows (amortized doubling).
+        """
+        if capacity_p <= self._capacity:
+            return
+        capacity = max(capacity_p, 2 * self._capacity)
+        n = self._size
+        self._ids = self._grow(self._ids, capacity, n)
+        self._parents = self._grow(self._parents, capacity, n)
+        self._coordinates = self._grow(self._coordinates, capacity, n)
+        self._radii = self._grow(self._radii, capacity, n)
+        self._active = self._grow(self._active, capacity, n)
+        self._capacity = capacity
+
+
+    def _reserve_edges(self, capacity_p):
+        """
+        Make sure the edge array can hold at least capacity_p edges (amortized doubling).
+        """
+        if capacity_p <= self._edge_capacity:
+            return
+        capacity = max(capacity_p, 2 * self._edge_capacity)
+        self._edges = self._grow(self._edges, capacity, self._nb_edges)
+        self._edge_capacity = capacity
+
+
+    @staticmethod
+    def _grow(array_p, capacity_p, used_p):
+        grown = np.empty((capacity_p,) + array_p.shape[1:], dtype=array_p.dtype)
+        grown[:used_p] = array_p[:used_p]
+        return grown
+
+
+    @property
+    def nb_resident_nodes(self):
+        return self._size
+
+
+    @property
+    def nb_edges(self):
+        """
+        Total number of edges added to the graph, evicted ones included.
+        """
+        return self._edge_offset + self._nb_edges
+
+
+    @property
+    def nb_resident_edges(self):
+        return self._nb_edges
+
+
+    def get_row(self, node_id):
+        """
+        Return the array row of a node id. Raise KeyError if the node does not exist or was evicted.
+        """
+        node_id = int(node_id)
+        row = node_id - self._offset
+        if 0 <= row < self._size and self._ids[row] == node_id:
+            return row
+        row = self._rows[node_id] - self._offset
+        if row < 0:
+            raise KeyError(f"Node {node_id} was evicted from memory")
+        return row
+
+
+    def get_rows(self, node_ids_p):
+        """
+        Vectorized get_row: return the array rows of an array of node ids.
+        """
+        node_ids = np.asarray(node_ids_p, dtype=np.int64)
+        rows = node_ids - self._offset
+        inside = (rows >= 0) & (rows < self._size)
+        dense = np.zeros(len(rows), dtype=bool)
+        dense[inside] = self._ids[rows[inside]] == node_ids[inside]
+        if not dense.all():
+            rows[~dense] = [self.get_row(node_id) for node_id in node_ids[~dense].tolist()]
+        return rows
+
+
+    def add_node(self, node_id_p, parent_p=None, edges_p=None, coordinates_p=None, radius_p=None, active_p=True):
+        """
+        Append a node to the arrays and return a view on it.
+        """
+        row = self._size
+        self._reserve_nodes(row + 1)
+        self._ids[row] = node_id_p
+        self._parents[row] = parent_p if parent_p is not None else -1
+        self._coordinates[row] = coordinates_p[:3] if coordinates_p is not None else (0.0, 0.0, 0.0)
+        self._radii[row] = radius_p if radius_p is not None else 1.0
+        self._active[row] = active_p if active_p is not None else False
+        if node_id_p != self.nb_nodes:
+            self._rows[int(node_id_p)] = self.nb_nodes
+        self._size += 1
+        self.nb_nodes += 1
+        if self.spatial_index is not None:
+            self.spatial_index.insert(node_id_p, self._coordinates[row])
+
+        self.add_edge(node_id_p, parent_p)
+        if edges_p != None:
+            for edge in edges_p:
+                self.add_edge(node_id_p, edge)
+        return NodeView(self, row)
+
+
+    def add_nodes(self, node_ids_p, parents_p, coordinates_p, radii_p, active_p=True, link_parents_p=True):
+        """
+        Append many nodes at once (vectorized add_node). parents_p uses -1 for nodes without parent.
+        When link_parents_p is set, an edge is added between every node and its parent.
+        """
+        node_ids = np.asarray(node_ids_p, dtype=np.int64)
+        count = len(node_ids)
+        if count == 0:
+            return
+        parents = np.asarray(parents_p, dtype=np.int64)
+        start = self._size
+        self._reserve_nodes(start + count)
+        self._ids[start:start+count] = node_ids
+        self._parents[start:start+count] = parents
+        self._coordinates[start:start+count] = np.asarray(coordinates_p, dtype=np.float64).reshape(count, 3)
+        self._radii[start:start+count] = radii_p
+        self._active[start:start+count] = active_p
+        logical_rows = np.arange(self.nb_nodes, self.nb_nodes + count)
+        for node_id, logical_row in zip(node_ids[node_ids != logical_rows].tolist(), logical_rows[node_ids != logical_rows].tolist()):
+            self._rows[node_id] = logical_row
+        self._size += count
+        self.nb_nodes += count
+        if self.spatial_index is not None:
+            self.spatial_index.insert_many(node_ids, self._coordinates[start:start+count])
+
+        if link_parents_p:
+            linked = parents >= 0
+            self.add_edges(node_ids[linked], parents[linked])
+
+
+    def add_edge(self, node_1_id, node_2_id):
+        """
+        Add an undirected edge between two node ids. Duplicates, self loops and None are ignored.
+        Return True if the edge was added.
+        """
+        if node_1_id is None or node_2_id is None or node_1_id == node_2_id:
+            return False
+        low, high = (int(node_1_id), int(node_2_id)) if node_1_id < node_2_id else (int(node_2_id), int(node_1_id))
+        key = self.edge_key(low, high)
+        if key in self._edge_tail:
+            return False
+        position = self._edge_index.searchsorted(key)
+        if position < len(self._edge_index) and self._edge_index[position] == key:
+            return False
+        self._reserve_edges(self._nb_edges + 1)
+        self._edges[self._nb_edges] = (low, high)
+        self._nb_edges += 1
+        self._edge_tail.add(key)
+        self._merge_edge_tail()
+        self._invalidate_edges()
+        return True
+
+
+    def add_edges(self, nodes_1_ids_p, nodes_2_ids_p):
+        """
+        Vectorized add_edge over two id arrays. Return the number of edges added.
+        """
+        nodes_1 = np.asarray(nodes_1_ids_p, dtype=np.int64)
+        nodes_2 = np.asarray(nodes_2_ids_p, dtype=np.int64)
+        edges = np.sort(np.stack((nodes_1, nodes_2), axis=1), axis=1)
+        edges = edges[(edges[:, 0] != edges[:, 1]) & (edges[:, 0] >= 0)]
+        keys, first = np.unique(self.edge_key(edges[:, 0], edges[:, 1]), return_index=True)
+        if len(self._edge_index):
+            positions = np.minimum(np.searchsorted(self._edge_index, keys), len(self._edge_index) - 1)
+            new = self._edge_index[positions] != keys
+            keys, first = keys[new], first[new]
+        if self._edge_tail:
+            new = np.fromiter((key not in self._edge_tail for key in keys.tolist()), dtype=bool, count=len(keys))
+            keys, first = keys[new], first[new]
+        first.sort()
+        edges = edges[first]
+        self._reserve_edges(self._nb_edges + len(edges))
+        self._edges[self._nb_edges:self._nb_edges+len(edges)] = edges
+        self._nb_edges += len(edges)
+        if len(keys) >= self.EDGE_INDEX_TAIL:
+            self._edge_index = np.insert(self._edge_index, np.searchsorted(self._edge_index, keys), keys)
+        else:
+            self._edge_tail.update(keys.tolist())
+            self._merge_edge_tail()
+        self._invalidate_edges()
+        return len(edges)
+
+
+    def _merge_edge_tail(self):
+        """
+        Merge the recent edge keys into the sorted edge keys once they are too many.
+        """
+        if len(self._edge_tail) < max(self.EDGE_INDEX_TAIL, len(self._edge_index) >> 8):
+            return
+        keys = np.sort(np.fromiter(self._edge_tail, dtype=np.int64, count=len(self._edge_tail)))
+        self._edge_index = np.insert(self._edge_index, np.searchsorted(self._edge_index, keys), keys)
+        self._edge_tail.clear()
+
+
+    def _reset_edge_index(self):
+        """
+        Rebuild the sorted edge keys from the resident edges (after edges were removed).
+        """
+        edges = self.get_edges_array()
+        self._edge_index = np.sort(self.edge_key(edges[:, 0], edges[:, 1]))
+        self._edge_tail.clear()
+
+
+    def evict(self, node_id_watermark_p, edge_watermark_p):
+        """
+        Drop from memory the rows of the nodes added before node_id_watermark_p and the edges
+        added before edge_watermark_p (global insertion indices). Used once they are stored on disk.
+        Evicted edges leave the deduplication index: edges added later must involve a resident node.
+        """
+        nb_rows = min(max(int(node_id_watermark_p) - self._offset, 0), self._size)
+        if nb_rows:
+            for column in (self._ids, self._parents, self._coordinates, self._radii, self._active):
+                column[:self._size-nb_rows] = column[nb_rows:self._size]
+            self._size -= nb_rows
+            self._offset += nb_rows
+            for node_id in [node_id for node_id, row in self._rows.items() if row < self._offset]:
+                del self._rows[node_id]
+            # The index would still return the evicted nodes: rebuilt from the resident ones when queried again
+            self.spatial_index = None
+
+        nb_edges = min(max(int(edge_watermark_p) - self._edge_offset, 0), self._nb_edges)
+        if nb_edges:
+            self._edges[:self._nb_edges-nb_edges] = self._edges[nb_edges:self._nb_edges]
+            self._nb_edges -= nb_edges
+            self._edge_offset += nb_edges
+            self._reset_edge_index()
+            self._invalidate_edges()
+
+
+    def start_at(self, nb_nodes_p, nb_edges_p):
+        """
+        Make an empty graph behave as if nb_nodes_p nodes and nb_edges_p edges were already
+        added and evicted, so the next appended rows get the following ids (used to resume a stream).
+        """
+        if self._size or self._nb_edges:
+            raise RuntimeError("start_at can only be called on an empty graph")
+        self._offset = self.nb_nodes = int(nb_nodes_p)
+        self._edge_offset = int(nb_edges_p)
+
+
+    def _neighbours(self):
+        """
+        Return the (sorted sources, destinations) arrays of both edge directions, built once per mutation.
+        """
+        if self._neighbours_cache is None:
+            # Both directions interleaved so the neighbours of a node keep the edge insertion order
+            edges = self.get_edges_array()
+            sources = edges.ravel()
+            destinations = edges[:, ::-1].ravel()
+            order = np.argsort(sources, kind='stable')
+            self._neighbours_cache = (sources[order], destinations[order])
+        return self._neighbours_cache
+
+
+    def get_node_edges(self, node_id_p):
+        """
+        Return the ids of the nodes connected to node_id_p.
+        """
+        sources, destinations = self._neighbours()
+        return destinations[np.searchsorted(sources, node_id_p, side='left'):np.searchsorted(sources, node_id_p, side='right')].tolist()
+
+
+    def set_node_edges(self, node_id_p, edges_p):
+        """
+        Replace the edges of one node (equivalent to Node.set_edges).
+        """
+        edges = self.get_edges_array()
+        touching = (edges == node_id_p).any(axis=1)
+        kept = edges[~touching]
+        self._nb_edges = len(kept)
+        self._edges[:self._nb_edges] = kept
+        self._reset_edge_index()
+        self._invalidate_edges()
+        for edge in edges_p:
+            self.add_edge(node_id_p, edge)
+
+
+    def set_coordinates(self, node_id, coordinates):
+        if isinstance(coordinates, dict):
+            coordinates = (coordinates['x'], coordinates['y'], coordinates['z'])
+        row = self.get_row(node_id)
+        self._coordinates[row] = coordinates
+        if self.spatial_index is not None:
+            self.spatial_index.update(node_id, self._coordinates[row])
+
+
+    def activate(self, node_id):
+        self._active[self.get_row(node_id)] = True
+
+
+    def deactivate(self, node_id):
+        self._active[self.get_row(node_id)] = False
+
+
+    def get_node(self, node_id):
+        return self.nodes[node_id]
+
+
+    def get_nodes(self):
+        return self.nodes.values()
+
+
+    def get_edges(self):
+        return [tuple(edge) for edge in self.get_edges_array().tolist()]
+
+
+    def get_edges_array(self):
+        return self._edges[:self._nb_edges]
+
+
+    def get_ids(self):
+        return self._ids[:self._size]
+
+
+    def get_parents(self):
+        return self._parents[:self._size]
+
+
+    def get_positions(self):
+        return self._coordinates[:self._size]
+
+
+    def get_radii(self):
+        return self._radii[:self._size]
+
+
+    def get_active(self):
+        return self._active[:self._size]
+
+
+    def nbytes(self):
+        """
+        Return the number of bytes held by the node and edge arrays.
+        """
+        return (self._ids.nbytes + self._parents.nbytes + self._coordinates.nbytes + self._radii.nbytes
+                + self._active.nbytes + self._edges.nbytes)
+
+
+    def serialize_nodes(self, start_row_p=0, end_row_p=None):
+        """
+        Return the nodes (rows start_row_p to end_row_p) as plain dictionaries, building every edge list
+        in one sorted pass.
+        """
+        rows = slice(start_row_p, self._size if end_row_p is None else min(end_row_p, self._size))
+        src_sorted, dst_sorted = self._neighbours()
+        ids = self.get_ids()[rows]
+        starts = np.searchsorted(src_sorted, ids, side='left').tolist()
+        ends = np.searchsorted(src_sorted, ids, side='right').tolist()
+
+        ids = ids.tolist()
+        parents = self.get_parents()[rows].tolist()
+        coordinates = self.get_positions()[rows].tolist()
+        radii = self.get_radii()[rows].tolist()
+        active = self.get_active()[rows].tolist()
+        nodes = {}
+        for row in range(len(ids)):
+            x, y, z = coordinates[row]
+            nodes[ids[row]] = {
+                'id': ids[row],
+                'parent': parents[row] if parents[row] >= 0 else None,
+                'edges': dst_sorted[starts[row]:ends[row]].tolist(),
+                'coordinates': {'x': x, 'y': y, 'z': z},
+                'radius': radii[row],
+                'active': active[row],
+            }
+        return nodes
+
+
+    def write_nodes(self, outfile_p):
+        """
+        Write the nodes of data.json as one json object in outfile_p, STREAM_BLOCK_SIZE nodes at a time
+        (the dictionaries of the whole graph are never held at once).
+        """
+        outfile_p.write("{")
+        for start_row in range(0, self._size, Config.STREAM_BLOCK_SIZE.value):
+            if start_row:
+                outfile_p.write(", ")
+            outfile_p.write(json.dumps(self.serialize_nodes(start_row, start_row + Config.STREAM_BLOCK_SIZE.value))[1:-1])
+        outfile_p.write("}")
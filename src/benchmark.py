@@ -0,0 +1,377 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Benchmarks of the Python stages (no Blender needed), with fixed seeds, across sizes:
+
+    $ python3 src/benchmark.py                   # default sizes
+    $ python3 src/benchmark.py -full             # up to 1e6 nodes
+    $ python3 src/benchmark.py -only gaussian_perlin mine -save-baseline
+
+Every benchmark is timed at several sizes (best of a few repetitions) and its scaling exponent is
+fitted on the log-log curve of the time against the amount of work (nodes, elements or voxels;
+1: linear). The results are appended to benchmarks/history.json and compared with the reference
+baseline committed in benchmarks/baseline.json (saved with -save-baseline): a size slower than the
+baseline by more than the tolerance is a regression (exit code 1). The benchmarks whose optional dependencies (PyVista) are missing are
+skipped.
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from config import Config, Color
+
+
+BENCHMARK_DIR = os.path.join(Config.PLUME_DIR.value, "benchmarks")
+SEED = 0
+MIN_REGRESSION_SECONDS = 0.005          # Differences below this are timer noise
+
+
+def grown_graph(algorithm_p, nb_nodes_p, seed_p=SEED, growth_mode_p="sequential", max_created_p=None):
+    """
+    Return an ArrayGraph of nb_nodes_p nodes grown by algorithm_p, in the default generation box
+    scaled to keep the density of 1000 nodes (deepened for the mine), and the growth to time (callable).
+    max_created_p defaults to MAX_CREATED_NODE_ON_CIRCLE.
+    """
+    from algorithm import Algorithm
+    from array_graph import ArrayGraph
+
+    scale = max(1.0, nb_nodes_p / 1000) ** (1 / 3)
+    size = tuple(int(length * scale) for length in Config.GENERATION_SIZE.value)
+    if algorithm_p == "mine":
+        # The mine digs one level (30 to 50 nodes) per layer below the first node and stops at the bottom of the box
+        size = size[:2] + (max(size[2], int(2 * Config.Z_AXIS_LAYER_STEP.value * nb_nodes_p / 20)),)
+    random = np.random.default_rng(seed_p)
+    graph = ArrayGraph("benchmark", 0, max_created_p if max_created_p is not None else Config.MAX_CREATED_NODE_ON_CIRCLE.value)
+    algorithm = Algorithm(graph_p=graph, loop_closure_probability_p=Config.DEFAULT_LOOP_CLOSURE_PROBABILITY.value,
+                          random_p=random, generation_size_p=size, nb_nodes_p=nb_nodes_p, growth_mode_p=growth_mode_p)
+    graph.add_node(node_id_p=0, coordinates_p=[0.0, 0.0, 0.0], radius_p=random.uniform(1.0, Config.MAX_RADIUS_NODE.value), active_p=True)
+    # Fixed cost of every graph, out of the timed growth (it hides the scaling of the small sizes)
+    algorithm.noise_bank
+    return graph, lambda: algorithm.algorithm(algorithm_p)
+
+
+def saved_graph(directory_p, nb_nodes_p):
+    """
+    Return the directory of a saved graph of nb_nodes_p nodes (grown with gaussian_perlin)
+    """
+    path = os.path.join(directory_p, f"graph_{nb_nodes_p}")
+    if not os.path.exists(os.path.join(path, "data.json")):
+        graph, grow = grown_graph("gaussian_perlin", nb_nodes_p)
+        grow()
+        graph.save_graph_path = os.path.join(path, "data.json")
+        graph.save_graph()
+    return path
+
+
+def growth_statistics(graph_p):
+    """
+    Return the statistics of a grown graph (arrays): per node, number of children, length and turn
+    (degrees, against the direction of the parent) of the edge from the parent; per graph (one value),
+    mean and largest depth (edges from the root) and diagonal of the bounding box.
+    """
+    parents = graph_p.get_parents()
+    positions = graph_p.get_positions()
+    children = np.bincount(parents[parents >= 0], minlength=len(parents))
+    child = np.flatnonzero(parents >= 0)
+    steps = positions[child] - positions[parents[child]]
+    turned = child[parents[parents[child]] >= 0]
+    before = positions[parents[turned]] - positions[parents[parents[turned]]]
+    after = positions[turned] - positions[parents[turned]]
+    turns = np.degrees(np.arctan2(after[:, 1], after[:, 0]) - np.arctan2(before[:, 1], before[:, 0]))
+    depths = np.zeros(len(parents), dtype=np.int64)
+    for node in child:
+        depths[node] = depths[parents[node]] + 1
+    return {
+        'children': children,
+        'edge_length': np.linalg.norm(steps, axis=1),
+        'turn': (turns + 180) % 360 - 180,
+        'mean_depth': np.array([depths.mean()]),
+        'max_depth': np.array([depths.max()]),
+        'extent': np.array([np.linalg.norm(positions.max(axis=0) - positions.min(axis=0))]),
+    }
+
+
+def compare_growth_modes(nb_nodes_p, max_created_p=None, nb_seeds_p=20):
+    """
+    Grow nb_seeds_p graphs of nb_nodes_p nodes with the sequential and the frontier gaussian_perlin and
+    return {statistic: {'sequential': mean, 'frontier': mean, 'ks': statistic, 'p_value'}}, the statistics
+    of the graphs of every mode being pooled (two sample Kolmogorov-Smirnov test).
+    """
+    from scipy.stats import ks_2samp
+
+    pooled = {}
+    for mode in ("sequential", "frontier"):
+        samples = {}
+        for seed in range(nb_seeds_p):
+            graph, grow = grown_graph("gaussian_perlin", nb_nodes_p, seed_p=SEED + seed, growth_mode_p=mode, max_created_p=max_created_p)
+            with contextlib.redirect_stdout(io.StringIO()):
+                grow()
+            for name, values in growth_statistics(graph).items():
+                samples.setdefault(name, []).append(values)
+        pooled[mode] = {name: np.concatenate(values) for name, values in samples.items()}
+    comparison = {}
+    for name in pooled['sequential']:
+        sequential, frontier = pooled['sequential'][name], pooled['frontier'][name]
+        test = ks_2samp(sequential, frontier)
+        comparison[name] = {'sequential': float(sequential.mean()), 'frontier': float(frontier.mean()), 'ks': float(test.statistic), 'p_value': float(test.pvalue)}
+    return comparison
+
+
+# Every benchmark: setup(size, scratch directory) returns the function to time (once)
+def growth_benchmark(algorithm_p, growth_mode_p="sequential", max_created_p=None):
+    def setup(size_p, directory_p):
+        return grown_graph(algorithm_p, int(size_p), growth_mode_p=growth_mode_p, max_created_p=max_created_p)[1]
+    return setup
+
+
+def setup_save_graph(size_p, directory_p):
+    graph, grow = grown_graph("gaussian_perlin", int(size_p))
+    grow()
+    graph.save_graph_path = os.path.join(directory_p, "save", "data.json")
+    return graph.save_graph
+
+
+def setup_load_graph(size_p, directory_p):
+    from graph_io import load_graph_arrays
+
+    path = saved_graph(directory_p, int(size_p))
+    return lambda: load_graph_arrays(path, mmap_p=False)
+
+
+def setup_load_graph_json(size_p, directory_p):
+    from graph_io import load_graph_json
+
+    path = saved_graph(directory_p, int(size_p))
+    return lambda: load_graph_json(os.path.join(path, "data.json"))
+
+
+def display_graph(directory_p, voxel_size_p):
+    from display import Display
+
+    display = Display(data_path=saved_graph(directory_p, 300), voxel_size=voxel_size_p)
+    display.load_graph()
+    return display
+
+
+def setup_voxelize(size_p, directory_p):
+    return display_graph(directory_p, size_p).voxelize
+
+
+def setup_extract_surface(size_p, directory_p):
+    display = display_graph(directory_p, size_p)
+    display.voxelize()
+    return display.extract_surface
+
+
+def lava_tube(shape_p):
+    from lava_tubes import ProceduralLavaTube
+
+    tube = ProceduralLavaTube(shape=shape_p, seed=SEED)
+    tube.generate_main_path(length=shape_p[0] - 10)
+    tube.add_side_branches(n_branches=max(1, shape_p[0] // 60))
+    return tube
+
+
+def setup_carve_tubes(size_p, directory_p):
+    return lava_tube(tuple(size_p)).carve_tubes
+
+
+def setup_smooth(size_p, directory_p):
+    tube = lava_tube(tuple(size_p))
+    tube.carve_tubes()
+    return tube.smooth
+
+
+def duplicated_pairs(size_p):
+    random = np.random.default_rng(SEED)
+    pairs = random.integers(1, max(2, int(size_p) // 4), size=(int(size_p), 2))
+    return [tuple(pair) for pair in pairs.tolist()]
+
+
+def setup_remove_duplicate_tuples(size_p, directory_p):
+    from tools import Tools
+
+    pairs = duplicated_pairs(size_p)
+    return lambda: Tools.remove_dupliacte_tuples(pairs)
+
+
+def setup_remove_duplicate_none_list(size_p, directory_p):
+    from tools import Tools
+
+    values = [value if value % 7 else None for value in np.random.default_rng(SEED).integers(0, int(size_p) // 2, size=int(size_p)).tolist()]
+    return lambda: Tools.remove_duplicate_none_list(values)
+
+
+# name: (setup, unit of the sizes, default sizes, full sizes); sizes are node counts unless stated.
+# The frontier growth mode only pays off when the frontier grows: "branching" graphs have up to 3
+# children per node (1.5 on average, 1 with the default MAX_CREATED_NODE_ON_CIRCLE)
+BENCHMARKS = {
+    'gaussian_perlin': (growth_benchmark("gaussian_perlin"), "nodes", (1e2, 1e3, 1e4), (1e2, 1e3, 1e4, 1e5, 1e6)),
+    'gaussian_perlin_frontier': (growth_benchmark("gaussian_perlin", "frontier"), "nodes", (1e2, 1e3, 1e4), (1e2, 1e3, 1e4, 1e5, 1e6)),
+    'gaussian_perlin_branching': (growth_benchmark("gaussian_perlin", max_created_p=3), "nodes", (1e4, 1e5), (1e4, 1e5, 1e6)),
+    'gaussian_perlin_branching_frontier': (growth_benchmark("gaussian_perlin", "frontier", 3), "nodes", (1e4, 1e5), (1e4, 1e5, 1e6)),
+    'mine': (growth_benchmark("mine"), "nodes", (1e3, 1e4, 1e5, 1e6), (1e3, 1e4, 1e5, 1e6)),
+    'save_graph': (setup_save_graph, "nodes", (1e2, 1e3, 1e4), (1e2, 1e3, 1e4, 1e5)),
+    'load_graph': (setup_load_graph, "nodes", (1e2, 1e3, 1e4), (1e2, 1e3, 1e4, 1e5)),
+    'load_graph_json': (setup_load_graph_json, "nodes", (1e2, 1e3, 1e4), (1e2, 1e3, 1e4, 1e5)),
+    'voxelize': (setup_voxelize, "voxel size", (2.0, 1.2), (2.0, 1.2, 0.8, 0.6)),
+    'extract_surface': (setup_extract_surface, "voxel size", (2.0, 1.2), (2.0, 1.2, 0.8, 0.6)),
+    'carve_tubes': (setup_carve_tubes, "volume shape", ((120, 60, 40),), ((120, 60, 40), (240, 100, 64))),
+    'smooth': (setup_smooth, "volume shape", ((120, 60, 40), (240, 100, 64)), ((120, 60, 40), (240, 100, 64), (480, 200, 128))),
+    'remove_duplicate_tuples': (setup_remove_duplicate_tuples, "tuples", (1e4, 1e5), (1e4, 1e5, 1e6)),
+    'remove_duplicate_none_list': (setup_remove_duplicate_none_list, "elements", (1e4, 1e5), (1e4, 1e5, 1e6)),
+}
+
+
+def size_key(size_p):
+    return "x".join(str(length) for length in size_p) if isinstance(size_p, tuple) else f"{size_p:g}"
+
+
+def size_value(size_p, unit_p):
+    """
+    Return the amount of work of a size: number of nodes or elements, of voxels for a volume shape or a voxel size
+    """
+    if unit_p == "volume shape":
+        return float(np.prod(size_p))
+    if unit_p == "voxel size":
+        return float(size_p) ** -3
+    return float(size_p)
+
+
+def time_benchmark(setup_p, size_p, directory_p, repeat_p):
+    """
+    Return the best wall time (seconds) of repeat_p runs of a benchmark, each on a new setup (the
+    prints and progress bars are dropped). The runs longer than 10 seconds are not repeated.
+    """
+    best = float("inf")
+    for _ in range(repeat_p):
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            function = setup_p(size_p, directory_p)
+            start = time.perf_counter()
+            function()
+            duration = time.perf_counter() - start
+        best = min(best, duration)
+        if duration > 10:
+            break
+    return best
+
+
+def run_benchmarks(names_p, full_p=False, repeat_p=3):
+    """
+    Return {benchmark name: {'unit', 'times': {size: seconds}, 'scaling': fitted exponent}} or {'skipped': reason}
+    """
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="plume_benchmark_") as directory:
+        for name in names_p:
+            setup, unit, sizes, full_sizes = BENCHMARKS[name]
+            times = {}
+            try:
+                for size in (full_sizes if full_p else sizes):
+                    times[size] = time_benchmark(setup, size, directory, repeat_p)
+                    print(f"\t-{name} ({unit} {size_key(size)}): {times[size]:.4f} seconds")
+            except ImportError as error:
+                results[name] = {'skipped': f"missing dependency ({error.name})"}
+                print(f"\t{Color.WARNING.value}-{name} skipped: missing dependency ({error.name}){Color.ENDC.value}")
+                continue
+            # Scaling exponent: slope of log(time) against log(size)
+            sizes_fitted = [size for size in times if times[size] > 0]
+            scaling = float(np.polyfit(np.log([size_value(size, unit) for size in sizes_fitted]), np.log([times[size] for size in sizes_fitted]), 1)[0]) if len(sizes_fitted) > 1 else None
+            results[name] = {'unit': unit, 'times': {size_key(size): duration for size, duration in times.items()}, 'scaling': scaling}
+    return results
+
+
+def find_regressions(results_p, baseline_p, tolerance_p):
+    """
+    Return the (benchmark, size, seconds, baseline seconds) slower than the baseline by more than tolerance_p (ratio)
+    """
+    regressions = []
+    for name, result in results_p.items():
+        reference = baseline_p.get('results', {}).get(name, {}).get('times', {})
+        for size, duration in result.get('times', {}).items():
+            if size in reference and duration > reference[size] * (1 + tolerance_p) and duration - reference[size] > MIN_REGRESSION_SECONDS:
+                regressions.append((name, size, duration, reference[size]))
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=Config.PLUME_DIR.value, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks of the Python stages of PLUME", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-only", help="Benchmarks to run", nargs='+', choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument("-full", help="Large sizes (up to 1e6 nodes, can take hours)", action="store_true")
+    parser.add_argument("-repeat", help="Repetitions of every size (best time kept)", type=int, default=3)
+    parser.add_argument("-tolerance", help="Slowdown against the baseline flagged as a regression (0.25: 25%%)", type=float, default=0.25)
+    parser.add_argument("-save-baseline", help="Save the results as the new baseline", action="store_true")
+    parser.add_argument("-dir", help="Directory of the history and of the baseline", type=str, default=BENCHMARK_DIR)
+    parser.add_argument("-growth-modes", help="Also compare the statistics of the graphs grown by the sequential and the frontier modes (graphs of this number of nodes)", type=int)
+    arguments = vars(parser.parse_args())
+
+    print(f"{Color.OKBLUE.value} == Benchmarks == {Color.ENDC.value}")
+    run = {
+        'date': datetime.datetime.now().strftime("%Y_%m_%d_%H_%M_%S"),
+        'commit': git_commit(),
+        'machine': {'platform': platform.platform(), 'processor': platform.processor(), 'cpus': os.cpu_count(), 'python': platform.python_version()},
+        'full': arguments['full'],
+        'results': run_benchmarks(arguments['only'], arguments['full'], max(1, arguments['repeat'])),
+    }
+    if arguments['growth_modes']:
+        # Same distributions expected: a p value below 0.01 flags a statistic that differs between the modes
+        run['growth_modes'] = {}
+        for max_created in (Config.MAX_CREATED_NODE_ON_CIRCLE.value, 3):
+            comparison = compare_growth_modes(arguments['growth_modes'], max_created)
+            run['growth_modes'][str(max_created)] = comparison
+            print(f"\n{Color.BOLD.value}Sequential against frontier growth ({arguments['growth_modes']} nodes, up to {max_created} children){Color.ENDC.value}")
+            for name, statistic in comparison.items():
+                color = Color.FAIL.value if statistic['p_value'] < 0.01 else Color.OKGREEN.value
+                print(f"\t{color}-{name}: mean {statistic['sequential']:.3f} against {statistic['frontier']:.3f} (KS {statistic['ks']:.3f}, p value {statistic['p_value']:.3f}){Color.ENDC.value}")
+
+    os.makedirs(arguments['dir'], exist_ok=True)
+    history_path = os.path.join(arguments['dir'], "history.json")
+    history = []
+    if os.path.exists(history_path):
+        with open(history_path) as infile:
+            history = json.load(infile)
+    history.append(run)
+    with open(history_path, "w") as outfile:
+        json.dump(history, outfile, indent=4)
+
+    print(f"\n{Color.BOLD.value}Scaling exponents (1: linear){Color.ENDC.value}")
+    for name, result in run['results'].items():
+        if result.get('scaling') is not None:
+            print(f"\t-{name}: {result['scaling']:.2f}")
+
+    baseline_path = os.path.join(arguments['dir'], "baseline.json")
+    regressions = []
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as infile:
+            baseline = json.load(infile)
+        regressions = find_regressions(run['results'], baseline, arguments['tolerance'])
+        print(f"\n{Color.BOLD.value}Against the baseline of {baseline['date']} (commit {baseline['commit']}){Color.ENDC.value}")
+        if baseline.get('machine') != run['machine']:
+            print(f"\t{Color.WARNING.value}-The baseline was measured on another machine ({baseline.get('machine', {}).get('processor') or baseline.get('machine', {}).get('platform')}, {baseline.get('machine', {}).get('cpus')} CPUs): save a baseline of this machine with -save-baseline{Color.ENDC.value}")
+        for name, size, duration, reference in regressions:
+            print(f"\t{Color.FAIL.value}-Regression: {name} ({size}) {duration:.4f} seconds instead of {reference:.4f} (+{100*(duration/reference - 1):.0f}%){Color.ENDC.value}")
+        if not regressions:
+            print(f"\t{Color.OKGREEN.value}-No regression{Color.ENDC.value}")
+    elif not arguments['save_baseline']:
+        print(f"\n{Color.WARNING.value}No baseline in {baseline_path}: nothing compared (save one with -save-baseline){Color.ENDC.value}")
+    if arguments['save_baseline']:
+        with open(baseline_path, "w") as outfile:
+            json.dump(run, outfile, indent=4)
+        print(f"\t-Baseline saved in {baseline_path}")
+    sys.exit(1 if regressions else 0)
@@ -3,12 +3,13 @@
 import sys
 import os
 import bpy, bmesh
-import json
+import numpy as np
 
 from bpy import context
 from  mathutils import Vector
 import random as rd
 import time
+import json
 
 
 # Get the path of the PLUME directory
@@ -21,19 +22,26 @@ if blend_dir not in sys.path:
    sys.path.append(blend_dir)
 
 from config import Config, Color
+from graph_io import load_graph_arrays
+from blender_pool import WORKER_PREFIX
+from resources import peak_memory, reset_peak_memory
+from instrumentation import span
 
 
 
 class MeshGeneration:
-   def __init__(self, generation_name_p, index_p, graph_path_p) -> None:
+   def __init__(self, generation_name_p, index_p, graph_path_p, seed_p=None) -> None:
       self.generation_name = str(generation_name_p)
       self.index = str(index_p)
-      self.path = graph_path_p+"/data.json"
+      self.path = graph_path_p
       self.saved_mesh_path = Config.PLUME_DIR.value+"/data/"+self.generation_name+"/"+self.index+"/mesh."+Config.MESH_FORMAT.value
       self.saved_texture_path = Config.PLUME_DIR.value+"/data/"+self.generation_name+"/"+self.index+"/"
-      self.json_file = open(self.path)
-      self.data = json.load(self.json_file)
+      self.graph = load_graph_arrays(self.path)
+      self.data = self.graph.metadata
       self.generation_dimension = self.data['generation_dimension']
+      # Mesh seed given by the generator, or the one recorded with the graph
+      seed = seed_p if seed_p is not None else self.data.get('seed', {}).get('mesh_seed')
+      self.random = rd.Random(seed)
 
       self.obj = None
       self.mesh = None
@@ -50,8 +58,9 @@ class MeshGeneration:
       print(f"{Color.BOLD.value}Start graph loading process{Color.ENDC.value}")
 
       # Extract and load data
-      verts, edges = self.extract_mesh_data()
-      result_loading = self.load_mesh_in_blender(verts_p=verts, edges_p=edges)
+      with span("blender_load", nodes=len(self.graph.ids)):
+         verts, edges = self.extract_mesh_data()
+         result_loading = self.load_mesh_in_blender(verts_p=verts, edges_p=edges)
       if result_loading == -1:
          print(f"{Color.FAIL.value}There was a problem while creating the mesh{Color.ENDC.value}")
          exit()
@@ -62,11 +71,13 @@ class MeshGeneration:
 
       # First decimation process (lower the number of polys for better performance)
       if Config.HIGH_POLY.value:
-         self.decimate_mesh_polys()
+         with span("decimation"):
+            self.decimate_mesh_polys()
       
       # Slice mesh
       if Config.SLICE_MESH.value:
-         self.slice_mesh()
+         with span("slicing"):
+            self.slice_mesh()
          
       else:
          self.chunks = bpy.context.scene.objects.items()
@@ -79,7 +90,8 @@ class MeshGeneration:
             chunck_number = i + 1
             bpy.context.view_layer.objects.active = self.chunks[i][1]
             print(f"{Color.OKBLUE.value}\n ==== Chuck {chunck_number}/{len(self.chunks)} ==== {Color.ENDC.value}")
-            self.bake_texture(self.material)
+            with span("chunk", chunk=chunck_number):
+               self.bake_texture(self.material)
             self.chunks[i][1].select_set(False)
          
          print("\nAll chunks are baked, proceeding to apply the textures\n")
@@ -95,50 +107,36 @@ class MeshGeneration:
 
       # Final decimation process
       if Config.HIGH_POLY.value and Config.FINAL_DECIMATION.value:
-         self.final_decimate_mesh_polys()
+         with span("final_decimation"):
+            self.final_decimate_mesh_polys()
       
       bpy.ops.object.select_all(action='SELECT')
 
       # Export the mesh
       if Config.SAVE_MESH.value:
-         self.export_mesh()
-      
-     
-
-      self.json_file.close()
+         with span("export", format=Config.MESH_FORMAT.value):
+            self.export_mesh()
 
 
    def initial_cleanup(self):
       """
-      Remove the default object of Blender
+      Remove the default object of Blender (already removed by reset_scene in a worker)
       """
       bpy.ops.object.select_all(action='DESELECT')
-      bpy.data.objects['Cube'].select_set(True)
-      bpy.ops.object.delete()
-      bpy.data.objects['Camera'].select_set(True)
-      bpy.ops.object.delete()
-      bpy.data.objects['Light'].select_set(True)
-      bpy.ops.object.delete()
+      for name in ('Cube', 'Camera', 'Light'):
+         if name in bpy.data.objects:
+            bpy.data.objects[name].select_set(True)
+            bpy.ops.object.delete()
 
 
    def extract_mesh_data(self):
       """
-      Load graph data into python variables (from a dictionary)
-      -Use [node_id]["coordinates"]["x"] or ["y"]
+      Load graph data as flat arrays (from the binary graph columns)
+      -Vertices are the node coordinates, edges are pairs of vertex indices
       """
       print("\t-Begin extraction of points")
-      verts, edges = [], []
-      for i in self.data['nodes']:
-         verts.append([
-            self.data['nodes'][i]["coordinates"]['x'],
-            self.data['nodes'][i]["coordinates"]['y'],
-            self.data['nodes'][i]["coordinates"]['z'],
-         ])
-         for edge in self.data['nodes'][i]['edges']:
-            edges.append([
-               self.data['nodes'][i]['id'],
-               edge
-            ])
+      verts = np.ascontiguousarray(self.graph.positions, dtype=np.float32)
+      edges = np.ascontiguousarray(self.graph.edges, dtype=np.int32)
       print("\t-Extraction done")
       return verts, edges
    
@@ -156,7 +154,11 @@ class MeshGeneration:
       col.objects.link(self.obj)
       bpy.context.view_layer.objects.active = self.obj
 
-      self.mesh.from_pydata(verts, edges, [])
+      self.mesh.vertices.add(len(verts))
+      self.mesh.vertices.foreach_set("co", verts.ravel())
+      self.mesh.edges.add(len(edges))
+      self.mesh.edges.foreach_set("vertices", edges.ravel())
+      self.mesh.update()
       
       #Merge points by distance = better graph and improved geometry
       bpy.ops.object.editmode_toggle()
@@ -196,12 +198,10 @@ class MeshGeneration:
       bpy.context.object.modifiers["Displace"].texture = self.create_voronoi_texture()
       print("\t-Displacement done")
 
-      # Apply modifiers
-      apply_mod = bpy.ops.object.modifier_apply(modifier='Subdivision')
-      apply_mod = bpy.ops.object.modifier_apply(modifier='Skin') # Create a mesh skin arount the graph
-      apply_mod = bpy.ops.object.modifier_apply(modifier='GeometryNodes')
-      apply_mod = bpy.ops.object.modifier_apply(modifier='Subdivision.001')
-      apply_mod = bpy.ops.object.modifier_apply(modifier='Displace')
+      # Apply modifiers (Skin: create a mesh skin arount the graph)
+      for modifier in ('Subdivision', 'Skin', 'GeometryNodes', 'Subdivision.001', 'Displace'):
+         with span("apply_modifier", modifier=modifier):
+            apply_mod = bpy.ops.object.modifier_apply(modifier=modifier)
       print(f"{Color.BOLD.value}Modifiers applied{Color.ENDC.value}")
 
 
@@ -213,7 +213,7 @@ class MeshGeneration:
       size = 0.2
       sign = 0.001
       for vert_index in range(len(obj.data.vertices)):
-         invert_prob = rd.randint(1,3)
+         invert_prob = self.random.randint(1,3)
          if invert_prob == 1:
             sign *= -1
          obj.data.skin_vertices[''].data[vert_index].radius = (size*2, size)
@@ -576,10 +576,9 @@ class MeshGeneration:
       uv_layer.active
       bpy.ops.object.editmode_toggle()
       bpy.ops.mesh.select_all(action='SELECT')
-      t1 = time.time()
-      uv_map = bpy.ops.uv.smart_project()
-      t2 = time.time()
-      end_time = (t2-t1)/60
+      with span("uv") as record:
+         uv_map = bpy.ops.uv.smart_project()
+      end_time = record['wall']/60
       print(f"\t-UV map Done, process took {int(end_time)} minutes and {round(end_time%1*60, 3)} seconds")
       bpy.ops.object.editmode_toggle()
       print(f"{Color.BOLD.value}UV map completed{Color.ENDC.value}")
@@ -620,7 +619,7 @@ class MeshGeneration:
 
       # get_devices() to let Blender detects GPU device
       print(f"\t{Color.UNDERLINE.value}Configuration:{Color.ENDC.value}")
-      bpy.context.preferences.addons["cycles"].preferences.get_devices()
+      detect_devices()
       print("\t-",bpy.context.preferences.addons["cycles"].preferences.compute_device_type)
       for d in bpy.context.preferences.addons["cycles"].preferences.devices:
          # d["use"] = 1 # Using all devices, include GPU and CPU
@@ -633,10 +632,9 @@ class MeshGeneration:
       material.node_tree.nodes.active = color_image_node
       obj.select_set(True)
       bpy.context.view_layer.objects.active = obj
-      t1 = time.time()
-      bpy.ops.object.bake(type='DIFFUSE', save_mode='EXTERNAL')
-      t2 = time.time()
-      end_time = (t2-t1)/60
+      with span("bake", map="color", texture_size=Config.TEXTURE_SIZE.value) as record:
+         bpy.ops.object.bake(type='DIFFUSE', save_mode='EXTERNAL')
+      end_time = record['wall']/60
       print(f"\t-Texture baked, process took {int(end_time)} minutes and {round(end_time%1*60, 3)} seconds")
       color_image.save_render(filepath= self.saved_texture_path + f'color_texture_{obj.name}.png')
       print("\t-Image saved")
@@ -650,10 +648,9 @@ class MeshGeneration:
       bpy.context.scene.cycles.bake_type = 'NORMAL'
       obj.select_set(True)
       bpy.context.view_layer.objects.active = obj
-      t1 = time.time()
-      bpy.ops.object.bake(type='NORMAL', save_mode='EXTERNAL')
-      t2 = time.time()
-      end_time = (t2-t1)/60
+      with span("bake", map="normal", texture_size=Config.TEXTURE_SIZE.value) as record:
+         bpy.ops.object.bake(type='NORMAL', save_mode='EXTERNAL')
+      end_time = record['wall']/60
       print(f"\t-Texture baked, process took {int(end_time)} minutes and {round(end_time%1*60, 3)} seconds")
       normal_image.save_render(filepath= self.saved_texture_path + f'normal_texture_{obj.name}.png')
       print("\t-Image saved")
@@ -668,10 +665,9 @@ class MeshGeneration:
       bpy.context.scene.cycles.bake_type = 'ROUGHNESS'
       obj.select_set(True)
       bpy.context.view_layer.objects.active = obj
-      t1 = time.time()
-      bpy.ops.object.bake(type='ROUGHNESS', save_mode='EXTERNAL')
-      t2 = time.time()
-      end_time = (t2-t1)/60
+      with span("bake", map="roughness", texture_size=Config.TEXTURE_SIZE.value) as record:
+         bpy.ops.object.bake(type='ROUGHNESS', save_mode='EXTERNAL')
+      end_time = record['wall']/60
       print(f"\t-Texture baked, process took {int(end_time)} minutes and {round(end_time%1*60, 3)} seconds")
       roughness_image.save_render(filepath= self.saved_texture_path + f'roughness_texture_{obj.name}.png')
       print("\t-Image saved")
@@ -906,7 +902,65 @@ class MeshGeneration:
 
 
 
+_devices_detected = False
+
+def detect_devices():
+   """
+   Let Blender detect the Cycles devices, once per Blender process (a worker bakes many meshes)
+   """
+   global _devices_detected
+   if not _devices_detected:
+      bpy.context.preferences.addons["cycles"].preferences.get_devices()
+      _devices_detected = True
+
+
+def reset_scene():
+   """
+   Remove every object and data block left by the previous job of a worker
+   """
+   for collection in (bpy.data.objects, bpy.data.meshes, bpy.data.materials, bpy.data.images, bpy.data.node_groups,
+                      bpy.data.textures, bpy.data.collections, bpy.data.cameras, bpy.data.lights):
+      for block in list(collection):
+         collection.remove(block)
+
+
+def report(status_p):
+   """
+   Send the status of a job to the worker pool (blender_pool.py)
+   """
+   print(WORKER_PREFIX + json.dumps(status_p), flush=True)
+
+
+def serve():
+   """
+   Persistent worker: mesh jobs are read from stdin, one json line each (graph, index, name, seed, job)
+   """
+   for line in sys.stdin:
+      if not line.strip():
+         continue
+      job = json.loads(line)
+      start = time.time()
+      report({'job': job['job'], 'status': 'started'})
+      reset_peak_memory()
+      try:
+         reset_scene()
+         with span("blender_mesh", index=job['index']):
+            MeshGeneration(index_p=job['index'], generation_name_p=job['name'], graph_path_p=job['graph'], seed_p=job.get('seed'))
+         report({'job': job['job'], 'status': 'done', 'duration': time.time() - start, 'error': None, 'peak_memory': peak_memory()})
+      except (Exception, SystemExit) as error:
+         # exit() of a failed mesh only ends the job
+         report({'job': job['job'], 'status': 'failed', 'duration': time.time() - start, 'error': repr(error)})
+
+
 if __name__ == '__main__':
-   generator = MeshGeneration(index_p=sys.argv[-3],
-                              generation_name_p= sys.argv[-1],
-                              graph_path_p=sys.argv[-5])
\ No newline at end of file
+   # Arguments given after "--" to Blender: -g <graph path> -index <index> -name <name> [-seed <seed>], or -worker
+   arguments = sys.argv[sys.argv.index("--")+1:]
+   if "-worker" in arguments:
+      serve()
+   else:
+      options = dict(zip(arguments[::2], arguments[1::2]))
+      with span("blender_mesh", index=options['-index']):
+         generator = MeshGeneration(index_p=options['-index'],
+                                    generation_name_p=options['-name'],
+                                    graph_path_p=options['-g'],
+                                    seed_p=int(options['-seed']) if '-seed' in options else None)
\ No newline at end of file
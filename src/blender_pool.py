@@ -0,0 +1,94 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Pool of persistent headless Blender workers (blender.py -worker).
+Blender is started once per worker instead of once per mesh: the startup, the add-ons and the
+Cycles devices are initialized once, and the scene is reset between two jobs. A job is sent on the
+stdin of a worker as one json line; the worker streams its output back on stdout, where the lines
+starting with WORKER_PREFIX hold the status of the job (started, done or failed, with its duration).
+Only the standard library is used here: this module is also imported by blender.py.
+"""
+import json
+import queue
+import subprocess
+import time
+
+WORKER_PREFIX = "PLUME_WORKER "
+
+
+class BlenderWorker:
+    def __init__(self, blender_path_p, script_path_p, name_p="blender"):
+        self.name = name_p
+        self.process = subprocess.Popen([blender_path_p, "--background", "--python", script_path_p, "--", "-worker"],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1)
+        self.nb_jobs = 0
+
+
+    def alive(self):
+        return self.process.poll() is None
+
+
+    def run(self, job_p):
+        """
+        Send a job (json serializable dict) and wait for its status. The output of Blender is printed.
+        Return the final status: {'job', 'status': 'done' or 'failed', 'duration', 'error'} ('peak_memory' when done).
+        """
+        job = dict(job_p, job=self.nb_jobs)
+        self.nb_jobs += 1
+        start = time.time()
+        try:
+            self.process.stdin.write(json.dumps(job) + "\n")
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError) as error:
+            return {'job': job['job'], 'status': 'failed', 'duration': 0.0, 'error': f"worker {self.name} is not running ({error})"}
+        for line in self.process.stdout:
+            if not line.startswith(WORKER_PREFIX):
+                print(line, end="")
+                continue
+            status = json.loads(line[len(WORKER_PREFIX):])
+            if status['job'] == job['job'] and status['status'] in ("done", "failed"):
+                return status
+        return {'job': job['job'], 'status': 'failed', 'duration': time.time() - start, 'error': f"worker {self.name} exited with code {self.process.wait()}"}
+
+
+    def close(self):
+        if self.alive():
+            self.process.stdin.close()
+            self.process.wait()
+
+
+class BlenderPool:
+    def __init__(self, blender_path_p, script_path_p, nb_workers_p=1):
+        """
+        nb_workers_p workers, started on first use. Thread safe: every job takes an idle worker.
+        """
+        self.blender_path = blender_path_p
+        self.script_path = script_path_p
+        self.nb_workers = max(1, int(nb_workers_p))
+        self._idle = queue.Queue()
+        for worker in range(self.nb_workers):
+            self._idle.put(None)
+        self._workers = []
+        self.nb_started = 0
+
+
+    def run(self, job_p):
+        """
+        Run a job on an idle worker (a new worker is started if it was never started or has died).
+        Return the final status of the job.
+        """
+        worker = self._idle.get()
+        try:
+            if worker is None or not worker.alive():
+                worker = BlenderWorker(self.blender_path, self.script_path, f"blender-{self.nb_started}")
+                self.nb_started += 1
+                self._workers.append(worker)
+            return worker.run(job_p)
+        finally:
+            self._idle.put(worker)
+
+
+    def close(self):
+        for worker in self._workers:
+            worker.close()
+        self._workers = []
@@ -0,0 +1,259 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Content-addressed cache of the outputs of the generation stages (graph, preview, mesh).
+The key of a stage is the hash of the Config fields the stage reads, of its inputs (seed and index
+for the graph, digest of the graph arrays for the preview and mesh stages) and of the source code
+of the stage (the modules listed in STAGE_MODULES). The output files of a stage are stored once, by
+content digest, in CACHE_DIR/objects and listed in a manifest (CACHE_DIR/entries/<key>.json). A stage
+whose key is already known is skipped: its outputs are hard linked (copied across file systems) into
+the output directory. Entries are evicted least recently used first once the stored objects exceed
+CACHE_MAX_SIZE_GB, several processes (sweep workers) can share the same cache directory.
+"""
+import fnmatch
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+from config import Config
+
+
+# Config fields read by every stage: changing any other field keeps the outputs of the stage
+STAGE_FIELDS = {
+    'graph': ('NB_NODES', 'GENERATION_SIZE', 'TYPE_OF_UNDERGROUND', 'THREE_DIMENSION_GENERATION', 'MAX_CREATED_NODE_ON_CIRCLE',
+              'MAX_RADIUS_NODE', 'DEFAULT_LOOP_CLOSURE_PROBABILITY', 'LOOP_CLOSURE_DISTANCE', 'LOOP_CLOSURE_MIN_HOPS',
+              'LOOP_CLOSURE_MAX_EDGES_PER_NODE', 'LOOP_CLOSURE_MAX_FRACTION',
+              'SELECTED_ALGORITHM', 'GROWTH_MODE', 'OCCUPANCY_GRID', 'OCCUPANCY_CELL_SIZE', 'OCCUPANCY_EXEMPT_HOPS',
+              'OCCUPANCY_RETRIES', 'REGIONS', 'REGION_STITCH_DISTANCE', 'NB_LAYERS', 'LAYER_PASSAGES', 'STALL_LIMIT',
+              'STALL_MAX_RECOVERIES', 'STALL_RADIUS_FACTOR', 'GRAPH_STORAGE', 'GRAPH_ANALYTICS', 'MEAN', 'STANDARD_DEVIATION',
+              'Z_AXIS_GAUSSIAN_MEAN', 'Z_AXIS_GAUSSIAN_STANDARD_DEVIATION', 'Z_AXIS_LAYER_PROB', 'Z_AXIS_LAYER_STEP',
+              'Z_AXIS_STEP_DOWN_XY_SHIFT', 'MAX_SCALE', 'MAX_OCTAVES', 'MAX_PERSISTENCE', 'MAX_LACUNARITY', 'NOISE_BANK_SIZE'),
+    'preview': ('GENERATE_GRAPH_IMAGE', 'ANIMATE', 'THEME', 'IMAGE_FORMAT'),
+    'mesh': ('MESH_FORMAT', 'SAVE_MESH', 'BAKE_TEXTURE', 'TEXTURE_SIZE', 'MAX_MESH_TRIANGLES', 'FINAL_DECIMATION',
+             'FINAL_DECIMATION_FACTOR', 'HIGH_POLY', 'SLICE_MESH', 'NUMBER_OF_CHUNKS'),
+}
+
+# Modules whose code changes the outputs of every stage (the graph stage also runs the modules of the
+# registered algorithms), to extend when a stage starts using a new module. config.py is left out: the
+# settings a stage reads are already in its key (STAGE_FIELDS).
+STAGE_MODULES = {
+    'graph': ('generation', 'algorithm', 'sampling', 'noise_bank', 'occupancy', 'registry', 'regions', 'layers',
+              'graph', 'array_graph', 'node', 'spatial_index', 'graph_stream', 'graph_io', 'analytics'),
+    'preview': ('display', 'graph_io'),
+    'mesh': ('blender', 'graph_io'),
+}
+
+# Age (seconds) under which an object no entry uses may belong to a store in progress (another sweep
+# worker sharing the cache directory) and is kept by the eviction
+ORPHAN_GRACE_PERIOD = 3600
+
+# Files written by every stage in the directory of its graph
+STAGE_OUTPUTS = {
+    'graph': ('data.json', 'graph_arrays/*'),
+    'preview': ('cave_graph.png', 'cave_bone_then_mesh.mp4'),
+    'mesh': ('mesh.*', '*_texture_*.png'),
+}
+
+
+def stage_sources(stage_p):
+    """
+    Return the sorted source files (in src) of the modules of a stage
+    """
+    from registry import ALGORITHMS
+
+    modules = set(STAGE_MODULES[stage_p])
+    if stage_p == "graph":
+        modules.update(module for module, _ in ALGORITHMS.values())
+    return sorted(module + ".py" for module in modules)
+
+
+def file_digest(path_p):
+    digest = hashlib.sha256()
+    with open(path_p, 'rb') as infile:
+        for chunk in iter(lambda: infile.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def graph_digest(graph_directory_p):
+    """
+    Return the digest of the columns of the graph saved in graph_directory_p and of its mesh seed
+    (the rest of the metadata, such as the date, does not change the preview or the mesh).
+    """
+    from graph_io import COLUMNS, load_graph_arrays
+
+    graph = load_graph_arrays(graph_directory_p)
+    digest = hashlib.sha256()
+    for column in COLUMNS:
+        array = np.ascontiguousarray(getattr(graph, column))
+        digest.update(f"{column}{array.dtype}{array.shape}".encode())
+        digest.update(array.tobytes())
+    digest.update(json.dumps(graph.metadata.get('seed', {}).get('mesh_seed')).encode())
+    return digest.hexdigest()
+
+
+class StageCache:
+    def __init__(self, directory_p=None, max_size_p=None):
+        """
+        max_size_p is the disk budget of the stored objects, in bytes.
+        """
+        self.directory = directory_p if directory_p is not None else Config.CACHE_DIR.value
+        self.max_size = max_size_p if max_size_p is not None else int(Config.CACHE_MAX_SIZE_GB.value * 1e9)
+        self.objects = os.path.join(self.directory, "objects")
+        self.entries = os.path.join(self.directory, "entries")
+        self._code = {}
+
+
+    def code_version(self, stage_p):
+        if stage_p not in self._code:
+            digest = hashlib.sha256()
+            for source in stage_sources(stage_p):
+                digest.update(source.encode())
+                digest.update(open(os.path.join(os.path.dirname(__file__), source), 'rb').read())
+            self._code[stage_p] = digest.hexdigest()
+        return self._code[stage_p]
+
+
+    def key(self, stage_p, inputs_p):
+        """
+        Return the cache key of a stage for its inputs (json serializable dict).
+        """
+        description = {
+            'stage': stage_p,
+            'fields': {name: getattr(Config, name).value for name in STAGE_FIELDS[stage_p]},
+            'inputs': inputs_p,
+            'code': self.code_version(stage_p),
+        }
+        return hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()
+
+
+    def _entry_path(self, key_p):
+        return os.path.join(self.entries, key_p + ".json")
+
+
+    def _object_path(self, digest_p):
+        return os.path.join(self.objects, digest_p[:2], digest_p)
+
+
+    @staticmethod
+    def _link(source_p, destination_p):
+        """
+        Hard link source_p to destination_p (copy across file systems), replacing destination_p.
+        """
+        os.makedirs(os.path.dirname(destination_p), exist_ok=True)
+        temporary = f"{destination_p}.{os.getpid()}.tmp"
+        try:
+            os.link(source_p, temporary)
+        except OSError:
+            shutil.copy2(source_p, temporary)
+        os.replace(temporary, destination_p)
+
+
+    @staticmethod
+    def _snapshot(directory_p, patterns_p):
+        files = {}
+        for root, _, names in os.walk(directory_p):
+            for name in names:
+                path = os.path.relpath(os.path.join(root, name), directory_p)
+                if any(fnmatch.fnmatch(path, pattern) for pattern in patterns_p):
+                    stat = os.stat(os.path.join(root, name))
+                    files[path] = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+        return files
+
+
+    def restore(self, key_p, directory_p):
+        """
+        Link the outputs of the entry key_p into directory_p. Return False if the entry is unknown or incomplete.
+        """
+        try:
+            with open(self._entry_path(key_p)) as infile:
+                entry = json.load(infile)
+            for path, digest in entry['files'].items():
+                self._link(self._object_path(digest), os.path.join(directory_p, path))
+        except (OSError, ValueError, KeyError):
+            return False
+        # Most recently used
+        os.utime(self._entry_path(key_p))
+        return True
+
+
+    def store(self, key_p, directory_p, paths_p):
+        """
+        Store the files paths_p (relative to directory_p) as the outputs of the entry key_p.
+        """
+        files = {}
+        for path in paths_p:
+            digest = file_digest(os.path.join(directory_p, path))
+            if not os.path.exists(self._object_path(digest)):
+                self._link(os.path.join(directory_p, path), self._object_path(digest))
+            files[path] = digest
+        os.makedirs(self.entries, exist_ok=True)
+        temporary = f"{self._entry_path(key_p)}.{os.getpid()}.tmp"
+        with open(temporary, "w") as outfile:
+            json.dump({'files': files, 'time': time.time()}, outfile)
+        os.replace(temporary, self._entry_path(key_p))
+
+
+    def run(self, stage_p, inputs_p, directory_p, function_p):
+        """
+        Restore the outputs of the stage for these inputs in directory_p, or run function_p() and store
+        the files it wrote. Return True if the stage was restored from the cache.
+        """
+        key = self.key(stage_p, inputs_p)
+        if self.restore(key, directory_p):
+            return True
+        before = self._snapshot(directory_p, STAGE_OUTPUTS[stage_p])
+        function_p()
+        after = self._snapshot(directory_p, STAGE_OUTPUTS[stage_p])
+        self.store(key, directory_p, [path for path, stat in after.items() if before.get(path) != stat])
+        return False
+
+
+    def size(self):
+        return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(self.objects) for name in names)
+
+
+    def evict(self):
+        """
+        Remove the least recently used entries, then the objects no entry uses, until the objects fit
+        in the disk budget. Return the number of entries removed.
+        """
+        if not os.path.isdir(self.entries):
+            return 0
+        entries = sorted((os.path.join(self.entries, name) for name in os.listdir(self.entries) if name.endswith(".json")), key=os.path.getmtime)
+        used = {}
+        for path in entries:
+            with open(path) as infile:
+                used[path] = set(json.load(infile)['files'].values())
+        sizes = {}
+        for root, _, names in os.walk(self.objects):
+            for name in names:
+                sizes[name] = os.path.getsize(os.path.join(root, name))
+        total = sum(sizes.values())
+        nb_removed = 0
+        for path in entries:
+            if total <= self.max_size:
+                break
+            os.remove(path)
+            digests = used.pop(path)
+            nb_removed += 1
+            still_used = set().union(*used.values())
+            for digest in digests - still_used:
+                if digest in sizes:
+                    os.remove(self._object_path(digest))
+                    total -= sizes.pop(digest)
+        # Objects of interrupted stores, old enough not to belong to a store in progress
+        still_used = set().union(*used.values())
+        deadline = time.time() - ORPHAN_GRACE_PERIOD
+        for digest in [digest for digest in sizes if digest not in still_used]:
+            try:
+                if os.path.getmtime(self._object_path(digest)) < deadline:
+                    os.remove(self._object_path(digest))
+            except FileNotFoundError:
+                # Removed by the eviction of another worker
+                pass
+        return nb_removed
@@ -3,6 +3,7 @@
 from enum import Enum
 import os
 import sys
+import json
 import datetime
 
 class Config(Enum):
@@ -47,20 +48,51 @@ class Config(Enum):
     # ===========================
     MAX_CREATED_NODE_ON_CIRCLE = 2          # Maximal number of nodes created per nodes
     MAX_RADIUS_NODE = 7.0                   # Distance between the nodes
-    DEFAULT_LOOP_CLOSURE_PROBABILITY = 10   # Probability of connecting two close nodes
-    SELECTED_ALGORITHM = "gaussian_perlin"  # Available: gaussian_perlin, mine
+    DEFAULT_LOOP_CLOSURE_PROBABILITY = 10   # Probability of connecting two close nodes (percentage, 0 disables the loop closure)
+    LOOP_CLOSURE_DISTANCE = 2.5             # Maximal distance between two nodes connected by the loop closure (below the distance between the nodes and Z_AXIS_LAYER_STEP)
+    LOOP_CLOSURE_MAX_EDGES_PER_NODE = 1     # Maximal number of loop closure edges of one node
+    LOOP_CLOSURE_MAX_FRACTION = 0.02        # Maximal number of loop closure edges, as a fraction of the number of nodes
+    LOOP_CLOSURE_MIN_HOPS = 6               # Nodes already connected by this number of edges or less are not connected again
+    SELECTED_ALGORITHM = "gaussian_perlin"  # Available: gaussian_perlin, mine, lava_tube (see registry.py)
+    GROWTH_MODE = "sequential"              # gaussian_perlin only. Available: sequential (one node at a time), frontier (whole frontier expanded at once, array storage only, faster with MAX_CREATED_NODE_ON_CIRCLE above 2)
+    OCCUPANCY_GRID = False                  # Reject the new nodes whose sphere overlaps the cave grown elsewhere (coarse occupancy grid of the generation box)
+    OCCUPANCY_CELL_SIZE = 2.0               # Size of the occupancy grid cells (enlarged automatically for very large generation boxes)
+    OCCUPANCY_EXEMPT_HOPS = 3               # Ancestors (and their children) of a new node within this number of edges never collide with it
+    OCCUPANCY_RETRIES = 2                   # Number of times a colliding node is drawn again before being rejected (gaussian_perlin)
+    REGIONS = (1,1,1)                       # Number of regions along x, y, z. Every region is grown in its own process and the regions are stitched together ((1,1,1): one root at the origin)
+    REGION_WORKERS = None                   # Number of processes growing the regions (None: number of CPU cores)
+    REGION_STITCH_DISTANCE = 14.0           # Maximal length of the edges stitching the boundary nodes of two neighbouring regions
+    NB_LAYERS = 1                           # Number of horizontal layers grown in parallel (planar graphs, REGIONS still tiles x and y) and linked by sloped passages (1: no explicit layers)
+    LAYER_PASSAGES = 4                      # Number of passages between two adjacent layers
+    STALL_LIMIT = 32                        # gaussian_perlin: expansions of the last node in a row without any child before the growth restarts from a random node
+    STALL_MAX_RECOVERIES = 8                # Restarts in a row creating less than STALL_LIMIT nodes before the growth gives up (status "stalled" in data.json)
+    STALL_RADIUS_FACTOR = 0.5               # Distance of the children multiplied by this factor at every such restart, until a node is created
+    SEED = None                             # Root seed of the generation (None: random). Recorded in data.json to regenerate any graph identically
+    GRAPH_STORAGE = "array"                 # Available: array (NumPy struct-of-arrays, low memory), object (one Node object per node)
+    STREAM_GRAPH = False                    # Stream the graph to disk in blocks during the generation (checkpointed, resumable, array storage only). The loop closure, analytics and save load the graph columns back (about 100 bytes per node)
+    STREAM_BLOCK_SIZE = 100000              # Number of nodes per streamed block (and between two checkpoints), also the nodes written at once in data.json
+    GRAPH_ANALYTICS = True                  # Compute the graph analytics (components, cycles, tortuosity, diameter...) and save them in data.json
     MAX_MESH_TRIANGLES = 100000000          # 1Million triangles: 1000000 (Upper threshold for vscode obj visualizer)
     FINAL_DECIMATION = False
     FINAL_DECIMATION_FACTOR = 0.8           # Percentage of final mesh decimation (after texture baking). 0.8 means keep 80% of the polys number of the model
     GPU_ACCELERATION = True                 # Use the GPU instead of the GPU (Spead up the texture baking)
-    PARALLELIZATION = False                 # If true the prompt in the terminal might be inconsistent
+    PARALLELIZATION = False                 # Generate the graphs on every CPU core at once. If true the prompt in the terminal might be inconsistent
+    PREVIEW_WORKERS = 1                     # Number of graph pictures/animations made at once (while the next graphs are generated)
+    MESH_WORKERS = 1                        # Number of Blender processes at once (meshes of the previous graphs made while the next graphs are generated)
+    STAGE_CACHE = True                      # Reuse the graph, picture and mesh of a previous run with the same seed, settings and code (skipped stages)
+    CACHE_DIR = os.path.join(PLUME_DIR, "cache")  # Content-addressed store of the cached stage outputs
+    CACHE_MAX_SIZE_GB = 20                  # Disk budget of the cache, the least recently used outputs are evicted beyond it
+    MEMORY_BUDGET_GB = None                 # RAM the stage workers may use at once, checked against the estimated peak of every stage (None: MEMORY_SAFETY_FACTOR of the available RAM)
+    MEMORY_SAFETY_FACTOR = 0.9              # Share of the available RAM (and GPU memory) given to the stage workers
+    INSTRUMENTATION = True                  # Record the wall time, CPU time and peak memory of the stages and their steps in data/<name>/spans (merged in spans_report.json)
+    PROFILE_SPAN = None                     # Name of a span (growth, voxelize, bake...) to profile with cProfile, saved next to the spans
     HIGH_POLY = True                        # If false, the generation is significantly faster
     SLICE_MESH = True
     NUMBER_OF_CHUNKS = 4
 
     #Gaussian
     MEAN = 0.0
-    STANDARD_DEVIATION = 0.5
+    STANDARD_DEVIATION = 0.5                # Spread of the growth directions, fraction of a turn (converted to a wrapped normal distribution of the same concentration, 107 degrees for 0.5)
 
     Z_AXIS_GAUSSIAN_MEAN = 0.0                      #Shift the Z axis by this value
     Z_AXIS_GAUSSIAN_STANDARD_DEVIATION = 0.1        #Higher value here leads to more extremums
@@ -73,6 +105,7 @@ class Config(Enum):
     MAX_OCTAVES = 1.0
     MAX_PERSISTENCE = 5.0
     MAX_LACUNARITY = 2.0
+    NOISE_BANK_SIZE = 256                   # Number of precomputed noise profiles (direction distributions)
 
     
     # Blender
@@ -91,3 +124,24 @@ class Color(Enum):
     BOLD = '\033[1m'
     UNDERLINE = '\033[4m'
     CBLINK    = '\33[5m'
+
+
+def configure(overrides_p):
+    """
+    Return a new Config enum with the values of overrides_p ({field name: value}) instead of the defaults.
+    Config cannot be changed in place: its fields with equal values are aliases of the same member.
+    """
+    unknown = [name for name in overrides_p if name not in Config.__members__]
+    if unknown:
+        raise ValueError(f"Unknown Config fields: {', '.join(unknown)}")
+    values = {}
+    for name, member in Config.__members__.items():
+        value = overrides_p.get(name, member.value)
+        # Tuples are lists once saved in json
+        values[name] = tuple(value) if isinstance(member.value, tuple) and isinstance(value, list) else value
+    return Enum('Config', list(values.items()), module=__name__)
+
+
+# Settings of a sweep run (sweep.py), inherited by the worker processes and Blender
+if os.environ.get("PLUME_SETTINGS"):
+    Config = configure(json.loads(os.environ["PLUME_SETTINGS"]))
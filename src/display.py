@@ -3,9 +3,11 @@
 """
 Display a graph using Pyvista library
 """
-import json
+import os
 from tqdm import tqdm
 from config import Config
+from graph_io import load_graph_arrays
+from instrumentation import span
 import numpy as np
 import pyvista as pv
 import math
@@ -28,19 +30,10 @@ class Display():
         self.contours = None
 
     def load_graph(self):
-        with open(self.data_path) as f:
-            data = json.load(f)
-        nodes = data['nodes']
-
-        self.positions = np.array([[v['coordinates']['x'], v['coordinates']['y'], v['coordinates']['z']] for v in nodes.values()])
-        self.radii = np.array([self.node_radius for _ in nodes.values()])
-        edges = []
-        for nid, node in nodes.items():
-            nid = int(nid)
-            for nb in node['edges']:
-                if (nid, nb) not in edges and (nb, nid) not in edges:
-                    edges.append((nid, nb))
-        self.edges = edges
+        graph = load_graph_arrays(os.path.dirname(self.data_path))
+        self.positions = np.asarray(graph.positions)
+        self.radii = np.full(len(graph), self.node_radius)
+        self.edges = np.asarray(graph.edges)
 
     def voxelize(self):
         margin = 2 * max(self.node_radius, self.edge_radius)
@@ -106,9 +99,11 @@ class Display():
         self.grid = grid
 
     def extract_surface(self):
-        contours = self.grid.contour(isosurfaces=[0.5], scalars="cave")
+        with span("contour"):
+            contours = self.grid.contour(isosurfaces=[0.5], scalars="cave")
         if self.smoothing:
-            contours = contours.smooth(n_iter=self.n_iter, relaxation_factor=self.relaxation_factor)
+            with span("smoothing", iterations=self.n_iter):
+                contours = contours.smooth(n_iter=self.n_iter, relaxation_factor=self.relaxation_factor)
         self.contours = contours
 
     def plot(self):
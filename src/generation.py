@@ -1,29 +1,43 @@
 # SPDX-License-Identifier: BSD-3-Clause
 
 from graph import Graph
-from display import Display
+from array_graph import ArrayGraph
+from graph_stream import GraphStream
 from algorithm import Algorithm
+from regions import grow_regions, nb_regions
+from layers import grow_layers
+from scheduler import Stage, StageScheduler
+from blender_pool import BlenderPool
+from cache import StageCache, graph_digest
+from resources import PREVIEW_VOXEL_SIZE, estimate_stage, memory_budget
+from instrumentation import SPANS_DIRECTORY, configure, load_spans, merge_spans, span
 from config import Color, Config
 import subprocess
 import argparse
 import datetime
-import multiprocessing
 from tools import Tools
-import random as rd
+import numpy as np
 import time
 import json
 import os
 
 class Generator:
 
-    def __init__(self, name_p, graph_path_p) -> None:       
+    def __init__(self, name_p, graph_path_p, seed_p=None, indices_p=None) -> None:       
         # Get the number of graphs
         self.nb_graphs = Config.NB_GENERATION.value
+        self.indices = list(range(self.nb_graphs)) if indices_p is None else list(indices_p)
+
+        # Root seed of the generation: every graph index gets its own independent random streams
+        seed = seed_p if seed_p is not None else Config.SEED.value
+        self.root_seed = np.random.SeedSequence(seed).entropy
         self.visualization = Config.OPEN_VISUALIZATION.value
         self.graphs=[]
 
         self.starting_time = time.time()
         self.graph_path = []
+        self.blender_pool = None
+        self.cache = StageCache() if Config.STAGE_CACHE.value else None
 
         # Get the name of the current graph generation
         if name_p == None or '':
@@ -46,6 +60,41 @@ class Generator:
                 self.graph_path = graph_path_p
 
 
+        if Config.INSTRUMENTATION.value:
+            configure(os.getcwd()+'/data/'+self.name+'/'+SPANS_DIRECTORY, Config.PROFILE_SPAN.value)
+
+        self.open_blender_pool()
+        try:
+            with span("generation"):
+                self.run()
+        finally:
+            if self.blender_pool is not None:
+                self.blender_pool.close()
+            if self.cache is not None:
+                self.cache.evict()
+            if Config.INSTRUMENTATION.value:
+                self.save_spans_report()
+
+
+    def __getstate__(self):
+        # The Blender workers stay in the main process (the other stages run in worker processes)
+        state = self.__dict__.copy()
+        state['blender_pool'] = None
+        return state
+
+
+    def open_blender_pool(self):
+        """
+        Persistent Blender workers for the meshes (not in DEBUG mode, where Blender opens its interface)
+        """
+        if Config.GENERATE_MESH.value and not Config.DEBUG.value:
+            self.blender_pool = BlenderPool(Tools.find_file("blender"), "src/blender.py", Config.MESH_WORKERS.value)
+
+
+    def run(self):
+        """
+        Regenerate the pictures and meshes of the given graphs, or generate everything
+        """
         if self.graph_path:
             # Regenerate graph
             if type(self.graph_path) == list:
@@ -53,48 +102,151 @@ class Generator:
                 for path in self.graph_path:
                     if Config.GENERATE_GRAPH_IMAGE.value:
                         saving_path = os.getcwd()+'/data/'+self.name+'/'+ str(index)
-                        self.create_graph_picture(path_p=path, saving_path_p=saving_path)
-                    self.create_mesh(index, graph_path_p=path)
+                        self.cached_picture(path, saving_path)
+                    self.cached_mesh(index, path)
                     index+=1
                                 
             else:
                 if Config.GENERATE_GRAPH_IMAGE.value:
                         saving_path = os.getcwd()+'/data/'+self.name
-                        self.create_graph_picture(path_p=path, saving_path_p=saving_path)
-                self.create_mesh(0, graph_path_p=self.graph_path)
+                        self.cached_picture(self.graph_path, saving_path)
+                self.cached_mesh(0, self.graph_path)
 
         else:
             # Start generation
-            if Config.PARALLELIZATION.value:
-                # Make n graphs in different CPU cores (Only for the graph generation)  
-                list_process = [i for i in range(self.nb_graphs)]
-                with multiprocessing.Pool(processes=self.nb_graphs) as pool:
-                    result = pool.map(self.generator, list_process)
-                # Create the mesh
-                if Config.GENERATE_MESH.value:
-                    for index in list_process:
-                        path = f'{os.getcwd()}/data/{self.name}/{index}'
-                        self.create_mesh(index, graph_path_p=path)
-            
-            else:
-                for index in range(self.nb_graphs):
-                    path = os.getcwd()+'/data/'+self.name+'/'+str(index)
-                    self.generator(index, path)
-                    if Config.GENERATE_MESH.value:
-                        duration = self.create_mesh(index, graph_path_p=path)
-                        
+            self.run_stages()
 
 
-    def generator(self, index_p, path_p):
+    def seed_sequence(self, index_p, stage_p):
         """
-        Main generation frame. Used for multiprocessing
+        Return the seed sequence of a stage (0: graph, 1: mesh) of the graph index_p.
+        Same as SeedSequence(root_seed).spawn(index_p+1)[index_p].spawn(stage_p+1)[stage_p], without
+        depending on the order in which the graphs are generated.
         """
-        index = index_p
-        self.generate_graph(index)
-        
-        # Create picture for n graphs
+        return np.random.SeedSequence(self.root_seed, spawn_key=(index_p, stage_p))
+
+
+    def mesh_seed(self, index_p):
+        """
+        Return the integer seed given to the mesh generation (Blender) of the graph index_p.
+        """
+        return int(self.seed_sequence(index_p, 1).generate_state(1)[0])
+
+
+    def run_stages(self):
+        """
+        Generate the graph, picture and mesh of every index with the stage scheduler: the graphs (in
+        parallel with PARALLELIZATION) and pictures of the next indices are made while Blender meshes
+        the previous ones. The workers are admitted by CPU count and by the memory budget.
+        """
+        stages = [Stage("graph", self.graph_stage, limit_p=(os.cpu_count() or 1) if Config.PARALLELIZATION.value else 1, process_p=True)]
         if Config.GENERATE_GRAPH_IMAGE.value:
-                self.create_graph_picture(path_p = path_p, saving_path_p=path_p)
+            stages.append(Stage("preview", self.preview_stage, depends_p=("graph",), limit_p=Config.PREVIEW_WORKERS.value, process_p=True))
+        if Config.GENERATE_MESH.value:
+            stages.append(Stage("mesh", self.mesh_stage, depends_p=("graph",), limit_p=Config.MESH_WORKERS.value))
+
+        # Preflight estimation of the peak memory of every stage
+        budget = memory_budget()
+        estimates = {stage.name: estimate_stage(stage.name) for stage in stages}
+        for stage in stages:
+            stage.memory, stage.vram = estimates[stage.name]['ram'], estimates[stage.name]['vram']
+            for resource in ('ram', 'vram'):
+                if budget[resource] is not None and estimates[stage.name][resource] > budget[resource]:
+                    print(f"{Color.WARNING.value}The {stage.name} stage might need {estimates[stage.name][resource]/1e9:.1f}GB of {resource.upper()}, "
+                          f"more than the {budget[resource]/1e9:.1f}GB available (it will run alone){Color.ENDC.value}")
+        scheduler = StageScheduler(stages, budget_p=budget)
+        failures = scheduler.run(self.indices)
+        self.save_resources(scheduler, estimates, budget)
+
+        for (index, stage), error in sorted(failures.items()):
+            print(f"{Color.FAIL.value}Graph {index}: the {stage} stage failed ({error!r}){Color.ENDC.value}")
+        durations = ", ".join(f"{stage} {duration/60:.2f}" for stage, duration in scheduler.summary().items())
+        print(f"Duration of the stages (minutes, summed over the graphs): {durations}")
+        print(f"Duration of the generation: {(time.time() - self.starting_time) / 60} minutes")
+
+
+    def save_resources(self, scheduler_p, estimates_p, budget_p):
+        """
+        Log the estimated and measured peak memory of the stages in data/<name>/resources.json (calibration of resources.py),
+        with their durations (seconds, summed over the graphs) and failures
+        """
+        peaks = {}
+        for (index, stage), peak in sorted(scheduler_p.peaks.items()):
+            peaks.setdefault(stage, {})[str(index)] = peak
+        os.makedirs(os.getcwd()+'/data/'+self.name, exist_ok=True)
+        with open(os.getcwd()+'/data/'+self.name+'/resources.json', "w") as outfile:
+            json.dump({'budget': budget_p, 'estimates': estimates_p, 'peaks': peaks, 'delayed': sorted(scheduler_p.delayed),
+                       'durations': scheduler_p.summary(), 'failures': {f"{index} {stage}": repr(error) for (index, stage), error in sorted(scheduler_p.failures.items())}},
+                      outfile, indent=4)
+        for stage, stage_peaks in peaks.items():
+            measured = [peak for peak in stage_peaks.values() if peak is not None]
+            if measured:
+                print(f"Peak memory of the {stage} stage: {max(measured)/1e9:.2f}GB (estimated {estimates_p[stage]['ram']/1e9:.2f}GB)")
+
+
+    def save_spans_report(self):
+        """
+        Merge the spans of every process (instrumentation.py) in data/<name>/spans_report.json
+        """
+        report = merge_spans(load_spans(os.getcwd()+'/data/'+self.name+'/'+SPANS_DIRECTORY))
+        with open(os.getcwd()+'/data/'+self.name+'/spans_report.json', "w") as outfile:
+            json.dump(report, outfile, indent=4)
+
+
+    def index_path(self, index_p):
+        return os.getcwd()+'/data/'+self.name+'/'+str(index_p)
+
+
+    def graph_stage(self, index_p):
+        """
+        Graph stage of the index index_p (the graph is saved, not returned to the scheduler)
+        """
+        with span("graph", index=index_p):
+            self.cached("graph", {'root_seed': self.root_seed, 'index': index_p}, self.index_path(index_p), lambda: self.generate_graph(index_p))
+
+
+    def preview_stage(self, index_p):
+        """
+        Picture (and animation) stage of the index index_p
+        """
+        with span("preview", index=index_p):
+            return self.cached_picture(self.index_path(index_p), self.index_path(index_p))
+
+
+    def mesh_stage(self, index_p):
+        """
+        Mesh stage (Blender, with the texture baking) of the index index_p. Return the peak memory of Blender.
+        """
+        with span("mesh", index=index_p):
+            return self.cached_mesh(index_p, self.index_path(index_p), self.mesh_seed(index_p))
+
+
+    def cached(self, stage_p, inputs_p, directory_p, function_p):
+        """
+        Run function_p(), unless the stage cache holds the outputs of the stage for the same inputs:
+        they are then linked into directory_p. Return the value returned by function_p (None if restored).
+        """
+        if self.cache is None:
+            return function_p()
+        result = []
+        if self.cache.run(stage_p, inputs_p, directory_p, lambda: result.append(function_p())):
+            print(f"\t-{stage_p} stage restored from the cache in {directory_p}")
+        return result[0] if result else None
+
+
+    def cached_picture(self, graph_path_p, saving_path_p):
+        if self.cache is None:
+            return self.create_graph_picture(path_p=graph_path_p, saving_path_p=saving_path_p)
+        return self.cached("preview", {'graph': graph_digest(graph_path_p)}, saving_path_p,
+                    lambda: self.create_graph_picture(path_p=graph_path_p, saving_path_p=saving_path_p))
+
+
+    def cached_mesh(self, index_p, graph_path_p, seed_p=None):
+        if self.cache is None:
+            return self.create_mesh(index_p, graph_path_p=graph_path_p, seed_p=seed_p)
+        # Blender saves the mesh and the textures in data/<name>/<index>
+        return self.cached("mesh", {'graph': graph_digest(graph_path_p), 'seed': seed_p}, os.getcwd()+'/data/'+self.name+'/'+str(index_p),
+                    lambda: self.create_mesh(index_p, graph_path_p=graph_path_p, seed_p=seed_p))
 
 
     def generate_graph(self, index_p):
@@ -107,64 +259,104 @@ class Generator:
         
         # Graph generation
         index = index_p
-        graph = Graph(self.name, index, Config.MAX_CREATED_NODE_ON_CIRCLE.value)
+        stream = None
+        tiled = nb_regions(Config.REGIONS.value) > 1 or Config.NB_LAYERS.value > 1
+        if Config.STREAM_GRAPH.value and not tiled:
+            # Nodes are evicted from memory once streamed, the spatial index is built after the generation
+            graph = ArrayGraph(self.name, index, Config.MAX_CREATED_NODE_ON_CIRCLE.value, spatial_index_p=False)
+            stream = GraphStream(os.path.dirname(graph.save_graph_path)+"/stream", Config.STREAM_BLOCK_SIZE.value)
+        elif Config.GRAPH_STORAGE.value == "array" or tiled:
+            graph = ArrayGraph(self.name, index, Config.MAX_CREATED_NODE_ON_CIRCLE.value)
+        else:
+            graph = Graph(self.name, index, Config.MAX_CREATED_NODE_ON_CIRCLE.value)
         print("\t-Graph created")
 
-        # Starting point
-        graph.add_node(node_id_p=0, coordinates_p=[0.0,0.0,0.0], radius_p=rd.uniform(1.0, Config.MAX_RADIUS_NODE.value), active_p=True)
-        print("\t-First node added")
+        random = np.random.default_rng(self.seed_sequence(index, 0))
+        algorithm = Algorithm(graph_p=graph, loop_closure_probability_p=Config.DEFAULT_LOOP_CLOSURE_PROBABILITY.value, stream_p=stream, random_p=random)
+        with span("growth", algorithm=Config.SELECTED_ALGORITHM.value, nodes=Config.NB_NODES.value):
+            if Config.NB_LAYERS.value > 1:
+                # Planar layers grown in a process pool, then linked by passages
+                nb_passages = grow_layers(graph, self.seed_sequence(index, 0), Config.SELECTED_ALGORITHM.value, random)
+                print(f"\t-{Config.NB_LAYERS.value} layers grown and linked ({nb_passages} passages)")
+            elif tiled:
+                # Regions grown in a process pool (own seeds spawned from the graph seed), then stitched
+                nb_stitches, _ = grow_regions(graph, self.seed_sequence(index, 0), Config.SELECTED_ALGORITHM.value)
+                print(f"\t-{nb_regions(Config.REGIONS.value)} regions grown and stitched ({nb_stitches} edges added)")
+            elif stream is not None and stream.has_checkpoint():
+                # Interrupted generation
+                print("\t-Resuming the generation from the last checkpoint")
+                algorithm.resume()
+            else:
+                # Starting point
+                graph.add_node(node_id_p=0, coordinates_p=[0.0,0.0,0.0], radius_p=random.uniform(1.0, Config.MAX_RADIUS_NODE.value), active_p=True)
+                print("\t-First node added")
 
-        # Main logic
-        algorithm = Algorithm(graph_p=graph, loop_closure_probability_p=Config.DEFAULT_LOOP_CLOSURE_PROBABILITY.value)
-        algorithm.algorithm(Config.SELECTED_ALGORITHM.value)
+                # Main logic
+                algorithm.algorithm(Config.SELECTED_ALGORITHM.value)
         print("\t-Algorithm applied to the graph")
 
-        processed_graph = self.post_processing_graph(graph_p=graph)
-        print("\t-Post processing algorithm applied to the graph")
-
-        processed_graph.create_adjency_matrix(graph.nb_nodes)
+        if stream is not None:
+            # Write the last block and reassemble the graph columns from the stream (the whole graph is
+            # needed by the loop closure and the analytics, data.json is written block by block)
+            algorithm.checkpoint(Config.SELECTED_ALGORITHM.value, graph.nb_nodes, completed_p=True)
+            graph = stream.load_graph(ArrayGraph(self.name, index, Config.MAX_CREATED_NODE_ON_CIRCLE.value))
+            print(f"\t-Graph reassembled from {len(stream.blocks)} streamed blocks")
+            algorithm.graph = graph
+
+        with span("loop_closure"):
+            nb_loops = algorithm.loop_closure()
+        print(f"\t-Loop closure applied ({nb_loops} edges added)")
+
+        if algorithm.occupancy is not None:
+            if 'occupancy' not in graph.data:
+                graph.data['occupancy'] = algorithm.occupancy.summary()
+            print(f"\t-Occupancy grid: {100*graph.data['occupancy']['rejection_rate']:.1f}% of the new nodes rejected")
+        if 'growth' not in graph.data and algorithm.growth['attempts']:
+            graph.data['growth'] = algorithm.growth
+        if graph.data.get('growth', {}).get('status') == "stalled":
+            growth = graph.data['growth']
+            print(f"{Color.WARNING.value}\t-The growth stalled and gave up: {graph.nb_nodes} nodes created instead of {Config.NB_NODES.value} ({growth['reseeds']} restarts, {growth['rejects']} of {growth['attempts']} candidates rejected){Color.ENDC.value}")
+
+        # Seeds needed to regenerate this graph (-seed root_seed -index index) and its mesh
+        graph.data['seed'] = {'root_seed': self.root_seed, 'index': index, 'mesh_seed': self.mesh_seed(index)}
+        graph.create_adjency_matrix(graph.nb_nodes)
         print("\t-Adjency matrix created")
 
         # Save the graph
-        processed_graph.save_graph()
+        with span("save_graph", nodes=graph.nb_nodes):
+            graph.save_graph()
+        if stream is not None:
+            stream.clear()
         print("\t-Graph saved")
 
-        # Display the adjency matrix
+        # Display the adjency matrix summary
         print(f"{Color.BOLD.value}Adjency matrix:{Color.ENDC.value}")
-        print(graph.adj_matrix)
+        print(graph.adjacency_summary())
 
         print(f"{Color.OKBLUE.value} == End of graph {index} generation == {Color.ENDC.value}")
-        return processed_graph
-
-
-    def post_processing_graph(self, graph_p):
-        """
-        Various post process solition applied to the graph. Currently:
-        - Remove edge duplicates
-        """
-        # Remove duplicates
-        graph = graph_p
-        for node in graph.nodes:
-            graph.nodes[node].set_edges(Tools.remove_duplicate_none_list(graph.nodes[node].get_edges()))
-        
         return graph
-    
+
 
     def create_graph_picture(self, path_p, saving_path_p):
         """
         Display the created graph
         """
+        # pyvista (VTK) and tqdm are only imported when a picture is requested
+        from display import Display
+
         print(f"\n{Color.OKBLUE.value} == Graph picture generation == {Color.ENDC.value}")
-        display = Display(data_path=path_p, voxel_size=0.6,
+        display = Display(data_path=path_p, voxel_size=PREVIEW_VOXEL_SIZE,
             node_radius=1.0,      # You can set per-node radii if desired
             edge_radius=1.0,      # You can set per-edge radii if desired
             smoothing=True,
             n_iter=50,
             relaxation_factor=0.1)
         print("\t-Display object created")
-        display.load_graph()
+        with span("load_graph"):
+            display.load_graph()
         print("\t-Graph important features imported")
-        display.voxelize()
+        with span("voxelize", voxel_size=PREVIEW_VOXEL_SIZE):
+            display.voxelize()
         print("\t-Graph voxelized")
         display.extract_surface()
         print("\t-Graph surface extracted")
@@ -172,20 +364,22 @@ class Generator:
         if Config.ANIMATE.value:
             # Animate the graph
             print("\t-Starting graph animation")
-            display.animate_bone_then_mesh_with_orbit(
-                path=saving_path_p + "/cave_bone_then_mesh.mp4",
-                tube_color="navy",
-                mesh_opacity=1,
-                n_skip_bone=1,    # Skip edges for faster bone growth animation
-                n_skip_mesh=1,    # Skip for faster mesh growth (adjust as you want)
-                orbit_frames=36,
-                orbit_factor=1.3,)
+            with span("animation"):
+                display.animate_bone_then_mesh_with_orbit(
+                    path=saving_path_p + "/cave_bone_then_mesh.mp4",
+                    tube_color="navy",
+                    mesh_opacity=1,
+                    n_skip_bone=1,    # Skip edges for faster bone growth animation
+                    n_skip_mesh=1,    # Skip for faster mesh growth (adjust as you want)
+                    orbit_frames=36,
+                    orbit_factor=1.3,)
             print("\t-Graph animated and saved as a video")
 
             
         if Config.GENERATE_GRAPH_IMAGE.value:
             # Create a static image of the graph
-            display.create_static_image(saving_path_p + "/cave_graph.png", tube_color="navy", mesh_opacity=1)
+            with span("static_image"):
+                display.create_static_image(saving_path_p + "/cave_graph.png", tube_color="navy", mesh_opacity=1)
             print("\t-Graph static image created")
 
 
@@ -199,26 +393,40 @@ class Generator:
         print(f"{Color.OKBLUE.value} == End of graph picture generation == {Color.ENDC.value}")
 
 
-    def create_mesh(self, index_p, graph_path_p=None):
+    def create_mesh(self, index_p, graph_path_p=None, seed_p=None):
         """
         Create the mesh using Blender
+        Without seed_p, Blender uses the mesh seed recorded in the graph data.
+        Return the peak memory of Blender (bytes, None if unknown).
         """
-        blender_path = Tools.find_file("blender")
         index = index_p
+        seed_argument = f" -seed {seed_p}" if seed_p is not None else ""
+        start = time.time()
 
         print(f"\n{Color.OKBLUE.value} == Mesh generation start == {Color.ENDC.value}")
+        if self.blender_pool is not None:
+            status = self.blender_pool.run({'graph': graph_path_p, 'index': index, 'name': self.name, 'seed': seed_p})
+            if status['status'] != "done":
+                print(f"\n{Color.FAIL.value}An issue occured: {status['error']}{Color.ENDC.value}")
+                raise RuntimeError(f"Mesh {index} failed: {status['error']}")
+            print(f"Mesh {index} done in {status['duration']:.1f} seconds")
+            print(f"\n{Color.OKBLUE.value} == Mesh generation finished == {Color.ENDC.value}")
+            return status.get('peak_memory')
+
+        blender_path = Tools.find_file("blender")
         result = None
         try:
             if Config.DEBUG.value:
-                result = subprocess.run(f"{blender_path} --python src/blender.py -- -g {graph_path_p} -index {index} -name {self.name}", shell=True, check=True)
+                result = subprocess.run(f"{blender_path} --python src/blender.py -- -g {graph_path_p} -index {index} -name {self.name}{seed_argument}", shell=True, check=True)
             else:
-                result = subprocess.run(f"{blender_path} --background --python src/blender.py -- -g {graph_path_p} -index {index} -name {self.name}", shell=True, check=True)
+                result = subprocess.run(f"{blender_path} --background --python src/blender.py -- -g {graph_path_p} -index {index} -name {self.name}{seed_argument}", shell=True, check=True)
         
         except Exception as e:
             print(f"\n{Color.FAIL.value}An issue occured: ",e)
             print(f"The blender path might be wrong, please check the path.json file")
             print(f"If it is the case, please remove the path.json file{Color.ENDC.value}")
-            exit()
+            # Only this index fails (stage scheduler)
+            raise
 
         finally:
             if result:
@@ -229,11 +437,9 @@ class Generator:
                 error = result.stderr
                 if error:
                     print(f"{Color.FAIL.value}Error: ", error,f"{Color.ENDC.value}")
-            duration = (time.time() - self.starting_time) / 60
-            print("Duration of the generation: ", duration," minutes")
+            duration = (time.time() - start) / 60
+            print("Duration of the mesh generation: ", duration," minutes")
             print(f"\n{Color.OKBLUE.value} == Mesh generation finished == {Color.ENDC.value}")
-        
-        return duration
 
 
 
@@ -245,7 +451,9 @@ if __name__ == '__main__':
     
     parser.add_argument("-n", help="Name of the current graph generation", type=str)
     parser.add_argument("-g", help="Take an already generated graph as input", type=str)
+    parser.add_argument("-seed", help="Root seed of the generation (recorded in data.json), overrides Config.SEED", type=int)
+    parser.add_argument("-index", help="Only generate these graph indices (with -seed: regenerate them identically)", type=int, nargs='+')
 
     args = parser.parse_args()
     arguments = vars(args)
-    generator = Generator(name_p=arguments['n'], graph_path_p=arguments['g'])
\ No newline at end of file
+    generator = Generator(name_p=arguments['n'], graph_path_p=arguments['g'], seed_p=arguments['seed'], indices_p=arguments['index'])
\ No newline at end of file
@@ -6,18 +6,20 @@ import numpy as np
 import json 
 import time
 import os
-import math
 import datetime
 
 from config import Config
+from spatial_index import SpatialIndex
+from graph_io import GraphArrays, canonical_edges, save_graph_arrays
 
 
 class Graph:
-    def __init__(self, generation_name_p, nb_graphs_p, max_created_node_on_circle_p=3):
+    def __init__(self, generation_name_p, nb_graphs_p, max_created_node_on_circle_p=3, spatial_index_p=True):
         """
         Create an instace of everything needed to create a graph.
         generation_name_p should be a string.
         nb_graphs_p should be an integer.
+        spatial_index_p enables the spatial index used by the neighbour queries.
         """
         self.starting_time = time.time()
         self.data = {}
@@ -30,6 +32,13 @@ class Graph:
         self.save_graph_path = Config.PLUME_DIR.value+"/data/"+self.generation_name+self.nb_graphs+"/data.json"
         self.adj_matrix = None
         self.max_created_node_on_circle = max_created_node_on_circle_p
+        self.spatial_index = SpatialIndex() if spatial_index_p else None
+
+        # Canonical undirected edge index: every edge is stored once as (min id, max id), the duplicates
+        # are looked up in the edges of the nodes
+        self._edge_list = []
+        self._edges_array_cache = None
+        self._neighbours_cache = None
     
     
     def create_adjency_matrix(self, nb_nodes_p):
@@ -37,18 +46,57 @@ class Graph:
         Create the adjency matrix of the graph.
         In a square matrix, rows and columns correspond to nodes, and each element indicates whether an edge exists between them (and possibly the weight of the edge). 
         It's a direct mathematical representation for both nodes and their relationships.
+        The matrix is stored as a sparse CSR matrix built in one vectorized pass from the edge array.
+        """
+        from scipy import sparse
+
+        edges = self.get_edges_array()
+        rows = np.concatenate((edges[:, 0], edges[:, 1]))
+        cols = np.concatenate((edges[:, 1], edges[:, 0]))
+        data = np.ones(len(rows), dtype=np.int8)
+        adj_matrix = sparse.coo_matrix((data, (rows, cols)), shape=(nb_nodes_p, nb_nodes_p)).tocsr()
+
+        # Duplicated edges are summed by the conversion, the matrix stays binary
+        adj_matrix.data[:] = 1
+        self.adj_matrix = adj_matrix
+
+
+    def get_adjacency_neighbors(self, node_id_p):
+        """
+        Return the ids of the nodes connected to node_id_p (slice of the CSR matrix).
+        """
+        return self.adj_matrix.indices[self.adj_matrix.indptr[node_id_p]:self.adj_matrix.indptr[node_id_p+1]]
+
+
+    def get_degrees(self):
+        """
+        Return the degree of every node as a vector.
+        """
+        return np.diff(self.adj_matrix.indptr)
+
+
+    def get_connected_components(self):
+        """
+        Return the number of connected components and the component label of every node.
         """
-        # Initialize the adjency matrix with zeros
-        self.adj_matrix = np.zeros((nb_nodes_p, nb_nodes_p))
+        from scipy.sparse import csgraph
 
-        # Get the edges of the graph
-        edges = self.get_edges()
+        return csgraph.connected_components(self.adj_matrix, directed=False)
 
-        #Fill the matrix
-        for edge in edges:
-            u,v = edge
-            self.adj_matrix[u][v] = 1
-            self.adj_matrix[v][u] = 1
+
+    def adjacency_summary(self):
+        """
+        Return a short human readable description of the adjency matrix.
+        """
+        n = self.adj_matrix.shape[0]
+        nb_edges = self.adj_matrix.nnz // 2
+        degrees = self.get_degrees()
+        nb_components, _ = self.get_connected_components()
+        density = self.adj_matrix.nnz / (n * n) if n else 0.0
+        return (f"\t-Nodes: {n}, edges: {nb_edges}, density: {density:.2e}\n"
+                f"\t-Degree min/mean/max: {degrees.min() if n else 0}/{degrees.mean() if n else 0:.2f}/{degrees.max() if n else 0}\n"
+                f"\t-Connected components: {nb_components}\n"
+                f"\t-Sparse storage: {self.adj_matrix.data.nbytes + self.adj_matrix.indices.nbytes + self.adj_matrix.indptr.nbytes} bytes")
 
 
     def add_node(self, node_id_p, parent_p=None, edges_p=None, coordinates_p=None,  radius_p=None, active_p=True):
@@ -56,13 +104,10 @@ class Graph:
         A node is created with the specified parameters. 
         Each node is represented as a dictionary and will be stored within another dictionary that encompasses all nodes in the graph.
         """
-        self.nodes[node_id_p] = Node(node_id_p, parent_p, edges_p, coordinates_p, radius_p, active_p)
-        if parent_p != None and edges_p != None:
-            self.add_edge(node_id_p, parent_p)
-        
-        if parent_p != None:
-            self.add_edge(node_id_p, parent_p)
-        
+        self.nodes[node_id_p] = Node(node_id_p, parent_p, None, coordinates_p, radius_p, active_p)
+        if self.spatial_index is not None:
+            self.spatial_index.insert(node_id_p, self.nodes[node_id_p].get_list_coordinates())
+        self.add_edge(node_id_p, parent_p)
         if edges_p != None:
             for edge in edges_p:
                 self.add_edge(node_id_p, edge)
@@ -70,16 +115,70 @@ class Graph:
         return self.nodes[node_id_p]
 
 
+    def add_nodes(self, node_ids_p, parents_p, coordinates_p, radii_p, active_p=True, link_parents_p=True):
+        """
+        add_node over arrays of nodes. parents_p uses -1 for nodes without parent.
+        When link_parents_p is not set, the parent edges are not added.
+        """
+        coordinates = np.asarray(coordinates_p, dtype=np.float64).reshape(-1, 3)
+        radii = np.broadcast_to(radii_p, len(coordinates))
+        active = np.broadcast_to(active_p, len(coordinates))
+        for i, (node_id, parent) in enumerate(zip(np.asarray(node_ids_p).tolist(), np.asarray(parents_p).tolist())):
+            parent = parent if parent >= 0 else None
+            self.add_node(node_id, parent if link_parents_p else None, None, coordinates[i].tolist(), float(radii[i]), bool(active[i]))
+            self.nodes[node_id].set_parent(parent)
+
+
+    @staticmethod
+    def edge_key(low_p, high_p):
+        """
+        Pack a canonical edge (low id, high id) in one integer (works on integers and NumPy arrays).
+        """
+        return (low_p << 32) | high_p
+
+
+    def _invalidate_edges(self):
+        self._edges_array_cache = None
+        self._neighbours_cache = None
+
+
+    @property
+    def nb_edges(self):
+        return len(self._edge_list)
+
+
     def add_edge(self, node_1_id, node_2_id):
         """
         Takes two integers (representing the nodes ids) and add respectively a child an a parent.
+        The edge is stored once whatever its direction. Duplicates, self loops and None are ignored.
+        Return True if the edge was added.
         """
+        if node_1_id is None or node_2_id is None or node_1_id == node_2_id:
+            return False
+        if node_2_id in self.nodes[node_1_id].edges:
+            return False
+        low, high = (node_1_id, node_2_id) if node_1_id < node_2_id else (node_2_id, node_1_id)
+        self._edge_list.append((low, high))
         self.nodes[node_1_id].add_edge(node_2_id)
         self.nodes[node_2_id].add_edge(node_1_id)
+        self._invalidate_edges()
+        return True
+
+
+    def add_edges(self, nodes_1_ids_p, nodes_2_ids_p):
+        """
+        add_edge over two sequences of ids. Return the number of edges added.
+        """
+        added = 0
+        for node_1_id, node_2_id in zip(nodes_1_ids_p, nodes_2_ids_p):
+            added += self.add_edge(int(node_1_id), int(node_2_id))
+        return added
 
 
     def set_coordinates(self, node_id, coordinates):
         self.nodes[node_id].set_coordinates(coordinates)
+        if self.spatial_index is not None:
+            self.spatial_index.update(node_id, self.nodes[node_id].get_list_coordinates())
 
 
     def activate(self, node_id):
@@ -99,23 +198,159 @@ class Graph:
 
 
     def get_edges(self):
-        edges_list = []
-        for node in self.nodes.values():
-            for edge in node.edges:
-                if edge != None:
-                    edges_list.append((node.id, edge))
-        return edges_list
+        """
+        Return the list of unique undirected edges as (min id, max id) tuples
+        """
+        return list(self._edge_list)
+
+
+    def get_edges_array(self):
+        """
+        Return the edges as an (n, 2) integer array (cached until the next edge is added)
+        """
+        if self._edges_array_cache is None:
+            self._edges_array_cache = np.array(self._edge_list, dtype=np.int64).reshape(-1, 2)
+        return self._edges_array_cache
+
+
+    def get_rows(self, node_ids_p):
+        """
+        Return the rows (in the order of get_ids and the other array accessors) of an array of node ids.
+        """
+        ids = self.get_ids()
+        order = np.argsort(ids, kind='stable')
+        return order[np.searchsorted(ids, np.asarray(node_ids_p, dtype=np.int64), sorter=order)]
+
+
+    def get_ids(self):
+        return np.array([node.id for node in self.nodes.values()], dtype=np.int64)
+
+
+    def get_parents(self):
+        return np.array([node.parent if node.parent is not None else -1 for node in self.nodes.values()], dtype=np.int64)
 
 
-    def get_neighbors(self, node_id_p,radius_p):
-        # Calculate the distance between each node and the b
-        origin = self.nodes[node_id_p]
-        neighbours = []
-        for node in self.nodes.values():
-            distance = math.sqrt((origin.coordinates['x'] - node.coordinates['x']) ** 2 + (origin.coordinates['y'] - node.coordinates['y']) ** 2 + (origin.coordinates['z'] - node.coordinates['z']) ** 2 )
-            if distance > radius_p:
-                neighbours.append(node)
-        return neighbours
+    def get_positions(self):
+        return np.array([node.get_list_coordinates() for node in self.nodes.values()], dtype=np.float64).reshape(-1, 3)
+
+
+    def get_radii(self):
+        return np.array([node.radius for node in self.nodes.values()], dtype=np.float64)
+
+
+    def get_active(self):
+        return np.array([node.active for node in self.nodes.values()], dtype=bool)
+
+
+    def get_spatial_index(self):
+        """
+        Return the spatial index of the neighbour queries. A graph created without one (streamed or
+        region graphs) builds it from its nodes on first use, then add_node maintains it.
+        """
+        if self.spatial_index is None:
+            self.spatial_index = SpatialIndex(capacity_p=max(self.nb_nodes, 1))
+            self.spatial_index.insert_many(self.get_ids(), self.get_positions())
+        return self.spatial_index
+
+
+    def get_neighbors(self, node_id_p, radius_p):
+        """
+        Return the nodes located within radius_p of the given node (the node itself excluded).
+        """
+        origin = self.get_node(node_id_p)
+        neighbours_ids = self.get_spatial_index().query_radius(origin.get_list_coordinates(), radius_p)
+        return [self.get_node(node_id) for node_id in neighbours_ids.tolist() if node_id != node_id_p]
+
+
+    def get_neighbors_batch(self, points_p, radius_p):
+        """
+        Return, for every query point of an (n, 3) array, the ids of the nodes within radius_p.
+        """
+        return self.get_spatial_index().query_radius_batch(points_p, radius_p)
+
+
+    def get_nearest_nodes(self, points_p, k_p=1):
+        """
+        Return the distances and ids of the k_p nodes closest to every query point of an (n, 3) array.
+        """
+        return self.get_spatial_index().query_knn_batch(points_p, k_p)
+
+
+    def get_nodes_in_box(self, min_p, max_p):
+        """
+        Return the ids of the nodes inside the axis aligned box [min_p, max_p].
+        """
+        return self.get_spatial_index().query_box(min_p, max_p)
+
+
+    def get_close_pairs(self, distance_p):
+        """
+        Return an (m, 2) array with the ids of every pair of nodes closer than distance_p.
+        A temporary spatial index is built when the graph has none (streamed generation).
+        """
+        spatial_index = self.spatial_index
+        if spatial_index is None:
+            spatial_index = SpatialIndex(capacity_p=max(self.nb_nodes, 1))
+            spatial_index.insert_many(self.get_ids(), self.get_positions())
+        return spatial_index.query_pairs(distance_p)
+
+
+    def get_loop_closure_candidates(self, distance_p, min_hops_p, chunk_size_p=1<<16):
+        """
+        Return an (m, 2) array with the ids of the pairs of nodes closer than distance_p which are not
+        already connected by a path of min_hops_p edges or less.
+        When the edges are exactly the parent links (a forest, as generated) the ancestors of both ends
+        are compared, otherwise both ends are expanded by half of min_hops_p with sparse products.
+        Pairs are tested in chunks.
+        """
+        pairs = self.get_close_pairs(distance_p)
+        if len(pairs) == 0 or min_hops_p <= 0:
+            return pairs
+        ids = self.get_ids()
+        parents = self.get_parents()
+        edges = self.get_edges_array()
+        n = int(max(ids.max(), pairs.max())) + 1
+
+        linked = parents >= 0
+        parent_keys = self.edge_key(np.minimum(ids[linked], parents[linked]), np.maximum(ids[linked], parents[linked]))
+        edge_keys = self.edge_key(edges.min(axis=1), edges.max(axis=1))
+        if len(parent_keys) == len(edge_keys) and np.array_equal(np.sort(parent_keys), np.sort(edge_keys)):
+            # Parent of every node, the roots (and the sentinel n) point to the sentinel
+            parent = np.full(n + 1, n, dtype=np.int64)
+            parent[ids[linked]] = parents[linked]
+
+            def within_hops(chunk_p):
+                ancestors_1 = [chunk_p[:, 0]]
+                ancestors_2 = [chunk_p[:, 1]]
+                for _ in range(min_hops_p):
+                    ancestors_1.append(parent[ancestors_1[-1]])
+                    ancestors_2.append(parent[ancestors_2[-1]])
+                # The path goes through a common ancestor reached in a and b steps, with a + b <= min_hops_p
+                connected = np.zeros(len(chunk_p), dtype=bool)
+                for a in range(min_hops_p + 1):
+                    for b in range(min_hops_p + 1 - a):
+                        connected |= (ancestors_1[a] == ancestors_2[b]) & (ancestors_1[a] != n)
+                return connected
+        else:
+            from scipy import sparse
+
+            adjacency = sparse.csr_matrix((np.ones(2 * len(edges), dtype=bool), (np.concatenate((edges[:, 0], edges[:, 1])), np.concatenate((edges[:, 1], edges[:, 0])))), shape=(n, n))
+            adjacency = adjacency + sparse.identity(n, dtype=bool, format='csr')
+
+            def reachable(nodes_p, hops_p):
+                reach = sparse.csr_matrix((np.ones(len(nodes_p), dtype=bool), (np.arange(len(nodes_p)), nodes_p)), shape=(len(nodes_p), n))
+                for _ in range(hops_p):
+                    reach = reach @ adjacency
+                return reach
+
+            def within_hops(chunk_p):
+                meeting = reachable(chunk_p[:, 0], (min_hops_p + 1) // 2).multiply(reachable(chunk_p[:, 1], min_hops_p // 2))
+                return np.diff(meeting.tocsr().indptr) > 0
+
+        keep = np.empty(len(pairs), dtype=bool)
+        for start in range(0, len(pairs), chunk_size_p):
+            keep[start:start+chunk_size_p] = ~within_hops(pairs[start:start+chunk_size_p])
+        return pairs[keep]
 
 
     def create_random_graph(self, nb_nodes_p):
@@ -128,6 +363,20 @@ class Graph:
             self.add_edge(rd.randint(0,nb_nodes_p-1), rd.randint(0,nb_nodes_p-1))
 
 
+    def serialize_nodes(self):
+        """
+        Return the nodes in a json serializable form (Node objects are dumped through their __dict__)
+        """
+        return self.nodes
+
+
+    def write_nodes(self, outfile_p):
+        """
+        Write the nodes of data.json as one json object in outfile_p
+        """
+        json.dump(self.serialize_nodes(), outfile_p, default=lambda o: o.__dict__)
+
+
     def save_graph(self):
         """
         Save the graph in a json file. All child connections are conserved
@@ -192,7 +441,22 @@ class Graph:
         self.data['nodes_number'] = self.nb_nodes
         self.data['nodes_max_new_nodes_created'] = Config.MAX_CREATED_NODE_ON_CIRCLE.value
         self.data['nodes_radius'] = Config.MAX_RADIUS_NODE.value
-        self.data['nodes'] = self.nodes
-        
+
+        # Binary columnar sidecar, loaded by every consumer through graph_io
+        ids = self.get_ids()
+        positions = self.get_positions()
+        edges = canonical_edges(self.get_edges_array(), ids)
+        if Config.GRAPH_ANALYTICS.value:
+            from analytics import compute_analytics
+
+            self.data['analytics'] = compute_analytics(positions, edges)
+        graph_arrays = GraphArrays(ids, self.get_parents(), positions, self.get_radii(), self.get_active(),
+                                   edges, metadata=dict(self.data))
+        save_graph_arrays(os.path.dirname(self.save_graph_path), graph_arrays)
+
+        # The nodes come last, written by write_nodes (block by block for the array storage)
+        metadata = json.dumps(self.data, default=lambda o: o.__dict__, sort_keys=False, indent=4)
         with open(self.save_graph_path, "w") as outfile:
-                json.dump(self.data, outfile, default=lambda o: o.__dict__, sort_keys=False, indent=4)
+            outfile.write(metadata[:-2] + ',\n    "nodes": ')
+            self.write_nodes(outfile)
+            outfile.write("\n}")
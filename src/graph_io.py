@@ -0,0 +1,115 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Binary columnar graph format and the single loader shared by every graph consumer
+(Display, Blender mesh generation and graph regeneration).
+
+The graph is written next to data.json in a "graph_arrays" directory holding one .npy file per column:
+- ids.npy        (n,)   int64    node ids
+- parents.npy    (n,)   int64    parent id, -1 for the root
+- positions.npy  (n, 3) float64  x, y, z coordinates
+- radii.npy      (n,)   float64  node radius
+- active.npy     (n,)   bool     active flag
+- edges.npy      (e, 2) int64    unique undirected edges as (row, row) pairs, row < row
+- metadata.json                  data.json without the nodes
+Columns are loaded through memory maps, so opening a graph does not copy its data.
+"""
+import json
+import os
+
+import numpy as np
+
+
+SIDECAR_DIRECTORY = "graph_arrays"
+COLUMNS = ("ids", "parents", "positions", "radii", "active", "edges")
+
+
+class GraphArrays:
+    """
+    Columns of a saved graph. Attributes are NumPy arrays (read-only memory maps when loaded from the sidecar).
+    """
+    def __init__(self, ids, parents, positions, radii, active, edges, metadata=None):
+        self.ids = ids
+        self.parents = parents
+        self.positions = positions
+        self.radii = radii
+        self.active = active
+        self.edges = edges
+        self.metadata = metadata if metadata is not None else {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __repr__(self):
+        return f"GraphArrays(nodes: {len(self.ids)}, edges: {len(self.edges)})"
+
+
+def canonical_edges(edges_p, ids_p=None):
+    """
+    Return the unique undirected edges of an (e, 2) id array as sorted (row, row) pairs.
+    None/negative entries and self loops are dropped. Ids are converted to rows when ids_p is given.
+    """
+    edges = np.asarray(edges_p, dtype=np.int64).reshape(-1, 2)
+    if ids_p is not None:
+        ids = np.asarray(ids_p, dtype=np.int64)
+        if len(ids) and not np.array_equal(ids, np.arange(len(ids))):
+            order = np.argsort(ids)
+            edges = order[np.searchsorted(ids, edges, sorter=order)]
+    edges = edges[(edges >= 0).all(axis=1) & (edges[:, 0] != edges[:, 1])]
+    edges = np.sort(edges, axis=1)
+    return np.unique(edges, axis=0)
+
+
+def sidecar_path(graph_directory_p):
+    return os.path.join(graph_directory_p, SIDECAR_DIRECTORY)
+
+
+def save_graph_arrays(graph_directory_p, graph_arrays_p):
+    """
+    Write the columns of a graph in the sidecar directory of graph_directory_p.
+    """
+    directory = sidecar_path(graph_directory_p)
+    os.makedirs(directory, exist_ok=True)
+    for column in COLUMNS:
+        np.save(os.path.join(directory, column + ".npy"), np.ascontiguousarray(getattr(graph_arrays_p, column)))
+    with open(os.path.join(directory, "metadata.json"), "w") as outfile:
+        json.dump(graph_arrays_p.metadata, outfile, indent=4)
+
+
+def load_graph_arrays(graph_directory_p, mmap_p=True, write_sidecar_p=True):
+    """
+    Load a graph saved in graph_directory_p.
+    The binary sidecar is memory mapped when available, otherwise data.json is parsed once and,
+    if write_sidecar_p is set, the sidecar is written so the next load is fast.
+    """
+    directory = sidecar_path(graph_directory_p)
+    if os.path.exists(os.path.join(directory, "metadata.json")):
+        mmap_mode = 'r' if mmap_p else None
+        columns = {column: np.load(os.path.join(directory, column + ".npy"), mmap_mode=mmap_mode) for column in COLUMNS}
+        with open(os.path.join(directory, "metadata.json")) as infile:
+            metadata = json.load(infile)
+        return GraphArrays(metadata=metadata, **columns)
+
+    graph_arrays = load_graph_json(os.path.join(graph_directory_p, "data.json"))
+    if write_sidecar_p:
+        save_graph_arrays(graph_directory_p, graph_arrays)
+    return graph_arrays
+
+
+def load_graph_json(path_p):
+    """
+    Parse a data.json file (legacy format) into GraphArrays.
+    """
+    with open(path_p) as infile:
+        data = json.load(infile)
+    nodes = data.pop('nodes')
+    n = len(nodes)
+
+    ids = np.fromiter((int(node['id']) for node in nodes.values()), dtype=np.int64, count=n)
+    parents = np.fromiter((node['parent'] if node['parent'] is not None else -1 for node in nodes.values()), dtype=np.int64, count=n)
+    positions = np.fromiter((value for node in nodes.values() for value in (node['coordinates']['x'], node['coordinates']['y'], node['coordinates']['z'])), dtype=np.float64, count=3*n).reshape(n, 3)
+    radii = np.fromiter((node['radius'] for node in nodes.values()), dtype=np.float64, count=n)
+    active = np.fromiter((node['active'] for node in nodes.values()), dtype=bool, count=n)
+    edges = [(node['id'], edge) for node in nodes.values() for edge in node['edges'] if edge is not None]
+    edges = canonical_edges(edges, ids)
+    return GraphArrays(ids, parents, positions, radii, active, edges, metadata=data)
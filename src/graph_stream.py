@@ -0,0 +1,129 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Checkpointed, append-only streaming of a graph to disk during its generation.
+Nodes and edges are written in blocks (block_XXXXXX.npz) as the algorithm grows the graph,
+followed by a checkpoint holding the algorithm state (RNG and frontier). Rows that the algorithm
+will not read anymore are then evicted from memory, so the resident graph stays close to one block.
+An interrupted generation resumes from the last checkpoint instead of restarting.
+"""
+import os
+import pickle
+import shutil
+
+import numpy as np
+
+
+class GraphStream:
+    def __init__(self, directory_p, block_size_p=100000):
+        self.directory = directory_p
+        self.block_size = block_size_p
+        self.checkpoint_path = os.path.join(self.directory, "checkpoint.pkl")
+        self.blocks = []                  # (first node id, last node id + 1) of every block
+        self.nb_flushed_nodes = 0
+        self.nb_flushed_edges = 0
+
+
+    def has_checkpoint(self):
+        return os.path.exists(self.checkpoint_path)
+
+
+    def should_flush(self, graph_p):
+        return graph_p.nb_nodes - self.nb_flushed_nodes >= self.block_size
+
+
+    def block_path(self, index_p):
+        return os.path.join(self.directory, f"block_{index_p:06d}.npz")
+
+
+    def _write_atomic(self, path_p, write_p):
+        """
+        Write a file through a temporary file so a crash never leaves a truncated block or checkpoint.
+        """
+        temporary_path = path_p + ".tmp"
+        with open(temporary_path, "wb") as outfile:
+            write_p(outfile)
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        os.replace(temporary_path, path_p)
+
+
+    def flush(self, graph_p, state_p, watermark_p):
+        """
+        Append the rows and edges added since the last flush as a new block, save a checkpoint with
+        the algorithm state, then evict from the graph every row below watermark_p (the oldest node id
+        the algorithm still needs).
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        first_row = self.nb_flushed_nodes - (graph_p.nb_nodes - graph_p.nb_resident_nodes)
+        first_edge = self.nb_flushed_edges - (graph_p.nb_edges - graph_p.nb_resident_edges)
+        edges = graph_p.get_edges_array()[first_edge:]
+        block = {
+            'ids': graph_p.get_ids()[first_row:],
+            'parents': graph_p.get_parents()[first_row:],
+            'positions': graph_p.get_positions()[first_row:],
+            'radii': graph_p.get_radii()[first_row:],
+            'active': graph_p.get_active()[first_row:],
+            'edges': edges,
+        }
+        if len(block['ids']) or len(edges):
+            self._write_atomic(self.block_path(len(self.blocks)), lambda outfile: np.savez(outfile, **block))
+            self.blocks.append((self.nb_flushed_nodes, graph_p.nb_nodes))
+        self.nb_flushed_nodes = graph_p.nb_nodes
+        self.nb_flushed_edges = graph_p.nb_edges
+
+        watermark = min(int(watermark_p), self.nb_flushed_nodes)
+        checkpoint = {
+            'blocks': self.blocks,
+            'nb_flushed_nodes': self.nb_flushed_nodes,
+            'nb_flushed_edges': self.nb_flushed_edges,
+            'watermark': watermark,
+            'state': state_p,
+        }
+        self._write_atomic(self.checkpoint_path, lambda outfile: pickle.dump(checkpoint, outfile))
+        graph_p.evict(watermark, self.nb_flushed_edges)
+
+
+    def _load_block(self, index_p):
+        with np.load(self.block_path(index_p)) as block:
+            return {key: block[key] for key in block.files}
+
+
+    def resume(self, graph_p):
+        """
+        Reload the resident rows of the last checkpoint in an empty ArrayGraph and return the saved algorithm state.
+        """
+        with open(self.checkpoint_path, "rb") as infile:
+            checkpoint = pickle.load(infile)
+        self.blocks = [tuple(block) for block in checkpoint['blocks']]
+        self.nb_flushed_nodes = checkpoint['nb_flushed_nodes']
+        self.nb_flushed_edges = checkpoint['nb_flushed_edges']
+        watermark = checkpoint['watermark']
+
+        # Blocks written after the checkpoint (crash between block and checkpoint) are overwritten later
+        graph_p.start_at(watermark, self.nb_flushed_edges)
+        for index, (first, last) in enumerate(self.blocks):
+            if last <= watermark:
+                continue
+            block = self._load_block(index)
+            keep = slice(max(watermark - first, 0), None)
+            graph_p.add_nodes(block['ids'][keep], block['parents'][keep], block['positions'][keep], block['radii'][keep], block['active'][keep], link_parents_p=False)
+        return checkpoint['state']
+
+
+    def load_graph(self, graph_p):
+        """
+        Load every block of the stream in an empty graph supporting add_nodes/add_edges.
+        """
+        for index in range(len(self.blocks)):
+            block = self._load_block(index)
+            graph_p.add_nodes(block['ids'], block['parents'], block['positions'], block['radii'], block['active'], link_parents_p=False)
+            graph_p.add_edges(block['edges'][:, 0], block['edges'][:, 1])
+        return graph_p
+
+
+    def clear(self):
+        """
+        Remove the blocks and the checkpoint once the graph is saved.
+        """
+        shutil.rmtree(self.directory, ignore_errors=True)
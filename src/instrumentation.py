@@ -0,0 +1,141 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Timing and memory instrumentation of the stages and their steps, with nested spans:
+
+    with span("voxelize", nodes=len(positions)) as record:
+        ...
+    print(record['wall'])
+
+A span measures its wall time, the CPU time of its process and its peak resident memory (a lower
+bound when the process reached its peak before the span). Once configure() is called, every span is
+written as one json line in <directory>/<process>-<pid>.jsonl (process: python or blender): the
+directory is given to the worker processes and to Blender through PLUME_SPANS. With PLUME_PROFILE
+set to a span name (Config.PROFILE_SPAN), the spans with this name are profiled with cProfile
+(<directory>/<name>-<pid>-<number>.prof). The spans of a generation are merged in one report with:
+
+    $ python3 src/instrumentation.py data/<generation_name>
+
+Only the standard library is used here: this module is also imported by blender.py.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from resources import current_memory, peak_memory
+
+SPANS_DIRECTORY = "spans"
+
+_local = threading.local()
+_lock = threading.Lock()
+_nb_profiles = 0
+
+
+def configure(directory_p, profile_p=None):
+    """
+    Write the spans of this process and of its future child processes in directory_p, and profile the
+    spans named profile_p
+    """
+    os.makedirs(directory_p, exist_ok=True)
+    os.environ["PLUME_SPANS"] = directory_p
+    if profile_p:
+        os.environ["PLUME_PROFILE"] = profile_p
+    else:
+        os.environ.pop("PLUME_PROFILE", None)
+
+
+def _process_name():
+    return "blender" if "bpy" in sys.modules else "python"
+
+
+def _write(directory_p, record_p):
+    with _lock:
+        with open(os.path.join(directory_p, f"{record_p['process']}-{record_p['pid']}.jsonl"), "a") as outfile:
+            outfile.write(json.dumps(record_p) + "\n")
+
+
+def _profile_path(directory_p, name_p):
+    global _nb_profiles
+    with _lock:
+        _nb_profiles += 1
+        return os.path.join(directory_p, f"{name_p}-{os.getpid()}-{_nb_profiles}.prof")
+
+
+@contextmanager
+def span(name_p, **attributes_p):
+    """
+    Measure the block as the span name_p (attributes_p: json serializable details, such as the index).
+    Yield its record, complete at the end of the block.
+    """
+    directory = os.environ.get("PLUME_SPANS")
+    stack = _local.__dict__.setdefault('stack', [])
+    stack.append(name_p)
+    record = {'name': name_p, 'path': "/".join(stack), 'process': _process_name(), 'pid': os.getpid(), **attributes_p}
+    profiler = None
+    if directory and os.environ.get("PLUME_PROFILE") == name_p:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+    start_memory, start_peak = current_memory(), peak_memory()
+    start, start_cpu = time.time(), time.process_time()
+    record['status'] = "failed"
+    try:
+        yield record
+        record['status'] = "done"
+    finally:
+        record['start'] = start
+        record['wall'] = time.time() - start
+        record['cpu'] = time.process_time() - start_cpu
+        end_peak = peak_memory()
+        record['peak_rss'] = end_peak if end_peak > start_peak else max(start_memory, current_memory())
+        stack.pop()
+        if profiler is not None:
+            profiler.disable()
+            record['profile'] = _profile_path(directory, name_p)
+            profiler.dump_stats(record['profile'])
+        if directory:
+            _write(directory, record)
+
+
+def load_spans(directory_p):
+    """
+    Return the spans of every process written in directory_p, in starting order
+    """
+    spans = []
+    for name in sorted(os.listdir(directory_p)):
+        if name.endswith(".jsonl"):
+            with open(os.path.join(directory_p, name)) as infile:
+                spans += [json.loads(line) for line in infile if line.strip()]
+    return sorted(spans, key=lambda record: record['start'])
+
+
+def merge_spans(spans_p):
+    """
+    Return the report of the spans, one entry per process and span path: number of spans, total and
+    maximal wall time, total CPU time (seconds), maximal peak resident memory (bytes) and failures.
+    """
+    report = {}
+    for record in spans_p:
+        entry = report.setdefault(f"{record['process']}:{record['path']}", {'count': 0, 'wall': 0.0, 'wall_max': 0.0, 'cpu': 0.0, 'peak_rss': 0, 'failed': 0})
+        entry['count'] += 1
+        entry['wall'] += record['wall']
+        entry['wall_max'] = max(entry['wall_max'], record['wall'])
+        entry['cpu'] += record['cpu']
+        entry['peak_rss'] = max(entry['peak_rss'], record['peak_rss'])
+        entry['failed'] += record['status'] != "done"
+    return report
+
+
+if __name__ == '__main__':
+    # Merge the spans of a generation in spans_report.json and print them
+    generation_path = sys.argv[1]
+    report = merge_spans(load_spans(os.path.join(generation_path, SPANS_DIRECTORY)))
+    with open(os.path.join(generation_path, "spans_report.json"), "w") as outfile:
+        json.dump(report, outfile, indent=4)
+    print(f"{'span':60} {'count':>6} {'wall (s)':>10} {'max (s)':>10} {'cpu (s)':>10} {'peak (MB)':>10}")
+    for path, entry in report.items():
+        print(f"{path:60} {entry['count']:>6} {entry['wall']:>10.2f} {entry['wall_max']:>10.2f} {entry['cpu']:>10.2f} {entry['peak_rss']/1e6:>10.1f}")
@@ -1,12 +1,9 @@
 # SPDX-License-Identifier: BSD-3-Clause
 
 import numpy as np
-from scipy.ndimage import gaussian_filter
-import pyvista as pv
-import matplotlib.pyplot as plt
-from matplotlib.widgets import Slider
 import json
 
+
 class ProceduralLavaTube:
     def __init__(
         self, 
@@ -24,8 +21,7 @@ class ProceduralLavaTube:
         self.min_neck_minor = min_neck_minor            # Min allowed for minor axis at necks
         self.chamber_major = chamber_major
         self.chamber_minor = chamber_minor
-        if seed is not None:
-            np.random.seed(seed)
+        self.random = np.random.default_rng(seed)
         self.reset()
 
     def reset(self):
@@ -38,8 +34,8 @@ class ProceduralLavaTube:
         if center_z is None:
             center_z = self.shape[2] // 2
         x = np.arange(length)
-        y = center_y + amplitude * np.sin(freq * x) + np.random.randn(length) * 0.7
-        z = center_z + 3.5 * np.sin(freq * x + 1.2) + np.random.randn(length) * 0.5
+        y = center_y + amplitude * np.sin(freq * x) + self.random.standard_normal(length) * 0.7
+        z = center_z + 3.5 * np.sin(freq * x + 1.2) + self.random.standard_normal(length) * 0.5
         main_path = np.stack([x, y, z], axis=1)
         self.main_path = main_path
         self.paths.append(('main', main_path, self.tube_major_radius, self.tube_minor_radius))
@@ -49,26 +45,26 @@ class ProceduralLavaTube:
         main_len = len(self.main_path)
         for i in range(n_branches):
             # Randomly pick branch start and length
-            leave = np.random.randint(10, main_len - max_length - 10)
-            blen = np.random.randint(min_length, max_length+1)
+            leave = self.random.integers(10, main_len - max_length - 10)
+            blen = self.random.integers(min_length, max_length+1)
             rejoin = leave + blen
             if rejoin > main_len - 3:
                 rejoin = main_len - 3
             # Branch is offset from main, can arc and then possibly rejoin
             branch_path = self.main_path[leave:rejoin].copy()
-            offset = np.random.uniform(min_offset, max_offset)
+            offset = self.random.uniform(min_offset, max_offset)
             arc = np.sin(np.linspace(0, np.pi, blen))  # arc shape in Y
             branch_path[:, 1] += offset * arc
             # Small Z arc for vertical offset variety
-            branch_path[:, 2] += np.random.uniform(-2.0, 2.5) * arc
+            branch_path[:, 2] += self.random.uniform(-2.0, 2.5) * arc
             # Optionally, rejoin by reducing offset toward end of branch
-            if p_rejoin > 0 and np.random.rand() < p_rejoin:
+            if p_rejoin > 0 and self.random.random() < p_rejoin:
                 arc2 = np.sin(np.linspace(np.pi, 2*np.pi, blen))
                 branch_path[:, 1] += -offset * 0.85 * arc2  # back toward main
-                branch_path[:, 2] += np.random.uniform(-2.0, 2.5) * arc2
+                branch_path[:, 2] += self.random.uniform(-2.0, 2.5) * arc2
             # Elliptical: Use same or slightly varied axes as main tube
-            major = self.tube_major_radius * np.random.uniform(0.9, 1.1)
-            minor = self.tube_minor_radius * np.random.uniform(0.9, 1.1)
+            major = self.tube_major_radius * self.random.uniform(0.9, 1.1)
+            minor = self.tube_minor_radius * self.random.uniform(0.9, 1.1)
             self.paths.append((f'branch{i+1}', branch_path, major, minor))
 
     def carve_tubes(
@@ -86,26 +82,26 @@ class ProceduralLavaTube:
             # Pick random chambers and necks
             chamber_population = np.arange(10, plen-10)
             chamber_count = min(n_chambers, len(chamber_population))
-            chamber_idx = np.random.choice(chamber_population, size=chamber_count, replace=False) if chamber_count > 0 else []
+            chamber_idx = self.random.choice(chamber_population, size=chamber_count, replace=False) if chamber_count > 0 else []
 
             neck_population = np.arange(8, plen-8)
             neck_count = min(n_necks, len(neck_population))
-            neck_idx = np.random.choice(neck_population, size=neck_count, replace=False) if neck_count > 0 else []
+            neck_idx = self.random.choice(neck_population, size=neck_count, replace=False) if neck_count > 0 else []
 
             
             for i, pt in enumerate(path):
                 # Vary axes for natural look
-                a = base_major + 0.6 * np.sin(0.2*i + np.random.uniform(-0.6, 0.6))
-                b = base_minor + 0.4 * np.sin(0.2*i + np.random.uniform(-0.6, 0.6))
-                a += np.random.uniform(-0.2, 0.2)
-                b += np.random.uniform(-0.2, 0.2)
+                a = base_major + 0.6 * np.sin(0.2*i + self.random.uniform(-0.6, 0.6))
+                b = base_minor + 0.4 * np.sin(0.2*i + self.random.uniform(-0.6, 0.6))
+                a += self.random.uniform(-0.2, 0.2)
+                b += self.random.uniform(-0.2, 0.2)
                 # Chambers
                 if i in chamber_idx:
-                    a += chamber_major * np.random.uniform(0.7, 1.0)
-                    b += chamber_minor * np.random.uniform(0.7, 1.0)
+                    a += chamber_major * self.random.uniform(0.7, 1.0)
+                    b += chamber_minor * self.random.uniform(0.7, 1.0)
                 # Necks
                 if i in neck_idx:
-                    b = max(b - (base_minor - neck_minor) * np.random.uniform(0.9, 1.3), neck_minor)
+                    b = max(b - (base_minor - neck_minor) * self.random.uniform(0.9, 1.3), neck_minor)
                 # No negative or zero axes!
                 a = max(a, 0.6)
                 b = max(b, self.min_neck_minor)
@@ -120,10 +116,14 @@ class ProceduralLavaTube:
                                     self.volume[x, y, z] = 0
 
     def smooth(self, sigma=1.15):
+        from scipy.ndimage import gaussian_filter
+
         smooth = gaussian_filter(self.volume.astype(float), sigma=sigma)
         self.mask = (smooth < 0.5).astype(np.uint8)
 
     def plot_3d(self):
+        import pyvista as pv
+
         grid = pv.ImageData()
         grid.dimensions = np.array(self.mask.shape) + 1
         grid.origin = (0, 0, 0)
@@ -134,6 +134,9 @@ class ProceduralLavaTube:
         tube_mesh.plot(opacity=1.0)
 
     def scroll_cross_section(self):
+        import matplotlib.pyplot as plt
+        from matplotlib.widgets import Slider
+
         fig, ax = plt.subplots(figsize=(6,5))
         plt.subplots_adjust(bottom=0.18)
         init_x = self.shape[0] // 2
@@ -210,6 +213,42 @@ class ProceduralLavaTube:
 
 
 
+def lava_tube(algorithm_p):
+    """
+    LAVA TUBE CONTEXT
+    Build the graph from the skeleton of a procedural lava tube filling the generation box: the main
+    tube along the x axis and the side branches leaving and rejoining it (one every 60 units).
+    The starting node is moved to the beginning of the main tube.
+    """
+    graph = algorithm_p.graph
+    size = np.asarray(algorithm_p.generation_size, dtype=np.float64)
+    tube = ProceduralLavaTube(shape=tuple(int(length) for length in size), seed=int(algorithm_p.random.integers(2**32)))
+    tube.generate_main_path(length=int(size[0]))
+    tube.add_side_branches(n_branches=int(size[0]) // 60)
+
+    # Skeleton centered in the generation box
+    _, main_path, major, minor = tube.paths[0]
+    main_path = main_path - size / 2
+    if not algorithm_p.three_dimension:
+        main_path[:, 2] = 0.0
+    graph.set_coordinates(0, dict(zip(('x', 'y', 'z'), main_path[0].tolist())))
+    graph.nodes[0].set_radius((major + minor) / 2)
+    main_ids = np.concatenate(([0], np.arange(graph.nb_nodes, graph.nb_nodes + len(main_path) - 1)))
+    graph.add_nodes(main_ids[1:], main_ids[:-1], main_path[1:], (major + minor) / 2)
+
+    for _, branch_path, major, minor in tube.paths[1:]:
+        branch_path = branch_path - size / 2
+        if not algorithm_p.three_dimension:
+            branch_path[:, 2] = 0.0
+        # Both ends of a branch lie on the main tube: they are replaced by the closest main tube nodes
+        leave, rejoin = np.argmin(np.linalg.norm(main_path[:, None, :] - branch_path[[0, -1]], axis=2), axis=0)
+        branch_path = branch_path[1:-1]
+        first_id = graph.nb_nodes
+        parents = np.concatenate(([main_ids[leave]], np.arange(first_id, first_id + len(branch_path) - 1)))
+        graph.add_nodes(np.arange(first_id, first_id + len(branch_path)), parents, branch_path, (major + minor) / 2)
+        graph.add_edges([graph.nb_nodes - 1], [main_ids[rejoin]])
+
+
 # --- Example usage ---
 if __name__ == "__main__":
     
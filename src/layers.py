@@ -0,0 +1,76 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Explicit multi-layer caves (Config.NB_LAYERS).
+The generation box is split in NB_LAYERS horizontal slabs. The planar graph of every layer is grown
+in its own worker process (regions.py, with the REGIONS tiling along x and y), so all the layers
+are generated at once. Adjacent layers are then linked by passages: sloped chains of nodes going
+down by Z_AXIS_LAYER_STEP at most per node while moving Z_AXIS_STEP_DOWN_XY_SHIFT times as much
+horizontally, between endpoints picked with a spatial query on the lower layer.
+"""
+import numpy as np
+
+from config import Config
+from regions import bridge, grow_regions
+
+
+def passage_endpoints(upper_p, lower_p, run_p, nb_passages_p, random_p):
+    """
+    Return the (i, j) rows of the endpoints of up to nb_passages_p passages between the (n, 3) node
+    positions upper_p and lower_p of two adjacent layers: random upper nodes, each with the lower node
+    whose horizontal distance is the closest to run_p.
+    """
+    from scipy.spatial import cKDTree
+
+    tree = cKDTree(lower_p[:, :2])
+    starts = np.sort(random_p.choice(len(upper_p), min(nb_passages_p, len(upper_p)), replace=False))
+    ends = np.empty(len(starts), dtype=np.int64)
+    for passage, close in enumerate(tree.query_ball_point(upper_p[starts, :2], 1.5 * run_p)):
+        if close:
+            distances = np.linalg.norm(lower_p[close, :2] - upper_p[starts[passage], :2], axis=1)
+            ends[passage] = close[int(np.argmin(np.abs(distances - run_p)))]
+        else:
+            ends[passage] = tree.query(upper_p[starts[passage], :2])[1]
+    return starts, ends
+
+
+def link_layers(graph_p, layer_ids_p, spacing_p, random_p, nb_passages_p=None):
+    """
+    Link every pair of adjacent layers of graph_p (layer_ids_p: node ids of every layer, bottom first,
+    spacing_p apart) by sloped passages. Return the number of passages and of nodes added.
+    """
+    nb_passages = Config.LAYER_PASSAGES.value if nb_passages_p is None else nb_passages_p
+    # Number of steps of a passage: Z_AXIS_LAYER_STEP down at most, shifted horizontally at every step
+    nb_steps = max(1, int(np.ceil(spacing_p / Config.Z_AXIS_LAYER_STEP.value)))
+    run = nb_steps * Config.Z_AXIS_LAYER_STEP.value * Config.Z_AXIS_STEP_DOWN_XY_SHIFT.value
+    positions = graph_p.get_positions()
+    nb_links, nb_nodes = 0, 0
+    for lower_ids, upper_ids in zip(layer_ids_p[:-1], layer_ids_p[1:]):
+        if not len(lower_ids) or not len(upper_ids):
+            continue
+        starts, ends = passage_endpoints(positions[graph_p.get_rows(upper_ids)], positions[graph_p.get_rows(lower_ids)], run, nb_passages, random_p)
+        for start, end in zip(upper_ids[starts].tolist(), lower_ids[ends].tolist()):
+            nb_nodes += bridge(graph_p, start, end, nb_steps)
+            nb_links += 1
+    return nb_links, nb_nodes
+
+
+def grow_layers(graph_p, seed_sequence_p, selected_algorithm_p, random_p, nb_layers_p=None):
+    """
+    Grow the layers in a process pool and link them in graph_p (empty). Return the number of passages.
+    """
+    nb_layers = Config.NB_LAYERS.value if nb_layers_p is None else nb_layers_p
+    regions = (Config.REGIONS.value[0], Config.REGIONS.value[1], nb_layers)
+    _, offsets = grow_regions(graph_p, seed_sequence_p, selected_algorithm_p, regions_p=regions, planar_p=True)
+    regions_per_layer = regions[0] * regions[1]
+    layer_ids = [np.arange(offsets[layer * regions_per_layer], offsets[(layer + 1) * regions_per_layer]) for layer in range(nb_layers)]
+    spacing = Config.GENERATION_SIZE.value[2] / nb_layers
+    nb_passages, nb_passage_nodes = link_layers(graph_p, layer_ids, spacing, random_p)
+    graph_p.data['layers'] = {
+        'nb_layers': nb_layers,
+        'spacing': spacing,
+        'nb_nodes': [len(ids) for ids in layer_ids],
+        'passages': nb_passages,
+        'passage_nodes': nb_passage_nodes,
+    }
+    return nb_passages
@@ -6,7 +6,7 @@ class Node:
     def __init__(self, node_id_p, parent_p=None, edges_p=None, coordinates_p=[0.0,0.0,0.0], radius_p=None, active_p=False):
         self.id = node_id_p
         self.parent = parent_p if parent_p is not None else None
-        self.edges = edges_p if edges_p is not None else [self.parent]
+        self.edges = edges_p if edges_p is not None else []
         self.coordinates = {
             'x': coordinates_p[0] if coordinates_p is not None else 0.0,
             'y': coordinates_p[1] if coordinates_p is not None else 0.0,
@@ -0,0 +1,122 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+NumPy implementation of 2D simplex noise (fractal sum of octaves) evaluated over whole arrays,
+and a bank of precomputed, seeded noise profiles around a circle used as direction distributions.
+"""
+import math
+
+import numpy as np
+
+
+F2 = 0.5 * (math.sqrt(3.0) - 1.0)
+G2 = (3.0 - math.sqrt(3.0)) / 6.0
+GRADIENTS = np.array([(1, 1), (-1, 1), (1, -1), (-1, -1), (1, 0), (-1, 0), (1, 0), (-1, 0), (0, 1), (0, -1), (0, 1), (0, -1)], dtype=np.float64)
+
+
+class SimplexNoise:
+    def __init__(self, seed_p=0):
+        """
+        The permutation table is shuffled from seed_p.
+        """
+        permutation = np.random.default_rng(seed_p).permutation(256)
+        self.permutation = np.concatenate((permutation, permutation))
+
+
+    def _corner(self, x_p, y_p, gradient_p):
+        t = 0.5 - x_p * x_p - y_p * y_p
+        contribution = t ** 4 * (GRADIENTS[gradient_p, 0] * x_p + GRADIENTS[gradient_p, 1] * y_p)
+        return np.where(t < 0, 0.0, contribution)
+
+
+    def noise2(self, x_p, y_p):
+        """
+        Return the simplex noise (in [-1, 1]) at every point of the x_p, y_p arrays.
+        """
+        x = np.asarray(x_p, dtype=np.float64)
+        y = np.asarray(y_p, dtype=np.float64)
+        # Skew the input space to find the simplex cell
+        s = (x + y) * F2
+        i = np.floor(x + s).astype(np.int64)
+        j = np.floor(y + s).astype(np.int64)
+        t = (i + j) * G2
+        x0 = x - (i - t)
+        y0 = y - (j - t)
+        # Middle corner of the simplex: (1, 0) for the lower triangle, (0, 1) for the upper one
+        i1 = (x0 > y0).astype(np.int64)
+        j1 = 1 - i1
+        x1 = x0 - i1 + G2
+        y1 = y0 - j1 + G2
+        x2 = x0 - 1.0 + 2.0 * G2
+        y2 = y0 - 1.0 + 2.0 * G2
+
+        ii = i & 255
+        jj = j & 255
+        permutation = self.permutation
+        gradient_0 = permutation[ii + permutation[jj]] % 12
+        gradient_1 = permutation[ii + i1 + permutation[jj + j1]] % 12
+        gradient_2 = permutation[ii + 1 + permutation[jj + 1]] % 12
+        return 70.0 * (self._corner(x0, y0, gradient_0) + self._corner(x1, y1, gradient_1) + self._corner(x2, y2, gradient_2))
+
+
+    def fractal2(self, x_p, y_p, octaves_p=1, persistence_p=0.5, lacunarity_p=2.0):
+        """
+        Return the normalized sum of octaves_p noise octaves at every point of the x_p, y_p arrays.
+        octaves_p, persistence_p and lacunarity_p are scalars or arrays broadcastable to the points.
+        """
+        x = np.asarray(x_p, dtype=np.float64)
+        y = np.asarray(y_p, dtype=np.float64)
+        octaves = np.asarray(octaves_p)
+        persistence = np.asarray(persistence_p, dtype=np.float64)
+        lacunarity = np.asarray(lacunarity_p, dtype=np.float64)
+        total = np.zeros(np.broadcast(x, y, octaves, persistence, lacunarity).shape)
+        amplitudes = np.zeros_like(total)
+        amplitude = np.ones_like(total)
+        frequency = np.ones_like(total)
+        for octave in range(int(octaves.max())):
+            used = octave < octaves
+            total += np.where(used, amplitude * self.noise2(x * frequency, y * frequency), 0.0)
+            amplitudes += np.where(used, amplitude, 0.0)
+            amplitude = amplitude * persistence
+            frequency = frequency * lacunarity
+        return total / np.maximum(amplitudes, 1e-12)
+
+
+class NoiseBank:
+    def __init__(self, nb_profiles_p=256, nb_samples_p=360, seed_p=0, max_scale_p=10.0, max_octaves_p=1.0, max_persistence_p=5.0, max_lacunarity_p=2.0):
+        """
+        Precompute nb_profiles_p noise distributions of nb_samples_p values around a circle, all at once.
+        Every profile draws its scale, octaves, persistence and lacunarity like the former per call
+        parameters, and a random offset in the noise plane.
+        """
+        random = np.random.default_rng(seed_p)
+        self.seed = seed_p
+        self.noise = SimplexNoise(random.integers(2**32))
+        self.scales = random.uniform(0.1, max_scale_p, nb_profiles_p)
+        self.octaves = np.maximum(np.rint(random.uniform(0.1, max_octaves_p, nb_profiles_p)), 1).astype(np.int64)
+        self.persistences = random.uniform(0.1, max_persistence_p, nb_profiles_p)
+        self.lacunarities = random.uniform(0.1, max_lacunarity_p, nb_profiles_p)
+        self.offsets = random.uniform(-1000.0, 1000.0, (nb_profiles_p, 2))
+
+        # Sampling along a circle makes the profiles periodic (no jump between 359 and 0 degrees)
+        angles = np.linspace(0.0, 2 * math.pi, nb_samples_p, endpoint=False)
+        radius = self.scales[:, None] / (2 * math.pi)
+        x = self.offsets[:, :1] + radius * np.cos(angles)
+        y = self.offsets[:, 1:] + radius * np.sin(angles)
+        values = self.noise.fractal2(x, y, self.octaves[:, None], self.persistences[:, None], self.lacunarities[:, None])
+
+        # Normalize the values so every profile sums to 1
+        values = values - values.min(axis=1, keepdims=True)
+        sums = values.sum(axis=1, keepdims=True)
+        self.profiles = np.where(sums > 0, values / np.where(sums > 0, sums, 1.0), 1.0 / nb_samples_p)
+
+
+    def __len__(self):
+        return len(self.profiles)
+
+
+    def profile(self, index_p):
+        """
+        Return the distribution of the profile index_p.
+        """
+        return self.profiles[index_p]
@@ -0,0 +1,195 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Coarse occupancy grid of the generation box, used to reject new nodes whose sphere reaches the
+cave already grown elsewhere. Every cell stores the newest node it holds, so a test reads the
+bounded number of cells covered by the candidate sphere (O(1) whatever the size of the graph).
+Nodes of the close family of the candidate (its ancestors up to a number of hops and their
+children) never cause a collision, a new node always being close to the nodes it grows from.
+"""
+import math
+
+import numpy as np
+
+
+class OccupancyGrid:
+    def __init__(self, size_p, cell_size_p=2.0, exempt_hops_p=3, max_cells_p=1 << 25):
+        """
+        size_p is the (x, y, z) size of the generation box, centered on the origin.
+        The cell size is enlarged if the grid would have more than max_cells_p cells.
+        """
+        size = np.asarray(size_p, dtype=np.float64)
+        self.cell_size = max(float(cell_size_p), (np.prod(size) / max_cells_p) ** (1 / 3))
+        self.exempt_hops = exempt_hops_p
+        self.origin = -size / 2
+        self.shape = np.ceil(size / self.cell_size).astype(np.int64) + 1
+        self._owners = np.full(int(np.prod(self.shape)), -1, dtype=np.int32)
+        # Parent of every marked node id (ancestor lookups of the exemptions)
+        self._parents = np.full(1024, -1, dtype=np.int32)
+        self._stencils = {}
+        self._flat_stencils = {}
+        # Candidates tested (once each, whatever their number of draws) and finally rejected, see count()
+        self.nb_tests = 0
+        self.nb_rejections = 0
+
+
+    def _stencil(self, radius_cells_p):
+        """
+        Return the cell offsets whose center is within radius_cells_p cells of the center cell.
+        """
+        if radius_cells_p not in self._stencils:
+            span = np.arange(-radius_cells_p, radius_cells_p + 1)
+            offsets = np.stack(np.meshgrid(span, span, span, indexing='ij'), axis=-1).reshape(-1, 3)
+            self._stencils[radius_cells_p] = offsets[np.sum(offsets ** 2, axis=1) <= radius_cells_p ** 2]
+        return self._stencils[radius_cells_p]
+
+
+    def _flat_stencil(self, radius_cells_p):
+        """
+        Return the flat index offsets of the stencil of radius_cells_p cells (valid away from the grid borders).
+        """
+        if radius_cells_p not in self._flat_stencils:
+            strides = np.array([self.shape[1] * self.shape[2], self.shape[2], 1], dtype=np.int64)
+            self._flat_stencils[radius_cells_p] = self._stencil(radius_cells_p) @ strides
+        return self._flat_stencils[radius_cells_p]
+
+
+    def _cells(self, positions_p, radii_p):
+        """
+        Return the (sphere index, flat cell index) pairs of the cells covered by every sphere.
+        """
+        positions = np.asarray(positions_p, dtype=np.float64).reshape(-1, 3)
+        centers = np.floor((positions - self.origin) / self.cell_size).astype(np.int64)
+        radius_cells = (np.asarray(radii_p, dtype=np.float64) / self.cell_size).astype(np.int64)
+        spheres, cells = [], []
+        for radius in np.unique(radius_cells).tolist():
+            selected = np.flatnonzero(radius_cells == radius)
+            offsets = self._stencil(radius)
+            covered = (centers[selected, None, :] + offsets).reshape(-1, 3)
+            inside = np.all((covered >= 0) & (covered < self.shape), axis=1)
+            spheres.append(np.repeat(selected, len(offsets))[inside])
+            cells.append(np.ravel_multi_index(covered[inside].T, self.shape))
+        if not spheres:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        return np.concatenate(spheres), np.concatenate(cells)
+
+
+    def _family(self, parents_p, exempt_hops_p):
+        """
+        Return the (n, hops+1) ancestors of the candidates (parent, grand parent...), -2 past the root.
+        """
+        family = np.full((len(parents_p), exempt_hops_p + 1), -2, dtype=np.int64)
+        family[:, 0] = parents_p
+        for hop in range(1, exempt_hops_p + 1):
+            previous = family[:, hop - 1]
+            known = (previous >= 0) & (previous < len(self._parents))
+            family[known, hop] = self._parents[previous[known]]
+            family[family[:, hop] < 0, hop] = -2
+        return family
+
+
+    def mark(self, node_ids_p, parents_p, positions_p):
+        """
+        Mark the cells holding new nodes (parents_p uses -1 or None for the root).
+        """
+        node_ids = np.asarray(node_ids_p, dtype=np.int64).reshape(-1)
+        if not len(node_ids):
+            return
+        parents = np.array([-1 if parent is None else parent for parent in parents_p], dtype=np.int64).reshape(-1)
+        if node_ids.max() >= len(self._parents):
+            grown = np.full(max(int(node_ids.max()) + 1, 2 * len(self._parents)), -1, dtype=np.int32)
+            grown[:len(self._parents)] = self._parents
+            self._parents = grown
+        self._parents[node_ids] = parents
+        positions = np.asarray(positions_p, dtype=np.float64).reshape(-1, 3)
+        cells = np.floor((positions - self.origin) / self.cell_size).astype(np.int64)
+        inside = np.all((cells >= 0) & (cells < self.shape), axis=1)
+        # The newest node keeps the cell
+        np.maximum.at(self._owners, np.ravel_multi_index(cells[inside].T, self.shape), node_ids[inside].astype(np.int32))
+
+
+    def collides(self, parents_p, positions_p, radii_p, exempt_hops_p=None):
+        """
+        Return, for every candidate child of parents_p, whether its sphere covers a cell holding a
+        node outside its family.
+        """
+        parents = np.asarray(parents_p, dtype=np.int64).reshape(-1)
+        exempt_hops = self.exempt_hops if exempt_hops_p is None else exempt_hops_p
+        spheres, cells = self._cells(positions_p, radii_p)
+        owners = self._owners[cells].astype(np.int64)
+        occupied = owners >= 0
+        spheres, owners = spheres[occupied], owners[occupied]
+        family = self._family(parents, exempt_hops)[spheres]
+        exempt = np.any(family == owners[:, None], axis=1) | np.any(family == self._parents[owners][:, None], axis=1)
+        collided = np.zeros(len(parents), dtype=bool)
+        collided[spheres[~exempt]] = True
+        return collided
+
+
+    def collides_one(self, parent_p, position_p, radius_p):
+        """
+        collides() for a single candidate (sequential growth), without the array set up of the batches:
+        the covered cells are one slice of the flat grid away from its borders and the family is a set.
+        """
+        center = [int(math.floor((position_p[axis] - self.origin[axis]) / self.cell_size)) for axis in range(3)]
+        radius_cells = int(radius_p / self.cell_size)
+        if all(radius_cells <= center[axis] < self.shape[axis] - radius_cells for axis in range(3)):
+            flat_center = (center[0] * self.shape[1] + center[1]) * self.shape[2] + center[2]
+            owners = self._owners[flat_center + self._flat_stencil(radius_cells)]
+        else:
+            covered = np.add(center, self._stencil(radius_cells))
+            covered = covered[np.all((covered >= 0) & (covered < self.shape), axis=1)]
+            owners = self._owners[np.ravel_multi_index(covered.T, self.shape)]
+        owners = set(owners[owners >= 0].tolist())
+        if not owners:
+            return False
+        family = {parent_p}
+        ancestor = parent_p
+        for _ in range(self.exempt_hops):
+            ancestor = int(self._parents[ancestor]) if 0 <= ancestor < len(self._parents) else -1
+            if ancestor < 0:
+                break
+            family.add(ancestor)
+        return any(owner not in family and int(self._parents[owner]) not in family for owner in owners)
+
+
+    def conflicts(self, parents_p, positions_p, radii_p):
+        """
+        Return, for a batch of candidates that do not collide with the grid, whether the sphere of each one
+        covers the cell of an earlier candidate of the batch with another parent.
+        """
+        parents = np.asarray(parents_p, dtype=np.int64).reshape(-1)
+        # First candidate of every cell holding a candidate
+        holders, held_cells = self._cells(positions_p, np.zeros(len(parents)))
+        order = np.lexsort((holders, held_cells))
+        held_cells, first = np.unique(held_cells[order], return_index=True)
+        first_holders = holders[order][first]
+
+        spheres, cells = self._cells(positions_p, radii_p)
+        position = np.minimum(np.searchsorted(held_cells, cells), max(len(held_cells) - 1, 0))
+        held = (held_cells[position] == cells) if len(held_cells) else np.zeros(len(cells), dtype=bool)
+        spheres, claimers = spheres[held], first_holders[position[held]]
+        conflicted = np.zeros(len(parents), dtype=bool)
+        conflicted[spheres[(claimers < spheres) & (parents[claimers] != parents[spheres])]] = True
+        return conflicted
+
+
+    def count(self, nb_tests_p, nb_rejections_p):
+        """
+        Count nb_tests_p candidates tested against the grid, nb_rejections_p of them rejected (after
+        their redraws). A candidate is counted once, however many times it is drawn again.
+        """
+        self.nb_tests += int(nb_tests_p)
+        self.nb_rejections += int(nb_rejections_p)
+
+
+    def summary(self):
+        """
+        Return the json serializable counters of the grid.
+        """
+        return {
+            'cell_size': self.cell_size,
+            'tests': self.nb_tests,
+            'rejections': self.nb_rejections,
+            'rejection_rate': self.nb_rejections / self.nb_tests if self.nb_tests else 0.0,
+        }
@@ -0,0 +1,177 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Tiled generation of large caves (Config.REGIONS).
+The generation box is split in a grid of regions. Every region is grown independently, in a process
+pool, from its own root at the center of the region with its own random stream and node budget.
+The regions are then stitched: the boundary nodes of two neighbouring regions facing each other
+across their common face are connected (mutual nearest nodes within REGION_STITCH_DISTANCE, or the
+closest pair, through a corridor of new nodes, when none is close enough: the cave stays connected).
+"""
+import os
+
+import numpy as np
+
+from config import Config
+
+
+def nb_regions(regions_p):
+    """
+    Return the number of regions of the (x, y, z) grid of regions regions_p.
+    """
+    return int(np.prod(regions_p))
+
+
+def region_boxes(size_p, regions_p):
+    """
+    Return the (n, 3) centers and the (x, y, z) size of the regions splitting the generation box
+    size_p (centered on the origin) in a regions_p grid. Regions are ordered x first.
+    """
+    regions = np.asarray(regions_p, dtype=np.int64)
+    region_size = np.asarray(size_p, dtype=np.float64) / regions
+    cells = np.stack(np.meshgrid(*(np.arange(count) for count in regions), indexing='ij'), axis=-1).reshape(-1, 3)
+    # x first
+    cells = cells[np.lexsort((cells[:, 0], cells[:, 1], cells[:, 2]))]
+    centers = (cells + 0.5) * region_size - np.asarray(size_p, dtype=np.float64) / 2
+    return centers, region_size
+
+
+def grow_region(task_p):
+    """
+    Grow one region. Run in the workers of the process pool.
+    task_p is (region index, center, size, number of nodes, np.random.SeedSequence, algorithm, 3D growth).
+    Return the arrays of the region in the coordinates of the generation box, its ids starting at 0.
+    """
+    from array_graph import ArrayGraph
+    from algorithm import Algorithm
+
+    region, center, size, nb_nodes, seed_sequence, selected_algorithm, three_dimension = task_p
+    random = np.random.default_rng(seed_sequence)
+    graph = ArrayGraph("regions", region, Config.MAX_CREATED_NODE_ON_CIRCLE.value, spatial_index_p=False)
+    graph.add_node(node_id_p=0, coordinates_p=[0.0, 0.0, 0.0], radius_p=random.uniform(1.0, Config.MAX_RADIUS_NODE.value), active_p=True)
+    algorithm = Algorithm(graph_p=graph, random_p=random, generation_size_p=size, nb_nodes_p=nb_nodes, three_dimension_p=three_dimension)
+    algorithm.algorithm(selected_algorithm)
+    return {
+        'ids': graph.get_ids().copy(),
+        'parents': graph.get_parents().copy(),
+        'positions': graph.get_positions() + center,
+        'radii': graph.get_radii().copy(),
+        'edges': graph.get_edges_array().copy(),
+        'occupancy': algorithm.occupancy.summary() if algorithm.occupancy is not None else None,
+        'growth': algorithm.growth,
+    }
+
+
+def stitch_pair(positions_a_p, positions_b_p, axis_p, plane_p, distance_p):
+    """
+    Return the (i, j) rows of the stitch edges between the nodes of two neighbouring regions, whose
+    common face is the plane coordinate plane_p along axis_p.
+    """
+    from scipy.spatial import cKDTree
+
+    # Boundary nodes: close enough to the common face to reach the other region
+    boundary_a = np.flatnonzero(np.abs(positions_a_p[:, axis_p] - plane_p) <= distance_p)
+    boundary_b = np.flatnonzero(np.abs(positions_b_p[:, axis_p] - plane_p) <= distance_p)
+    if not len(boundary_a) or not len(boundary_b):
+        boundary_a, boundary_b = np.arange(len(positions_a_p)), np.arange(len(positions_b_p))
+    distances_a, nearest_a = cKDTree(positions_b_p[boundary_b]).query(positions_a_p[boundary_a])
+    _, nearest_b = cKDTree(positions_a_p[boundary_a]).query(positions_b_p[boundary_b])
+    mutual = (nearest_b[nearest_a] == np.arange(len(boundary_a))) & (distances_a <= distance_p)
+    if not np.any(mutual):
+        mutual[np.argmin(distances_a)] = True
+    return boundary_a[mutual], boundary_b[nearest_a[mutual]]
+
+
+def bridge(graph_p, node_a_p, node_b_p, nb_steps_p):
+    """
+    Connect two distant nodes with a straight corridor of nb_steps_p edges (radius interpolated between
+    both ends). Return the number of nodes added.
+    """
+    rows = graph_p.get_rows([node_a_p, node_b_p])
+    start, end = graph_p.get_positions()[rows]
+    radius_start, radius_end = graph_p.get_radii()[rows]
+    nb_nodes = nb_steps_p - 1
+    if nb_nodes <= 0:
+        graph_p.add_edge(node_a_p, node_b_p)
+        return 0
+    steps = np.arange(1, nb_nodes + 1)[:, None] / (nb_nodes + 1)
+    ids = np.arange(graph_p.nb_nodes, graph_p.nb_nodes + nb_nodes)
+    graph_p.add_nodes(ids, np.concatenate(([node_a_p], ids[:-1])), start + steps * (end - start), radius_start + steps[:, 0] * (radius_end - radius_start))
+    graph_p.add_edge(int(ids[-1]), node_b_p)
+    return nb_nodes
+
+
+def grow_regions(graph_p, seed_sequence_p, selected_algorithm_p, nb_nodes_p=None, size_p=None, regions_p=None, planar_p=False):
+    """
+    Grow the regions in a process pool and stitch them in graph_p (empty).
+    The random stream of every region is spawned from seed_sequence_p (same regions whatever the
+    number of workers). With planar_p, every region is grown in 2D at the height of its center and
+    the regions are only stitched along x and y (layers).
+    Return the number of stitch edges and the first node id of every region (plus the end id).
+    """
+    nb_nodes = Config.NB_NODES.value if nb_nodes_p is None else nb_nodes_p
+    size = Config.GENERATION_SIZE.value if size_p is None else size_p
+    regions = Config.REGIONS.value if regions_p is None else regions_p
+    centers, region_size = region_boxes(size, regions)
+    budgets = np.full(len(centers), nb_nodes // len(centers))
+    budgets[:nb_nodes % len(centers)] += 1
+    tasks = [(region, centers[region], tuple(region_size.tolist()), int(max(budgets[region], 1)),
+              np.random.SeedSequence(seed_sequence_p.entropy, spawn_key=tuple(seed_sequence_p.spawn_key) + (region,)),
+              selected_algorithm_p, False if planar_p else None) for region in range(len(centers))]
+
+    import multiprocessing
+
+    nb_workers = min(Config.REGION_WORKERS.value or os.cpu_count() or 1, len(tasks))
+    # The workers of a pool (PARALLELIZATION) cannot start their own pool
+    if nb_workers > 1 and not multiprocessing.current_process().daemon:
+        with multiprocessing.Pool(processes=nb_workers) as pool:
+            grown = pool.map(grow_region, tasks, chunksize=1)
+    else:
+        grown = [grow_region(task) for task in tasks]
+
+    # Concatenate the regions, their ids shifted after the previous regions
+    offsets = np.cumsum([0] + [len(region['ids']) for region in grown])
+    for region, offset in zip(grown, offsets[:-1]):
+        parents = np.where(region['parents'] >= 0, region['parents'] + offset, -1)
+        graph_p.add_nodes(region['ids'] + offset, parents, region['positions'], region['radii'], link_parents_p=False)
+        graph_p.add_edges(region['edges'][:, 0] + offset, region['edges'][:, 1] + offset)
+
+    # Stitch every pair of regions sharing a face
+    grid = np.asarray(regions, dtype=np.int64)
+    cells = np.stack(np.unravel_index(np.arange(len(grown)), grid[::-1]), axis=1)[:, ::-1]
+    nb_stitches = 0
+    nb_bridge_nodes = 0
+    for region_a in range(len(grown)):
+        for axis in range(2 if planar_p else 3):
+            if cells[region_a, axis] + 1 >= grid[axis]:
+                continue
+            region_b = region_a + int(np.prod(grid[:axis]))
+            plane = centers[region_a, axis] + region_size[axis] / 2
+            rows_a, rows_b = stitch_pair(grown[region_a]['positions'], grown[region_b]['positions'], axis, plane, Config.REGION_STITCH_DISTANCE.value)
+            nodes_a, nodes_b = grown[region_a]['ids'][rows_a] + offsets[region_a], grown[region_b]['ids'][rows_b] + offsets[region_b]
+            if len(nodes_a) == 1 and np.linalg.norm(grown[region_a]['positions'][rows_a[0]] - grown[region_b]['positions'][rows_b[0]]) > Config.REGION_STITCH_DISTANCE.value:
+                # No region reached the common face: corridor between the closest nodes
+                length = np.linalg.norm(grown[region_a]['positions'][rows_a[0]] - grown[region_b]['positions'][rows_b[0]])
+                nb_bridge_nodes += bridge(graph_p, int(nodes_a[0]), int(nodes_b[0]), int(np.ceil(length / Config.MAX_RADIUS_NODE.value)))
+                nb_stitches += 1
+            else:
+                nb_stitches += graph_p.add_edges(nodes_a, nodes_b)
+
+    graph_p.data['regions'] = {
+        'regions': [int(count) for count in regions],
+        'region_size': region_size.tolist(),
+        'nb_nodes': [len(region['ids']) for region in grown],
+        'stitch_edges': nb_stitches,
+        'bridge_nodes': nb_bridge_nodes,
+    }
+    if any(region['growth']['attempts'] for region in grown):
+        growth = {counter: sum(region['growth'][counter] for region in grown) for counter in grown[0]['growth'] if counter != 'status'}
+        growth['status'] = "stalled" if any(region['growth']['status'] == "stalled" for region in grown) else "complete"
+        graph_p.data['growth'] = growth
+    summaries = [region['occupancy'] for region in grown if region['occupancy'] is not None]
+    if summaries:
+        tests = sum(summary['tests'] for summary in summaries)
+        rejections = sum(summary['rejections'] for summary in summaries)
+        graph_p.data['occupancy'] = {'cell_size': summaries[0]['cell_size'], 'tests': tests, 'rejections': rejections,
+                                     'rejection_rate': rejections / tests if tests else 0.0}
+    return nb_stitches, offsets
@@ -0,0 +1,39 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Registry of the graph generation algorithms (Config.SELECTED_ALGORITHM).
+Every algorithm is registered under its name with the module and the function implementing it. The
+module is only imported when the algorithm is selected, so the dependencies of an algorithm never
+slow down the others. The function receives the Algorithm instance (graph, random generator,
+stream...) once the starting node is defined.
+"""
+import importlib
+
+
+ALGORITHMS = {}
+
+
+def register(name_p, module_p, function_p):
+    """
+    Register the algorithm name_p implemented by module_p.function_p (a dotted path inside the module,
+    e.g. "Algorithm.start_mine").
+    """
+    ALGORITHMS[name_p] = (module_p, function_p)
+
+
+def get_algorithm(name_p):
+    """
+    Import and return the function of the algorithm name_p.
+    """
+    if name_p not in ALGORITHMS:
+        raise KeyError(f"Unknown algorithm '{name_p}'. Available: {', '.join(ALGORITHMS)}")
+    module_name, function_name = ALGORITHMS[name_p]
+    function = importlib.import_module(module_name)
+    for attribute in function_name.split('.'):
+        function = getattr(function, attribute)
+    return function
+
+
+register("gaussian_perlin", "algorithm", "Algorithm.start_gaussian_perlin")
+register("mine", "algorithm", "Algorithm.start_mine")
+register("lava_tube", "lava_tubes", "lava_tube")
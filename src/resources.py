@@ -0,0 +1,143 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Preflight estimation of the peak memory (RAM and VRAM) of the generation stages, and measures of
+the actual peaks. The stage scheduler admits a worker only if its estimate fits in the memory left,
+so the host does not swap. The estimates are linear models of the settings (NB_NODES, voxel size of
+the pictures, HIGH_POLY, NUMBER_OF_CHUNKS, TEXTURE_SIZE): their coefficients below are calibrated
+with the peaks logged next to the estimates in data/<name>/resources.json.
+Only the standard library is imported at module level: this module is also imported by blender.py.
+"""
+import os
+
+from config import Config
+
+
+PYTHON_BASE = 250e6                                 # Python interpreter with NumPy and SciPy
+GRAPH_BYTES_PER_NODE = {'array': 600, 'object': 4000}   # Graph storage, spatial index, occupancy grid and analytics
+PREVIEW_BASE = 600e6                                # PyVista (VTK) and the rendering
+PREVIEW_VOXEL_SIZE = 0.6                            # Voxel size of the graph pictures
+PREVIEW_MARGIN = 2.0                                # Margin of the voxel grid around the nodes
+PREVIEW_BYTES_PER_VOXEL = 100                       # Voxel grid points, meshgrid and distance temporaries of Display.voxelize
+BLENDER_BASE = 1.5e9                                # Blender with its add-ons
+MESH_BYTES_PER_NODE = {True: 4e6, False: 4e5}       # Mesh of one graph node, with (HIGH_POLY) or without the remesh
+MESH_BYTES_PER_TRIANGLE = 300
+TEXTURE_BYTES_PER_TEXEL = 32                        # Color, normal and roughness images of a chunk with their float bake buffers
+GPU_TEXTURE_BYTES_PER_TEXEL = 48                    # Bake buffers of one chunk on the GPU
+GPU_BYTES_PER_TRIANGLE = 150
+
+
+def estimate_stage(stage_p):
+    """
+    Return the estimated peak memory of one run of a stage (graph, preview or mesh), in bytes:
+    {'ram', 'vram'}.
+    """
+    nb_nodes = Config.NB_NODES.value
+    if stage_p == "graph":
+        from regions import nb_regions
+
+        ram = PYTHON_BASE + nb_nodes * GRAPH_BYTES_PER_NODE.get(Config.GRAPH_STORAGE.value, GRAPH_BYTES_PER_NODE['object'])
+        # The regions and layers are grown in a pool of worker processes
+        nb_tiles = nb_regions(Config.REGIONS.value) * Config.NB_LAYERS.value
+        if nb_tiles > 1:
+            ram += min(nb_tiles, Config.REGION_WORKERS.value or os.cpu_count() or 1) * PYTHON_BASE
+        return {'ram': ram, 'vram': 0}
+
+    if stage_p == "preview":
+        # Voxel grid of the bounding box of the graph (GENERATION_SIZE at most, with the margin of Display.voxelize)
+        nb_voxels = 1
+        for size in Config.GENERATION_SIZE.value:
+            nb_voxels *= (size + 2 * PREVIEW_MARGIN) / PREVIEW_VOXEL_SIZE
+        return {'ram': PREVIEW_BASE + nb_voxels * PREVIEW_BYTES_PER_VOXEL, 'vram': 0}
+
+    if stage_p == "mesh":
+        nb_triangles = min(Config.MAX_MESH_TRIANGLES.value, nb_nodes * MESH_BYTES_PER_NODE[bool(Config.HIGH_POLY.value)] / MESH_BYTES_PER_TRIANGLE)
+        ram = BLENDER_BASE + nb_triangles * MESH_BYTES_PER_TRIANGLE
+        vram = 0
+        if Config.BAKE_TEXTURE.value:
+            # One set of textures per chunk, the chunks are baked one at a time
+            nb_chunks = Config.NUMBER_OF_CHUNKS.value if Config.SLICE_MESH.value else 1
+            nb_texels = Config.TEXTURE_SIZE.value ** 2
+            ram += nb_chunks * nb_texels * TEXTURE_BYTES_PER_TEXEL
+            if Config.GPU_ACCELERATION.value:
+                vram = nb_texels * GPU_TEXTURE_BYTES_PER_TEXEL + nb_triangles / nb_chunks * GPU_BYTES_PER_TRIANGLE
+        return {'ram': ram, 'vram': vram}
+
+    raise ValueError(f"Unknown stage '{stage_p}'")
+
+
+def available_memory():
+    """
+    Return the memory (bytes) available without swapping
+    """
+    import psutil
+
+    return psutil.virtual_memory().available
+
+
+def available_vram():
+    """
+    Return the free memory (bytes) of the GPU with the most, or None if no NVIDIA GPU is found
+    """
+    import subprocess
+
+    try:
+        output = subprocess.run(["nvidia-smi", "--query-gpu=memory.free", "--format=csv,noheader,nounits"],
+                                capture_output=True, text=True, check=True, timeout=10).stdout
+        return max(int(line) for line in output.split()) * 2**20
+    except (OSError, subprocess.SubprocessError, ValueError):
+        return None
+
+
+def memory_budget():
+    """
+    Return the RAM and VRAM (bytes, None: not limited) the workers of the stages may use at once:
+    MEMORY_BUDGET_GB, or MEMORY_SAFETY_FACTOR of the memory available now.
+    """
+    if Config.MEMORY_BUDGET_GB.value is not None:
+        ram = Config.MEMORY_BUDGET_GB.value * 1e9
+    else:
+        ram = available_memory() * Config.MEMORY_SAFETY_FACTOR.value
+    vram = available_vram()
+    return {'ram': ram, 'vram': vram * Config.MEMORY_SAFETY_FACTOR.value if vram is not None else None}
+
+
+def reset_peak_memory():
+    """
+    Reset the peak resident memory of the current process (Linux only, ignored elsewhere)
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as outfile:
+            outfile.write("5")
+    except OSError:
+        pass
+
+
+def current_memory():
+    """
+    Return the resident memory (bytes) of the current process, or 0 if unknown
+    """
+    try:
+        with open("/proc/self/statm") as infile:
+            return int(infile.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+def peak_memory():
+    """
+    Return the peak resident memory (bytes) of the current process since its start or the last
+    reset_peak_memory(), without its child processes
+    """
+    try:
+        with open("/proc/self/status") as infile:
+            for line in infile:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    import sys
+
+    # Kilobytes on Linux, bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
@@ -0,0 +1,98 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Continuous angle sampling (degrees) for the graph growth.
+Mixtures of wrapped normal distributions are sampled directly, without any probability table.
+Tabulated distributions (e.g. noise profiles) are sampled through their inverse CDF, which is
+cached so repeated parameters never rebuild it.
+"""
+from collections import OrderedDict
+from functools import lru_cache
+
+import numpy as np
+
+
+@lru_cache(maxsize=None)
+def wrapped_standard_deviation(turn_standard_deviation_p):
+    """
+    Return the standard deviation (degrees) of the wrapped normal distribution as concentrated as the
+    former 360 bins tables: a normal distribution of standard deviation turn_standard_deviation_p (a
+    fraction of a turn) over the unwrapped turn [0, 1], averaged over the directions.
+    Both have the same mean resultant length R, and a wrapped normal of standard deviation s (radians)
+    has R = exp(-s**2/2). A standard deviation of 0.5 turn (180 degrees) gives 107 degrees: wrapping
+    180 degrees directly would make the angles almost uniform.
+    """
+    turn = np.linspace(0.0, 1.0, 360)
+    weights = np.exp(-0.5 * ((turn[None, :] - turn[:, None]) / turn_standard_deviation_p) ** 2)
+    weights /= weights.sum(axis=1, keepdims=True)
+    length = max(float(np.mean(np.abs(weights @ np.exp(2j * np.pi * turn)))), 1e-12)
+    return float(np.degrees(np.sqrt(-2 * np.log(length))))
+
+
+class AngularSampler:
+    def __init__(self, standard_deviation_p, cache_size_p=256, random_p=None):
+        """
+        standard_deviation_p is the standard deviation of the wrapped normal distributions in degrees.
+        random_p is the random generator used for the draws (np.random by default).
+        """
+        self.standard_deviation = standard_deviation_p
+        self.cache_size = cache_size_p
+        self.random = random_p if random_p is not None else np.random
+        self._inverse_cdfs = OrderedDict()
+
+
+    def sample_mixture(self, centers_p, weights_p=None, nb_p=1):
+        """
+        Draw nb_p angles in [0, 360) from an equally weighted (or weights_p weighted) mixture of wrapped
+        normal distributions centered on centers_p (degrees).
+        """
+        centers = np.atleast_1d(np.asarray(centers_p, dtype=np.float64))
+        if len(centers) == 1:
+            chosen = np.zeros(nb_p, dtype=np.int64)
+        else:
+            weights = np.full(len(centers), 1 / len(centers)) if weights_p is None else np.asarray(weights_p, dtype=np.float64) / np.sum(weights_p)
+            chosen = np.minimum(np.searchsorted(np.cumsum(weights), self.random.random(nb_p), side='right'), len(centers) - 1)
+        return (centers[chosen] + self.standard_deviation * self.random.standard_normal(nb_p)) % 360
+
+
+    def sample_mixtures(self, centers_p, counts_p):
+        """
+        Draw counts_p[i] angles from the equally weighted mixture of the wrapped normal distributions
+        centered on the row i of the (m, c) array centers_p (NaN for unused components), for every row
+        at once. Return the concatenated angles, row after row.
+        """
+        centers = np.asarray(centers_p, dtype=np.float64).reshape(len(counts_p), -1)
+        rows = np.repeat(np.arange(len(centers)), counts_p)
+        centers = centers[rows]
+        valid = ~np.isnan(centers)
+        # Uniform choice among the valid components of every row
+        chosen = (self.random.random(len(rows)) * valid.sum(axis=1)).astype(np.int64)
+        component = np.argmax(np.cumsum(valid, axis=1) > chosen[:, None], axis=1)
+        return (centers[np.arange(len(rows)), component] + self.standard_deviation * self.random.standard_normal(len(rows))) % 360
+
+
+    def inverse_cdf(self, probability_p, key_p=None):
+        """
+        Return the (cdf, angles) knots of the inverse CDF of a distribution tabulated over [0, 360).
+        The knots are cached under key_p (least recently used entries are dropped first).
+        """
+        if key_p is not None and key_p in self._inverse_cdfs:
+            self._inverse_cdfs.move_to_end(key_p)
+            return self._inverse_cdfs[key_p]
+        probability = np.asarray(probability_p, dtype=np.float64)
+        cdf = np.concatenate(([0.0], np.cumsum(probability)))
+        knots = (cdf / cdf[-1], np.linspace(0.0, 360.0, len(probability) + 1))
+        if key_p is not None:
+            self._inverse_cdfs[key_p] = knots
+            if len(self._inverse_cdfs) > self.cache_size:
+                self._inverse_cdfs.popitem(last=False)
+        return knots
+
+
+    def sample_table(self, probability_p, nb_p=1, key_p=None):
+        """
+        Draw nb_p continuous angles in [0, 360) from a distribution tabulated over equal bins
+        (uniform inside a bin).
+        """
+        cdf, angles = self.inverse_cdf(probability_p, key_p)
+        return np.interp(self.random.random(nb_p), cdf, angles) % 360
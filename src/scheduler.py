@@ -0,0 +1,158 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Pipelined scheduler of the generation stages.
+Every generation index goes through a DAG of stages (graph, preview, mesh...). A stage of an index
+starts as soon as the stages it depends on are done for this index, so the stages of different
+indices overlap: the graphs of the next indices are generated while Blender meshes the previous
+ones. Every stage has its own executor, whose number of workers is the concurrency limit of the
+stage (processes for CPU bound Python stages, threads for the stages waiting on a subprocess).
+With a memory budget, a stage of an index is only started if its estimated peak memory fits in the
+budget left by the running stages (one stage always runs). A failed stage stops its index only.
+"""
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+
+def _timed(function_p, index_p, measure_p=False):
+    """
+    Run function_p(index_p) in the worker and return its duration (seconds) and peak memory (bytes):
+    the value returned by function_p (peak of the subprocess it waited on), or with measure_p the
+    peak of the worker process.
+    """
+    from resources import peak_memory, reset_peak_memory
+
+    if measure_p:
+        reset_peak_memory()
+    start = time.time()
+    peak = function_p(index_p)
+    duration = time.time() - start
+    if peak is None and measure_p:
+        peak = peak_memory()
+    return duration, peak
+
+
+class Stage:
+    def __init__(self, name_p, function_p, depends_p=(), limit_p=1, process_p=False, memory_p=0, vram_p=0):
+        """
+        function_p(index) runs the stage for one generation index (picklable with process_p).
+        At most limit_p indices run the stage at once, in worker processes with process_p (CPU bound
+        Python code) or in threads (subprocesses, I/O). memory_p and vram_p are the estimated peak
+        RAM and VRAM of one run (bytes).
+        """
+        self.name = name_p
+        self.function = function_p
+        self.depends = tuple(depends_p)
+        self.limit = max(1, int(limit_p))
+        self.process = process_p
+        self.memory = memory_p
+        self.vram = vram_p
+
+
+class StageScheduler:
+    def __init__(self, stages_p, budget_p=None):
+        """
+        budget_p: RAM and VRAM (bytes) the running stages may use at once, {'ram', 'vram'} (None: not limited)
+        """
+        self.stages = {stage.name: stage for stage in stages_p}
+        self.budget = dict(budget_p or {})
+        for stage in self.stages.values():
+            unknown = [name for name in stage.depends if name not in self.stages]
+            if unknown:
+                raise ValueError(f"Stage '{stage.name}' depends on unknown stages: {', '.join(unknown)}")
+        self._check_acyclic()
+        self.durations = {}       # (index, stage name): duration of the stage in its worker (seconds)
+        self.failures = {}        # (index, stage name): exception raised by the stage
+        self.peaks = {}           # (index, stage name): measured peak memory of the stage (bytes, None: unknown)
+        self.delayed = set()      # (index, stage name) started later to fit in the memory budget
+
+
+    def _check_acyclic(self):
+        visited, visiting = set(), set()
+
+        def visit(name_p):
+            if name_p in visited:
+                return
+            if name_p in visiting:
+                raise ValueError(f"Cycle in the stages through '{name_p}'")
+            visiting.add(name_p)
+            for depend in self.stages[name_p].depends:
+                visit(depend)
+            visiting.remove(name_p)
+            visited.add(name_p)
+
+        for name in self.stages:
+            visit(name)
+
+
+    def _fits(self, stage_p, reserved_p):
+        """
+        Return True if the estimated memory of stage_p fits in the budget left by the running stages
+        """
+        for resource, needed in (('ram', stage_p.memory), ('vram', stage_p.vram)):
+            if self.budget.get(resource) is not None and reserved_p[resource] + needed > self.budget[resource]:
+                return False
+        return True
+
+
+    def run(self, indices_p):
+        """
+        Run every stage for every index of indices_p (earlier indices first when a stage is busy).
+        Return the failures, {(index, stage name): exception}.
+        """
+        indices = list(indices_p)
+        executors = {name: (ProcessPoolExecutor if stage.process else ThreadPoolExecutor)(max_workers=stage.limit)
+                     for name, stage in self.stages.items()}
+        done = {index: set() for index in indices}
+        submitted = set()
+        failed = set()
+        running = {}
+        nb_running = {name: 0 for name in self.stages}
+        reserved = {'ram': 0, 'vram': 0}
+        try:
+            while True:
+                # Start every stage whose dependencies are done, index by index, while it has an idle
+                # worker and fits in the memory budget (or nothing else runs)
+                for index in indices:
+                    if index in failed:
+                        continue
+                    for name, stage in self.stages.items():
+                        if (index, name) in submitted or not done[index].issuperset(stage.depends) or nb_running[name] >= stage.limit:
+                            continue
+                        if running and not self._fits(stage, reserved):
+                            self.delayed.add((index, name))
+                            continue
+                        running[executors[name].submit(_timed, stage.function, index, stage.process)] = (index, name)
+                        submitted.add((index, name))
+                        nb_running[name] += 1
+                        reserved['ram'] += stage.memory
+                        reserved['vram'] += stage.vram
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    index, name = running.pop(future)
+                    nb_running[name] -= 1
+                    reserved['ram'] -= self.stages[name].memory
+                    reserved['vram'] -= self.stages[name].vram
+                    error = future.exception()
+                    if error is None:
+                        self.durations[(index, name)], self.peaks[(index, name)] = future.result()
+                        done[index].add(name)
+                    else:
+                        self.failures[(index, name)] = error
+                        failed.add(index)
+        finally:
+            for executor in executors.values():
+                executor.shutdown(wait=True, cancel_futures=True)
+        return self.failures
+
+
+    def summary(self):
+        """
+        Return the total duration (seconds, summed over the indices) of every stage.
+        """
+        totals = {name: 0.0 for name in self.stages}
+        for (_, name), duration in self.durations.items():
+            totals[name] += duration
+        return totals
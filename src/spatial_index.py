@@ -0,0 +1,227 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Incrementally maintained spatial index for the graph nodes.
+Points are appended to a small brute-force buffer; full buffers are turned into static KD-trees
+which are merged by pairs of equal size (logarithmic method). An insertion costs O(log n) amortized
+and a query visits at most O(log n) trees plus the buffer.
+"""
+import numpy as np
+
+
+def _kd_tree(points_p):
+    # scipy is only imported once the first tree is built
+    from scipy.spatial import cKDTree
+
+    return cKDTree(points_p)
+
+
+class SpatialIndex:
+    def __init__(self, buffer_size_p=64, capacity_p=1024):
+        """
+        buffer_size_p is the number of points kept in the brute-force buffer before a KD-tree is built.
+        """
+        self.buffer_size = buffer_size_p
+        self.nb_points = 0
+        self._points = np.empty((capacity_p, 3), dtype=np.float64)
+        self._ids = np.empty(capacity_p, dtype=np.int64)
+        # Each tree covers a contiguous range of inserted points: (start, end, tree)
+        self._trees = []
+        self._indexed = 0
+
+
+    def __len__(self):
+        return self.nb_points
+
+
+    def _reserve(self, capacity_p):
+        if capacity_p <= len(self._ids):
+            return
+        capacity = max(capacity_p, 2 * len(self._ids))
+        points = np.empty((capacity, 3), dtype=np.float64)
+        ids = np.empty(capacity, dtype=np.int64)
+        points[:self.nb_points] = self._points[:self.nb_points]
+        ids[:self.nb_points] = self._ids[:self.nb_points]
+        self._points = points
+        self._ids = ids
+
+
+    def insert(self, node_id_p, coordinates_p):
+        """
+        Add one point to the index.
+        """
+        self._reserve(self.nb_points + 1)
+        self._points[self.nb_points] = coordinates_p[:3]
+        self._ids[self.nb_points] = node_id_p
+        self.nb_points += 1
+        if self.nb_points - self._indexed >= self.buffer_size:
+            self._flush_buffer()
+
+
+    def insert_many(self, node_ids_p, coordinates_p):
+        """
+        Add many points to the index at once.
+        """
+        node_ids = np.asarray(node_ids_p, dtype=np.int64)
+        coordinates = np.asarray(coordinates_p, dtype=np.float64).reshape(-1, 3)
+        self._reserve(self.nb_points + len(node_ids))
+        self._points[self.nb_points:self.nb_points+len(node_ids)] = coordinates
+        self._ids[self.nb_points:self.nb_points+len(node_ids)] = node_ids
+        self.nb_points += len(node_ids)
+        if self.nb_points - self._indexed >= self.buffer_size:
+            self._flush_buffer()
+
+
+    def update(self, node_id_p, coordinates_p):
+        """
+        Move an already indexed point and rebuild the tree that contains it.
+        """
+        positions = np.flatnonzero(self._ids[:self.nb_points] == node_id_p)
+        if len(positions) == 0:
+            raise KeyError(node_id_p)
+        position = positions[0]
+        self._points[position] = coordinates_p[:3]
+        for i, (start, end, _) in enumerate(self._trees):
+            if start <= position < end:
+                self._trees[i] = (start, end, _kd_tree(self._points[start:end]))
+                break
+
+
+    def rebuild(self):
+        """
+        Rebuild the index as one single KD-tree.
+        """
+        self._trees = []
+        self._indexed = 0
+        if self.nb_points:
+            self._trees.append((0, self.nb_points, _kd_tree(self._points[:self.nb_points])))
+            self._indexed = self.nb_points
+
+
+    def _flush_buffer(self):
+        """
+        Turn the buffer into a KD-tree and merge trees of similar size.
+        """
+        start = self._indexed
+        end = self.nb_points
+        self._indexed = end
+        # Merge with the previous trees while they are not larger than the new block
+        while self._trees and (self._trees[-1][1] - self._trees[-1][0]) <= (end - start):
+            start = self._trees.pop()[0]
+        self._trees.append((start, end, _kd_tree(self._points[start:end])))
+
+
+    def _buffer(self):
+        return self._points[self._indexed:self.nb_points], self._ids[self._indexed:self.nb_points]
+
+
+    def query_radius(self, point_p, radius_p):
+        """
+        Return the ids of the points within radius_p of point_p.
+        """
+        return self.query_radius_batch(np.asarray(point_p, dtype=np.float64).reshape(1, 3), radius_p)[0]
+
+
+    def query_radius_batch(self, points_p, radius_p):
+        """
+        Return, for every query point, the ids of the points within radius_p (list of arrays).
+        """
+        points = np.asarray(points_p, dtype=np.float64).reshape(-1, 3)
+        results = [[] for _ in range(len(points))]
+        for start, _, tree in self._trees:
+            for i, found in enumerate(tree.query_ball_point(points, radius_p)):
+                if found:
+                    results[i].append(self._ids[start + np.asarray(found, dtype=np.int64)])
+
+        buffer_points, buffer_ids = self._buffer()
+        if len(buffer_ids):
+            distances = np.linalg.norm(points[:, None, :] - buffer_points[None, :, :], axis=2)
+            for i, inside in enumerate(distances <= radius_p):
+                if inside.any():
+                    results[i].append(buffer_ids[inside])
+
+        return [np.concatenate(found) if found else np.empty(0, dtype=np.int64) for found in results]
+
+
+    def query_pairs(self, radius_p):
+        """
+        Return an (m, 2) array with the ids of every pair of points closer than radius_p (one batched
+        query; the index is first merged into a single KD-tree).
+        """
+        if self._indexed < self.nb_points or len(self._trees) > 1:
+            self.rebuild()
+        if not self._trees:
+            return np.empty((0, 2), dtype=np.int64)
+        pairs = self._trees[0][2].query_pairs(radius_p, output_type='ndarray')
+        return self._ids[pairs.reshape(-1, 2)]
+
+
+    def query_knn(self, point_p, k_p=1):
+        """
+        Return the distances and ids of the k_p points closest to point_p.
+        """
+        distances, ids = self.query_knn_batch(np.asarray(point_p, dtype=np.float64).reshape(1, 3), k_p)
+        return distances[0], ids[0]
+
+
+    def query_knn_batch(self, points_p, k_p=1):
+        """
+        Return two (n, k) arrays with the distances and ids of the k_p closest points of every query point.
+        Missing neighbours (less than k points indexed) have an infinite distance and an id of -1.
+        """
+        points = np.asarray(points_p, dtype=np.float64).reshape(-1, 3)
+        all_distances = [np.full((len(points), k_p), np.inf)]
+        all_ids = [np.full((len(points), k_p), -1, dtype=np.int64)]
+        for start, end, tree in self._trees:
+            k = min(k_p, end - start)
+            distances, local = tree.query(points, k=k)
+            distances = distances.reshape(len(points), k)
+            local = local.reshape(len(points), k)
+            all_distances.append(distances)
+            all_ids.append(self._ids[start + local])
+
+        buffer_points, buffer_ids = self._buffer()
+        if len(buffer_ids):
+            distances = np.linalg.norm(points[:, None, :] - buffer_points[None, :, :], axis=2)
+            all_distances.append(distances)
+            all_ids.append(np.broadcast_to(buffer_ids, distances.shape))
+
+        distances = np.concatenate(all_distances, axis=1)
+        ids = np.concatenate(all_ids, axis=1)
+        order = np.argsort(distances, axis=1, kind='stable')[:, :k_p]
+        return np.take_along_axis(distances, order, axis=1), np.take_along_axis(ids, order, axis=1)
+
+
+    def query_box(self, min_p, max_p):
+        """
+        Return the ids of the points inside the axis aligned box [min_p, max_p].
+        """
+        return self.query_box_batch(np.asarray(min_p, dtype=np.float64).reshape(1, 3), np.asarray(max_p, dtype=np.float64).reshape(1, 3))[0]
+
+
+    def query_box_batch(self, mins_p, maxs_p):
+        """
+        Return, for every box, the ids of the points inside it (list of arrays).
+        """
+        mins = np.asarray(mins_p, dtype=np.float64).reshape(-1, 3)
+        maxs = np.asarray(maxs_p, dtype=np.float64).reshape(-1, 3)
+        centers = (mins + maxs) / 2
+        half_sizes = (maxs - mins) / 2
+        # Chebyshev balls enclosing each box, filtered afterwards
+        radii = half_sizes.max(axis=1)
+        results = [[] for _ in range(len(centers))]
+        for start, _, tree in self._trees:
+            for i, found in enumerate(tree.query_ball_point(centers, radii, p=np.inf)):
+                if found:
+                    positions = start + np.asarray(found, dtype=np.int64)
+                    inside = np.all((self._points[positions] >= mins[i]) & (self._points[positions] <= maxs[i]), axis=1)
+                    results[i].append(self._ids[positions[inside]])
+
+        buffer_points, buffer_ids = self._buffer()
+        if len(buffer_ids):
+            inside = np.all((buffer_points[None, :, :] >= mins[:, None, :]) & (buffer_points[None, :, :] <= maxs[:, None, :]), axis=2)
+            for i in range(len(centers)):
+                if inside[i].any():
+                    results[i].append(buffer_ids[inside[i]])
+
+        return [np.concatenate(found) if found else np.empty(0, dtype=np.int64) for found in results]
@@ -0,0 +1,245 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Parameter sweeps over the Config fields. The points of the sweep (grid or random search) are read
+from a json file or from the command line:
+
+    $ python3 src/sweep.py -f sweep.json
+    $ python3 src/sweep.py -n texture_study -p TEXTURE_SIZE=1024,4096 -p NB_NODES=100,200 -seed 1
+    $ python3 src/sweep.py -n size_study -p GENERATION_SIZE=[500,100,100],[250,50,50] -p SELECTED_ALGORITHM=gaussian_perlin,mine
+
+    sweep.json: {"name": "texture_study", "mode": "grid" or "random", "samples": 10 (random only),
+                 "parameters": {"TEXTURE_SIZE": [1024, 4096], "NB_NODES": {"low": 100, "high": 1000}},
+                 "fixed": {"GENERATE_MESH": false}, "seed": 1, "workers": 2}
+
+A random search draws every parameter from its list of values, or uniformly between low and high.
+Every run is a generation named <name>_run<number>, in its own process with its own immutable
+Config (config.configure), given to the generation, its stage workers and Blender through
+PLUME_SETTINGS. The runs are executed concurrently and data/<name>/results.csv gets one row per run:
+its settings, timings, peak memory and graph and mesh statistics.
+"""
+import argparse
+import csv
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+from config import Config, Color
+
+
+# Unattended runs: no viewer, no Blender interface (unless set by the sweep)
+SWEEP_DEFAULTS = {'OPEN_VISUALIZATION': False, 'DEBUG': False}
+
+
+def parse_value(text_p):
+    try:
+        return json.loads(text_p)
+    except ValueError:
+        return text_p
+
+
+def parse_values(text_p):
+    """
+    Parse the values of a swept field, "value,value...": json values, lists included
+    ([500,100,100],[250,50,50]), or bare strings (gaussian_perlin,mine).
+    """
+    try:
+        return json.loads(f"[{text_p}]")
+    except ValueError:
+        pass
+    # Split on the commas outside of the lists and objects
+    values, depth, start = [], 0, 0
+    for position, character in enumerate(text_p):
+        if character in "[{":
+            depth += 1
+        elif character in "]}":
+            depth -= 1
+        elif character == "," and depth == 0:
+            values.append(text_p[start:position])
+            start = position + 1
+    values.append(text_p[start:])
+    return [parse_value(value) for value in values]
+
+
+def sweep_points(parameters_p, mode_p="grid", samples_p=10, seed_p=None):
+    """
+    Return the list of the settings ({field name: value}) of the runs.
+    parameters_p: {field name: list of values, or {'low', 'high'} (random search only)}
+    """
+    unknown = [name for name in parameters_p if name not in Config.__members__]
+    if unknown:
+        raise ValueError(f"Unknown Config fields: {', '.join(unknown)}")
+    names = list(parameters_p)
+    if mode_p == "grid":
+        for name in names:
+            if not isinstance(parameters_p[name], list):
+                raise ValueError(f"A grid sweep needs a list of values for {name}")
+        return [dict(zip(names, values)) for values in itertools.product(*(parameters_p[name] for name in names))]
+    if mode_p == "random":
+        random = np.random.default_rng(seed_p)
+        points = []
+        for _ in range(samples_p):
+            point = {}
+            for name in names:
+                values = parameters_p[name]
+                if isinstance(values, list):
+                    point[name] = values[random.integers(len(values))]
+                elif isinstance(values['low'], int) and isinstance(values['high'], int):
+                    point[name] = int(random.integers(values['low'], values['high'], endpoint=True))
+                else:
+                    point[name] = float(random.uniform(values['low'], values['high']))
+            points.append(point)
+        return points
+    raise ValueError(f"Unknown sweep mode '{mode_p}' (grid or random)")
+
+
+def run_statistics(generation_path_p):
+    """
+    Return the graph statistics (mean over the graphs of the scalar analytics, growth status) and the
+    mesh statistics (number and size of the meshes and textures) of a generation directory.
+    """
+    from analytics import collect_analytics
+
+    statistics = {}
+    analytics = [values for values in collect_analytics(generation_path_p).values() if values]
+    for key in sorted(set().union(*analytics)) if analytics else ():
+        values = [values[key] for values in analytics if isinstance(values.get(key), (int, float)) and not isinstance(values.get(key), bool)]
+        if values:
+            statistics[f"graph_{key}"] = float(np.mean(values))
+    statuses = []
+    meshes, mesh_size, textures = 0, 0, 0
+    for index in sorted(os.listdir(generation_path_p)):
+        directory = os.path.join(generation_path_p, index)
+        if not os.path.isdir(directory):
+            continue
+        metadata = os.path.join(directory, "graph_arrays", "metadata.json")
+        if os.path.exists(metadata):
+            with open(metadata) as infile:
+                statuses.append(json.load(infile).get('growth', {}).get('status', "complete"))
+        for name in os.listdir(directory):
+            if name.startswith("mesh."):
+                meshes += 1
+                mesh_size += os.path.getsize(os.path.join(directory, name))
+            elif "_texture_" in name:
+                textures += 1
+    statistics['graphs'] = len(statuses)
+    statistics['graphs_stalled'] = statuses.count("stalled")
+    statistics['meshes'] = meshes
+    statistics['mesh_size_mb'] = mesh_size / 1e6
+    statistics['textures'] = textures
+    return statistics
+
+
+def run_point(task_p):
+    """
+    Run one point of the sweep: task_p is (run number, name, settings, seed, sweep directory).
+    The generation runs in its own Python process, whose Config is built from PLUME_SETTINGS, and its
+    output is saved in <sweep directory>/<name>.log. Return its row of the results table.
+    """
+    run, name, settings, seed, sweep_path = task_p
+    row = {'run': run, 'name': name, **{f"setting_{key}": value for key, value in settings.items()}}
+    command = [sys.executable, os.path.join(Config.PLUME_DIR.value, "src", "generation.py"), "-n", name]
+    if seed is not None:
+        command += ["-seed", str(seed)]
+    environment = dict(os.environ, PLUME_SETTINGS=json.dumps({**SWEEP_DEFAULTS, **settings}))
+    start = time.time()
+    with open(os.path.join(sweep_path, name + ".log"), "w") as log:
+        result = subprocess.run(command, env=environment, stdout=log, stderr=subprocess.STDOUT)
+    row['duration_s'] = time.time() - start
+
+    generation_path = os.path.join(Config.PLUME_DIR.value, "data", name)
+    failures = {}
+    if os.path.exists(os.path.join(generation_path, "resources.json")):
+        with open(os.path.join(generation_path, "resources.json")) as infile:
+            resources = json.load(infile)
+        failures = resources.get('failures', {})
+        row.update({f"duration_{stage}_s": duration for stage, duration in resources.get('durations', {}).items()})
+        row.update({f"peak_{stage}_gb": max(peak for peak in peaks.values() if peak) / 1e9
+                    for stage, peaks in resources.get('peaks', {}).items() if any(peaks.values())})
+    row['status'] = "done" if result.returncode == 0 and not failures else "failed"
+    row['error'] = "; ".join(f"{stage}: {error}" for stage, error in failures.items()) or (f"exit code {result.returncode}" if result.returncode else "")
+    if os.path.isdir(generation_path):
+        row.update(run_statistics(generation_path))
+    return row
+
+
+def save_results(path_p, rows_p):
+    columns = []
+    for row in rows_p:
+        columns += [column for column in row if column not in columns]
+    with open(path_p, "w", newline="") as outfile:
+        writer = csv.DictWriter(outfile, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(sorted(rows_p, key=lambda row: row['run']))
+
+
+def run_sweep(name_p, points_p, fixed_p=None, seed_p=None, nb_workers_p=None):
+    """
+    Run the generation of every point of the sweep (with the fixed settings) in nb_workers_p processes
+    (None: one per CPU core). Return the rows of the results table, also saved in data/<name_p>/results.csv.
+    """
+    from resources import available_memory
+
+    fixed = dict(fixed_p or {})
+    unknown = [name for name in fixed if name not in Config.__members__]
+    if unknown:
+        raise ValueError(f"Unknown Config fields: {', '.join(unknown)}")
+    nb_workers = max(1, min(len(points_p), nb_workers_p or os.cpu_count() or 1))
+    # The runs at once share the memory (memory-aware admission of the stages of every run)
+    fixed.setdefault('MEMORY_BUDGET_GB', available_memory() * Config.MEMORY_SAFETY_FACTOR.value / nb_workers / 1e9)
+    sweep_path = os.path.join(Config.PLUME_DIR.value, "data", name_p)
+    os.makedirs(sweep_path, exist_ok=True)
+    tasks = [(run, f"{name_p}_run{run:03d}", {**fixed, **point}, seed_p, sweep_path) for run, point in enumerate(points_p)]
+    with open(os.path.join(sweep_path, "sweep.json"), "w") as outfile:
+        json.dump({'name': name_p, 'seed': seed_p, 'runs': [{'run': run, 'name': name, 'settings': settings} for run, name, settings, _, _ in tasks]}, outfile, indent=4)
+
+    print(f"{Color.OKBLUE.value} == Sweep {name_p}: {len(tasks)} runs on {nb_workers} workers == {Color.ENDC.value}")
+    rows = []
+    # Every run is a subprocess: threads are enough to wait on them
+    with ThreadPoolExecutor(max_workers=nb_workers) as executor:
+        for future in as_completed([executor.submit(run_point, task) for task in tasks]):
+            row = future.result()
+            rows.append(row)
+            save_results(os.path.join(sweep_path, "results.csv"), rows)
+            print(f"Run {row['run']} ({row['name']}) {row['status']} in {row['duration_s']:.1f} seconds")
+    print(f"{Color.OKBLUE.value} == End of sweep {name_p}: {os.path.join(sweep_path, 'results.csv')} == {Color.ENDC.value}")
+    return sorted(rows, key=lambda row: row['run'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Parameter sweep over the Config fields", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-f", help="json file of the sweep (the other arguments override it)", type=str)
+    parser.add_argument("-n", help="Name of the sweep", type=str)
+    parser.add_argument("-p", help="Swept field and its values, FIELD=value,value... (json values, lists included)", action="append", default=[])
+    parser.add_argument("-set", help="Fixed field of every run, FIELD=value", action="append", default=[])
+    parser.add_argument("-mode", help="grid or random", type=str)
+    parser.add_argument("-samples", help="Number of runs of a random search", type=int)
+    parser.add_argument("-seed", help="Root seed of every run (and of the random search)", type=int)
+    parser.add_argument("-workers", help="Number of runs at once (default: number of CPU cores)", type=int)
+    arguments = vars(parser.parse_args())
+
+    sweep = {}
+    if arguments['f']:
+        with open(arguments['f']) as infile:
+            sweep = json.load(infile)
+    parameters = dict(sweep.get('parameters', {}))
+    for parameter in arguments['p']:
+        field, values = parameter.split("=", 1)
+        parameters[field] = parse_values(values)
+    fixed = dict(sweep.get('fixed', {}))
+    for setting in arguments['set']:
+        field, value = setting.split("=", 1)
+        fixed[field] = parse_value(value)
+    if not parameters:
+        parser.error("nothing to sweep (-f or -p)")
+
+    seed = arguments['seed'] if arguments['seed'] is not None else sweep.get('seed')
+    points = sweep_points(parameters, arguments['mode'] or sweep.get('mode', "grid"), arguments['samples'] or sweep.get('samples', 10), seed)
+    name = arguments['n'] or sweep.get('name') or "Sweep_" + time.strftime("%Y_%m_%d_%H_%M_%S")
+    run_sweep(name, points, fixed, seed, arguments['workers'] or sweep.get('workers'))
@@ -57,16 +57,20 @@ class Tools:
         """
         Takes a list of tuple in parameter and return a list of unique tuples irrespective of 
         their order.
+        Single pass: each tuple is compared through its sorted version in a set.
         """
         if tuple_list_p:
             unique_tuples = []
+            seen = set()
 
             for t in tuple_list_p:
                 if t==None:
                     continue
                 if not all(t):
                     continue
-                if sorted(t) not in [sorted(x) for x in unique_tuples]:
+                key = tuple(sorted(t))
+                if key not in seen:
+                    seen.add(key)
                     unique_tuples.append(t)
             return unique_tuples
         
@@ -79,10 +83,7 @@ class Tools:
         """
         Take a list as input and return the same list without duplicates or none elements
         """
-        list_pre = list(dict.fromkeys(list_p))
-        while None in list_pre:
-            list_pre.remove(None)
-        return list_pre
+        return [element for element in dict.fromkeys(list_p) if element is not None]
 
 
     @staticmethod